@@ -0,0 +1,211 @@
+import shlex
+import sys
+import time
+from typing import Dict, List, Any, Iterable, Optional, TextIO
+
+from firestore_client import firestore
+from firestore_manager import FirestoreManager, BatchWriter, USER_ROLES
+
+USAGE = {
+    'assign-role': 'assign-role <user_id> <student|cr|admin>',
+    'add-department': 'add-department <code> <name>',
+    'add-subclass': 'add-subclass <id> <name> <department> <year> [semester=N] [capacity=N]',
+    'add-subject': 'add-subject <code> <name> <department> <year> <semester> <credits> '
+                   '[shared-with=DEPT,DEPT] [description=TEXT]',
+}
+
+class CommandError(ValueError):
+    pass
+
+def _int(value: str, name: str) -> int:
+    if not value.isdigit():
+        raise CommandError(f"{name} must be a number, got '{value}'")
+    return int(value)
+
+def _split(line: str):
+    """Positional arguments and key=value options of a command line"""
+    positional, options = [], {}
+    for token in shlex.split(line, comments=True):
+        key, sep, value = token.partition('=')
+        if sep and positional:
+            options[key] = value
+        else:
+            positional.append(token)
+    return positional, options
+
+class CommandRunner:
+    """Runs admin commands through one client, coalescing writes into batches.
+
+    Every command is validated first and its writes queued on a single
+    BatchWriter. Role assignments are buffered so the target users can be
+    checked with one ``get_all`` per 500 IDs: unknown users are reported
+    instead of failing a whole batch, and users already holding the role
+    are skipped without a write.
+    """
+
+    def __init__(self, fm: FirestoreManager, dry_run: bool = False):
+        self.fm = fm
+        self.dry_run = dry_run
+        self.writer: Optional[BatchWriter] = None
+        self._roles: Dict[str, str] = {}
+        self._dept_subclasses: Dict[str, List[str]] = {}
+        self._departments: Optional[set] = None
+        self._subjects_added: List[Dict[str, Any]] = []
+        self.summary = {'commands': 0, 'queued': 0, 'unchanged': 0, 'errors': 0}
+        self.errors: List[str] = []
+
+    def _known_departments(self) -> set:
+        if self._departments is None:
+            self._departments = {dept['code'] for dept in self.fm.get_all_departments()}
+        return self._departments
+
+    def _require_department(self, code: str):
+        if code not in self._known_departments():
+            raise CommandError(f"unknown department '{code}'")
+
+    def _queue(self, count: int = 1):
+        self.summary['queued'] += count
+
+    def assign_role(self, args: List[str], options: Dict[str, str]):
+        user_id, role = args
+        if role not in USER_ROLES:
+            raise CommandError(f"role must be one of {', '.join(USER_ROLES)}")
+        self._roles[user_id] = role
+        if len(self._roles) >= BatchWriter.MAX_BATCH_SIZE:
+            self._apply_roles()
+
+    def add_department(self, args: List[str], options: Dict[str, str]):
+        code, name = args
+        self._known_departments().add(code)
+        if not self.dry_run:
+            self.fm.create_department({'code': code, 'name': name, 'subclasses': []}, writer=self.writer)
+        self._queue()
+
+    def add_subclass(self, args: List[str], options: Dict[str, str]):
+        subclass_id, name, department, year = args
+        self._require_department(department)
+        data = {'id': subclass_id, 'name': name, 'department': department, 'year': _int(year, 'year')}
+        for key in ('semester', 'capacity'):
+            if key in options:
+                data[key] = _int(options[key], key)
+        if not self.dry_run:
+            self.fm.create_subclass(data, writer=self.writer)
+        self._dept_subclasses.setdefault(department, []).append(subclass_id)
+        self._queue()
+
+    def add_subject(self, args: List[str], options: Dict[str, str]):
+        code, name, department, year, semester, credits = args
+        self._require_department(department)
+        shared_with = [dept for dept in options.get('shared-with', '').split(',') if dept]
+        for dept in shared_with:
+            self._require_department(dept)
+        data = {
+            'code': code, 'name': name, 'department': department,
+            'year': _int(year, 'year'), 'semester': _int(semester, 'semester'),
+            'credits': _int(credits, 'credits'), 'isShared': bool(shared_with),
+            'sharedWith': shared_with, 'description': options.get('description', ''),
+        }
+        if not self.dry_run:
+            self.fm.create_subject(data, writer=self.writer)
+        self._subjects_added.append(data)
+        self._queue()
+
+    HANDLERS = {
+        'assign-role': assign_role,
+        'add-department': add_department,
+        'add-subclass': add_subclass,
+        'add-subject': add_subject,
+    }
+
+    def _apply_roles(self):
+        """Queue buffered role changes for existing users whose role differs"""
+        pending, self._roles = self._roles, {}
+        if not pending:
+            return
+        users = self.fm.db.collection('users')
+        refs = [users.document(user_id) for user_id in pending]
+        for snapshot in self.fm.db.get_all(refs, field_paths=['role']):
+            role = pending.pop(snapshot.id)
+            if not snapshot.exists:
+                self._error(f"assign-role {snapshot.id}: user not found")
+            elif (snapshot.to_dict() or {}).get('role') == role:
+                self.summary['unchanged'] += 1
+            else:
+                if not self.dry_run:
+                    self.fm.assign_user_role(snapshot.id, role, writer=self.writer)
+                self._queue()
+        for user_id in pending:
+            self._error(f"assign-role {user_id}: user not found")
+
+    def _apply_department_lists(self):
+        for department, subclass_ids in self._dept_subclasses.items():
+            if not self.dry_run:
+                ref = self.fm.db.collection('departments').document(department)
+                self.writer.update(ref, {'subclasses': firestore.ArrayUnion(subclass_ids),
+                                         'updatedAt': firestore.SERVER_TIMESTAMP})
+            self._queue()
+        self._dept_subclasses = {}
+
+    def _error(self, message: str):
+        self.summary['errors'] += 1
+        self.errors.append(message)
+        print(f"❌ {message}")
+
+    def execute(self, line: str, line_number: int = 0):
+        """Validate one command line and queue its writes"""
+        args, options = _split(line)
+        if not args:
+            return
+        name, args = args[0], args[1:]
+        self.summary['commands'] += 1
+        handler = self.HANDLERS.get(name)
+        try:
+            if handler is None:
+                raise CommandError(f"unknown command (expected one of {', '.join(self.HANDLERS)})")
+            try:
+                handler(self, args, options)
+            except ValueError as e:
+                if isinstance(e, CommandError):
+                    raise
+                raise CommandError(f"usage: {USAGE[name]}")
+        except CommandError as e:
+            self._error(f"line {line_number}: {name}: {e}")
+
+    def run(self, lines: Iterable[str]) -> Dict[str, Any]:
+        """Execute every command, commit all writes and return the summary"""
+        started = time.monotonic()
+        self.writer = self.fm.bulk_writer() if not self.dry_run else None
+        try:
+            for line_number, line in enumerate(lines, 1):
+                self.execute(line, line_number)
+            self._apply_roles()
+            if self.writer is not None:
+                # Subclass documents must exist before departments list them
+                self.writer.flush()
+            self._apply_department_lists()
+        finally:
+            if self.writer is not None:
+                self.summary.update(self.writer.close())
+        if self._subjects_added and not self.dry_run:
+            self.fm.rebuild_subject_catalogs()
+        self.summary['seconds'] = round(time.monotonic() - started, 3)
+        return self.summary
+
+def print_batch_summary(summary: Dict[str, Any], dry_run: bool = False):
+    """Print what a command script did"""
+    print(f"\n📜 Batch commands{' (dry run)' if dry_run else ''}:")
+    print(f"   {summary['commands']} commands, {summary['queued']} writes queued, "
+          f"{summary['unchanged']} unchanged, {summary['errors']} errors "
+          f"in {summary['seconds']}s")
+    if summary.get('failed'):
+        print(f"   ⚠️ {summary['failed']} writes failed to commit")
+
+def run_script(fm: FirestoreManager, source: TextIO, dry_run: bool = False) -> Dict[str, Any]:
+    """Run the commands read from ``source`` (a script file or stdin)"""
+    summary = CommandRunner(fm, dry_run=dry_run).run(source)
+    print_batch_summary(summary, dry_run)
+    return summary
+
+def open_script(path: str) -> TextIO:
+    """The script at ``path``, or stdin for '-'"""
+    return sys.stdin if path == '-' else open(path, encoding='utf-8')
@@ -0,0 +1,354 @@
+import asyncio
+import random
+import sys
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Any, Optional, AsyncIterator, Awaitable, Iterable
+
+from firestore_client import DEFAULT_SERVICE_ACCOUNT, firestore, get_async_client
+from firestore_manager import (
+    DOWNLOAD_BASE_SHARD, DOWNLOAD_SHARD_COLLECTION, DOWNLOAD_SHARDS, STAT_BREAKDOWNS, STAT_COLLECTIONS,
+    BatchWriter, FirestoreManager, department_fields, subclass_fields, subject_fields
+)
+from search_index import SearchIndex
+
+async def gather_bounded(coros: Iterable[Awaitable], limit: int = 8) -> List[Any]:
+    """Like asyncio.gather, but with at most ``limit`` awaitables running at once"""
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(coro):
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+class AsyncFirestoreManager:
+    """FirestoreManager counterpart built on the async Firestore client.
+
+    Independent queries (one count per collection, the reference ID sets of
+    the integrity checks, batch commits) are issued concurrently, so a job
+    takes roughly as long as its slowest query instead of the sum of all.
+    """
+
+    def __init__(self, service_account_path: str = DEFAULT_SERVICE_ACCOUNT,
+                 concurrency: int = 8, max_retries: int = 5, backoff: float = 0.5):
+        """Set up the manager; the async connection is opened on first use"""
+        self.service_account_path = service_account_path
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._aggregation_supported = True
+        self._sum_supported = True
+        self._db = None
+        self._sync = None
+
+    @property
+    def db(self):
+        """The async Firestore client, connected (and shared process-wide) on first access"""
+        if self._db is None:
+            try:
+                self._db = get_async_client(self.service_account_path)
+                print("✅ Connected to Firestore (async) successfully")
+            except Exception as e:
+                print(f"❌ Failed to connect to Firestore: {e}")
+                sys.exit(1)
+        return self._db
+
+    @property
+    def sync_manager(self) -> FirestoreManager:
+        """Synchronous manager for the derived data (note index, search index, catalogs) it maintains"""
+        if self._sync is None:
+            self._sync = FirestoreManager(self.service_account_path)
+        return self._sync
+
+    async def _create(self, collection_name: str, doc_id: str, fields: Dict[str, Any], label: str) -> Optional[str]:
+        try:
+            await self.db.collection(collection_name).document(doc_id).set(
+                {**fields, 'createdAt': datetime.now(), 'updatedAt': firestore.SERVER_TIMESTAMP}
+            )
+            print(f"✅ Created {label}")
+            return doc_id
+        except Exception as e:
+            print(f"❌ Failed to create {label}: {e}")
+            return None
+
+    async def create_department(self, dept_data: Dict[str, Any]) -> Optional[str]:
+        """Create a new department"""
+        return await self._create('departments', dept_data['code'], department_fields(dept_data),
+                                  f"department: {dept_data['name']}")
+
+    async def create_subclass(self, subclass_data: Dict[str, Any]) -> Optional[str]:
+        """Create a new subclass"""
+        return await self._create('subclasses', subclass_data['id'], subclass_fields(subclass_data),
+                                  f"subclass: {subclass_data['name']}")
+
+    async def create_subject(self, subject_data: Dict[str, Any]) -> Optional[str]:
+        """Create a new subject"""
+        return await self._create('subjects', subject_data['code'], subject_fields(subject_data),
+                                  f"subject: {subject_data['name']} ({subject_data['code']})")
+
+    async def iter_collection(self, collection_name: str, filters: Optional[List[tuple]] = None,
+                              fields: Optional[List[str]] = None,
+                              page_size: int = 500) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a collection page by page (see FirestoreManager.iter_collection)"""
+        query = self.db.collection(collection_name)
+        for field, op, value in filters or []:
+            query = query.where(field, op, value)
+        if fields is not None:
+            query = query.select(fields)
+        query = query.order_by('__name__').limit(page_size)
+
+        last_doc = None
+        while True:
+            page = query.start_after(last_doc) if last_doc is not None else query
+            count = 0
+            async for doc in page.stream():
+                data = doc.to_dict() or {}
+                data['id'] = doc.id
+                yield data
+                last_doc = doc
+                count += 1
+            if count < page_size:
+                return
+
+    async def _collect(self, collection_name: str, department: Optional[str] = None) -> List[Dict[str, Any]]:
+        filters = [('department', '==', department)] if department else None
+        try:
+            return [doc async for doc in self.iter_collection(collection_name, filters)]
+        except Exception as e:
+            print(f"❌ Failed to get {collection_name}: {e}")
+            return []
+
+    async def get_all_departments(self) -> List[Dict[str, Any]]:
+        """Get all departments"""
+        return await self._collect('departments')
+
+    async def get_all_subclasses(self, department: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all subclasses, optionally filtered by department"""
+        return await self._collect('subclasses', department)
+
+    async def get_all_subjects(self, department: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Get all subjects, optionally filtered by department"""
+        return await self._collect('subjects', department)
+
+    async def count_documents(self, query) -> int:
+        """Count documents with an aggregation, falling back to streaming IDs only"""
+        if self._aggregation_supported:
+            try:
+                result = await query.count(alias='total').get()
+                return int(result[0][0].value)
+            except Exception as e:
+                print(f"⚠️ Count aggregation unavailable, streaming IDs instead: {e}")
+                self._aggregation_supported = False
+        return len([doc async for doc in query.select([]).stream()])
+
+    async def sum_field(self, query, field: str) -> int:
+        """Sum a numeric field with a sum aggregation, falling back to streaming only that field"""
+        if self._sum_supported:
+            try:
+                result = await query.sum(field, alias='total').get()
+                return int(result[0][0].value or 0)
+            except Exception as e:
+                print(f"⚠️ Sum aggregation unavailable, streaming '{field}' instead: {e}")
+                self._sum_supported = False
+        return sum([int((doc.to_dict() or {}).get(field) or 0) async for doc in query.select([field]).stream()])
+
+    async def _id_set(self, collection_name: str, keep=None, field: Optional[str] = None) -> set:
+        ids = set()
+        async for doc in self.iter_collection(collection_name, fields=[field] if field else []):
+            if keep is None or keep(doc):
+                ids.add(doc['id'])
+        return ids
+
+    async def get_statistics(self) -> Dict[str, int]:
+        """Get database statistics, counting all collections concurrently"""
+        try:
+            *counts, downloads = await gather_bounded(
+                [self.count_documents(self.db.collection(name)) for name in STAT_COLLECTIONS] +
+                [self.sum_field(self.db.collection('notes'), 'downloads')],
+                self.concurrency
+            )
+            stats = dict(zip(STAT_COLLECTIONS, counts))
+            stats['downloads'] = downloads
+            return stats
+        except Exception as e:
+            print(f"❌ Failed to get statistics: {e}")
+            return {}
+
+    async def count_by(self, collection_name: str, field: str, values: List[Any]) -> Dict[str, int]:
+        """Count documents per value of ``field`` (see FirestoreManager.count_by)"""
+        collection = self.db.collection(collection_name)
+        if self._aggregation_supported:
+            total, *counts = await gather_bounded(
+                [self.count_documents(collection)] +
+                [self.count_documents(collection.where(field, '==', value)) for value in values],
+                self.concurrency
+            )
+            breakdown = {str(value): count for value, count in zip(values, counts)}
+            breakdown['(other)'] = total - sum(counts)
+            return breakdown
+
+        tally = Counter()
+        known = set(values)
+        async for doc in collection.select([field]).stream():
+            value = (doc.to_dict() or {}).get(field)
+            tally[str(value) if value in known else '(other)'] += 1
+        breakdown = {str(value): tally.get(str(value), 0) for value in values}
+        breakdown['(other)'] = tally.get('(other)', 0)
+        return breakdown
+
+    async def get_breakdowns(self) -> Dict[str, Dict[str, int]]:
+        """Get per-field statistics with all breakdowns running concurrently"""
+        async def breakdown(collection_name, field, values):
+            if isinstance(values, str):
+                values = sorted(await self._id_set(values))
+            return await self.count_by(collection_name, field, values)
+
+        async def unapproved():
+            return {'unapproved': await self.count_documents(
+                self.db.collection('notes').where('approved', '==', False)
+            )}
+
+        try:
+            names = list(STAT_BREAKDOWNS) + ['notes_by_approval']
+            results = await asyncio.gather(
+                *(breakdown(*spec) for spec in STAT_BREAKDOWNS.values()), unapproved()
+            )
+            return dict(zip(names, results))
+        except Exception as e:
+            print(f"❌ Failed to get statistics breakdowns: {e}")
+            return {}
+
+    async def _commit_chunks(self, ops: List[tuple]) -> int:
+        """Commit ``ops`` in concurrent batches, retrying each with backoff (as BatchWriter does).
+
+        Returns the number of operations whose batch still failed.
+        """
+        async def commit(chunk):
+            for attempt in range(self.max_retries + 1):
+                try:
+                    batch = self.db.batch()
+                    for kind, ref, data in chunk:
+                        if kind == 'delete':
+                            batch.delete(ref)
+                        else:
+                            batch.update(ref, data)
+                    await batch.commit()
+                    return 0
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        print(f"❌ Batch of {len(chunk)} writes failed after {attempt + 1} attempts: {e}")
+                        return len(chunk)
+                    await asyncio.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+
+        size = BatchWriter.MAX_BATCH_SIZE
+        failed = await gather_bounded((commit(ops[i:i + size]) for i in range(0, len(ops), size)),
+                                      self.concurrency)
+        return sum(failed)
+
+    async def _refresh_derived_data(self, deleted_notes: Dict[str, Dict[str, Any]], deleted_subjects: set):
+        """Drop deleted notes and subjects from the indexes and rebuild catalogs if subjects went"""
+        fm = self.sync_manager
+        if deleted_notes and not await asyncio.to_thread(
+                fm.index_notes, {note_id: (doc, None) for note_id, doc in deleted_notes.items()}):
+            print("⚠️ Deleted notes were not fully unindexed; run --action index-notes and build-search-index")
+        if deleted_subjects:
+            await asyncio.to_thread(fm.rebuild_subject_catalogs)
+            await asyncio.to_thread(SearchIndex(fm).remove_subjects, deleted_subjects)
+
+    async def cleanup_orphaned_data(self, dry_run: bool = True, sample_size: int = 10) -> Dict[str, Dict[str, Any]]:
+        """Async integrity checks (see FirestoreManager.cleanup_orphaned_data).
+
+        The three reference ID sets load concurrently, then notes, users and
+        department lists are scanned concurrently against them. Fixes are
+        committed in 500-operation batches whenever enough have queued up,
+        each retried with backoff. Deleted notes take their download counter
+        shards with them; once every fix has committed, deleted notes and
+        subjects are removed from the visibility and search indexes and the
+        subject catalogs are rebuilt, as in the synchronous version.
+        """
+        report = {}
+        pending: List[tuple] = []
+        deleted_notes: Dict[str, Dict[str, Any]] = {}
+        deleted_subjects = set()
+        failed = 0
+        flush_at = BatchWriter.MAX_BATCH_SIZE * self.concurrency
+
+        async def scan(check, docs, is_broken, fix):
+            nonlocal failed
+            result = {'scanned': 0, 'found': 0, 'sample': []}
+            report[check] = result
+            async for doc in docs:
+                result['scanned'] += 1
+                if is_broken(doc):
+                    result['found'] += 1
+                    if len(result['sample']) < sample_size:
+                        result['sample'].append(doc['id'])
+                    if not dry_run:
+                        pending.extend(fix(doc))
+                        if len(pending) >= flush_at:
+                            chunk = pending[:]
+                            pending.clear()
+                            failed += await self._commit_chunks(chunk)
+
+        def ref(collection_name, doc):
+            return self.db.collection(collection_name).document(doc['id'])
+
+        def delete_note(doc):
+            deleted_notes[doc['id']] = doc
+            shards = self.db.collection('notes').document(doc['id']).collection(DOWNLOAD_SHARD_COLLECTION)
+            shard_ids = [DOWNLOAD_BASE_SHARD] + [str(i) for i in range(doc.get('downloadShards') or DOWNLOAD_SHARDS)]
+            return [('delete', ref('notes', doc), None)] + [('delete', shards.document(shard_id), None)
+                                                            for shard_id in shard_ids]
+
+        def delete_subject(doc):
+            deleted_subjects.add(doc.get('code') or doc['id'])
+            return [('delete', ref('subjects', doc), None)]
+
+        try:
+            departments = await self._id_set('departments')
+            in_department = lambda doc: doc.get('department') in departments
+            subclasses, subjects = await asyncio.gather(
+                self._id_set('subclasses', in_department, 'department'),
+                self._id_set('subjects', in_department, 'department'),
+            )
+
+            await asyncio.gather(
+                scan('orphaned_subclasses', self.iter_collection('subclasses', fields=['department']),
+                     lambda doc: not in_department(doc),
+                     lambda doc: [('delete', ref('subclasses', doc), None)]),
+                scan('orphaned_subjects', self.iter_collection('subjects', fields=['department', 'code']),
+                     lambda doc: not in_department(doc), delete_subject),
+                scan('orphaned_notes',
+                     self.iter_collection('notes', fields=['subclassId', 'subjectCode', 'isShared',
+                                                           'downloadShards']),
+                     lambda doc: doc.get('subjectCode') not in subjects or
+                                 (doc.get('subclassId') not in subclasses and not doc.get('isShared')),
+                     delete_note),
+                scan('users_with_unknown_subclass', self.iter_collection('users', fields=['subclass']),
+                     lambda doc: bool(doc.get('subclass')) and doc['subclass'] not in subclasses,
+                     lambda doc: [('update', ref('users', doc), {'subclass': firestore.DELETE_FIELD,
+                                                            'updatedAt': firestore.SERVER_TIMESTAMP})]),
+                scan('department_subclass_lists', self.iter_collection('departments', fields=['subclasses']),
+                     lambda doc: any(sub not in subclasses for sub in doc.get('subclasses') or []),
+                     lambda doc: [('update', ref('departments', doc), {
+                         'subclasses': [sub for sub in doc.get('subclasses') or [] if sub in subclasses],
+                         'updatedAt': firestore.SERVER_TIMESTAMP
+                     })]),
+            )
+            if pending:
+                failed += await self._commit_chunks(pending)
+            if failed:
+                print(f"❌ {failed} cleanup writes failed; re-run the cleanup, then --action index-notes "
+                      "and build-search-index")
+            elif not dry_run:
+                await self._refresh_derived_data(deleted_notes, deleted_subjects)
+        except Exception as e:
+            print(f"❌ Failed to cleanup: {e}")
+
+        print(f"\n🧹 Integrity report{' (dry run)' if dry_run else ''}:")
+        for check, result in report.items():
+            print(f"   {check}: {result['found']} of {result['scanned']}")
+            if result['sample']:
+                print(f"      e.g. {', '.join(result['sample'])}")
+        return report
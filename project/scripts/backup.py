@@ -0,0 +1,322 @@
+import json
+import os
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+try:
+    import msgpack
+except ImportError:  # JSON chunks are larger and slower to decode, but need nothing extra
+    msgpack = None
+
+from firestore_manager import FirestoreManager, DOWNLOAD_SHARD_COLLECTION
+from storage_backend import json_default, json_object_hook
+
+BACKUP_MAGIC = b'CCBACKUP1\n'
+INDEX_MAGIC = b'CCINDEX1'
+CHUNK_HEADER = struct.Struct('>I')
+FOOTER = struct.Struct('>Q8s')
+
+CHUNK_DOCS = 2000
+COMPRESSION_LEVEL = 6
+PAGE_SIZE = 1000
+
+# Subcollection groups included in backups, with the collection their parents live in
+BACKUP_SUBCOLLECTIONS = {DOWNLOAD_SHARD_COLLECTION: 'notes'}
+
+def _encode(rows: List[list], encoding: str) -> bytes:
+    if encoding == 'msgpack':
+        return msgpack.packb(rows, default=json_default, use_bin_type=True, datetime=False)
+    return json.dumps(rows, default=json_default, separators=(',', ':')).encode('utf-8')
+
+def _decode(payload: bytes, encoding: str) -> List[list]:
+    if encoding == 'msgpack':
+        if msgpack is None:
+            raise RuntimeError("this backup was written with msgpack; install it to read it (pip install msgpack)")
+        return msgpack.unpackb(payload, object_hook=json_object_hook, raw=False, strict_map_key=False)
+    return json.loads(payload.decode('utf-8'), object_hook=json_object_hook)
+
+def _iter_snapshots(query, page_size: int = PAGE_SIZE) -> Iterator[Any]:
+    """Every document of ``query`` in ID order, one page held in memory at a time"""
+    query = query.order_by('__name__').limit(page_size)
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc is not None else query
+        count = 0
+        for snapshot in page.stream():
+            yield snapshot
+            last_doc = snapshot
+            count += 1
+        if count < page_size:
+            return
+
+class DepartmentResolver:
+    """Department a document belongs to, used to tag backup chunks.
+
+    Departments are keyed by code; subclasses, subjects and users carry a
+    ``department`` field; notes and assignments inherit their subclass's
+    department and subcollection documents their parent's. Derived
+    collections (visibility and search indexes, ...) belong to none.
+    """
+
+    def __init__(self, fm: FirestoreManager):
+        self.subclasses = {doc['id']: doc.get('department') for doc in fm.iter_subclasses(fields=['department'])}
+        self.parents: Dict[str, Optional[str]] = {}
+
+    def department(self, collection_name: str, doc_id: str, data: Dict[str, Any]) -> Optional[str]:
+        if collection_name == 'departments':
+            return data.get('code') or doc_id
+        if data.get('department'):
+            return data['department']
+        if data.get('subclassId'):
+            return self.subclasses.get(data['subclassId'])
+        return None
+
+    def parent_department(self, doc_path: str) -> Optional[str]:
+        return self.parents.get(doc_path.rsplit('/', 2)[0])
+
+class BackupFile:
+    """Writer of the backup format.
+
+    A backup is ``BACKUP_MAGIC``, then chunks of up to ``CHUNK_DOCS``
+    documents, each a 4-byte big-endian length followed by a zlib stream of
+    ``[path, data]`` rows (msgpack, or JSON without it), then the index of
+    every chunk (zlib JSON) and a footer holding the index offset. Every
+    chunk holds one collection group and one department, so a partial
+    restore seeks straight to the chunks it needs.
+    """
+
+    def __init__(self, path: str, encoding: Optional[str] = None):
+        self.path = path
+        self.encoding = encoding or ('msgpack' if msgpack is not None else 'json')
+        self._tmp_path = path + '.tmp'
+        self._fp = open(self._tmp_path, 'wb')
+        self._fp.write(BACKUP_MAGIC)
+        self._lock = threading.Lock()
+        self.chunks: List[Dict[str, Any]] = []
+
+    def write_chunk(self, collection_name: str, department: Optional[str], rows: List[list],
+                    parent: Optional[str] = None):
+        """Compress and append one chunk (safe to call from several threads)"""
+        payload = zlib.compress(_encode(rows, self.encoding), COMPRESSION_LEVEL)
+        entry = {'collection': collection_name, 'department': department, 'count': len(rows),
+                 'first': rows[0][0], 'last': rows[-1][0], 'length': len(payload), 'crc32': zlib.crc32(payload)}
+        if parent:
+            entry['parent'] = parent
+        with self._lock:
+            entry['offset'] = self._fp.tell()
+            self._fp.write(CHUNK_HEADER.pack(len(payload)))
+            self._fp.write(payload)
+            self.chunks.append(entry)
+
+    def close(self, collections: Dict[str, int]) -> int:
+        """Write the index and footer, then move the file into place; returns its size"""
+        index = {'version': 1, 'encoding': self.encoding, 'compression': 'zlib', 'created_at': time.time(),
+                 'collections': collections,
+                 'chunks': sorted(self.chunks, key=lambda chunk: chunk['offset'])}
+        payload = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'), COMPRESSION_LEVEL)
+        offset = self._fp.tell()
+        self._fp.write(payload)
+        self._fp.write(FOOTER.pack(offset, INDEX_MAGIC))
+        self._fp.close()
+        os.replace(self._tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    def abort(self):
+        self._fp.close()
+        if os.path.exists(self._tmp_path):
+            os.remove(self._tmp_path)
+
+class BackupReader:
+    """Reads the index of a backup file and the chunks selected from it"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as fp:
+            if fp.read(len(BACKUP_MAGIC)) != BACKUP_MAGIC:
+                raise ValueError(f"{path} is not a backup file")
+            fp.seek(-FOOTER.size, os.SEEK_END)
+            end = fp.tell()
+            offset, magic = FOOTER.unpack(fp.read(FOOTER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{path} has no index (the export did not finish)")
+            fp.seek(offset)
+            self.index = json.loads(zlib.decompress(fp.read(end - offset)).decode('utf-8'))
+        self.encoding = self.index['encoding']
+
+    def select(self, collections: Optional[List[str]] = None,
+               department: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Index entries of the chunks a restore needs.
+
+        Naming a collection also selects its subcollection groups (``notes``
+        brings the notes' download counter shards).
+        """
+        return [chunk for chunk in self.index['chunks']
+                if (not collections or chunk['collection'] in collections or chunk.get('parent') in collections)
+                and (department is None or chunk['department'] == department)]
+
+    def read_chunk(self, chunk: Dict[str, Any], fp=None) -> List[list]:
+        """The ``[path, data]`` rows of one chunk, checked against the index"""
+        if fp is None:
+            with open(self.path, 'rb') as fp:
+                return self.read_chunk(chunk, fp)
+        fp.seek(chunk['offset'])
+        (length,) = CHUNK_HEADER.unpack(fp.read(CHUNK_HEADER.size))
+        payload = fp.read(length)
+        if length != chunk['length'] or zlib.crc32(payload) != chunk['crc32']:
+            raise ValueError(f"chunk at offset {chunk['offset']} of {self.path} is corrupt")
+        return _decode(zlib.decompress(payload), self.encoding)
+
+    def iter_documents(self, chunks: Optional[List[Dict[str, Any]]] = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """``(document path, data)`` of the given chunks (default: all), in file order"""
+        with open(self.path, 'rb') as fp:
+            for chunk in chunks if chunks is not None else self.index['chunks']:
+                for path, data in self.read_chunk(chunk, fp):
+                    yield path, data
+
+class CampusBackup:
+    """Streams every collection into a backup file and restores from one.
+
+    Collections are exported concurrently, each paged by document ID and
+    buffered per department until a chunk is full; compression runs on the
+    worker threads, only the file append is serialized. Subcollection
+    groups follow once their parents' departments are known. Restores
+    decode the selected chunks concurrently per collection and write them
+    through a BatchWriter each.
+    """
+
+    def __init__(self, fm: FirestoreManager, max_workers: int = 8):
+        self.fm = fm
+        self.max_workers = max_workers
+
+    def export(self, path: str, collections: Optional[List[str]] = None,
+               encoding: Optional[str] = None) -> Dict[str, Any]:
+        started = time.monotonic()
+        names = collections or [collection.id for collection in self.fm.db.collections()]
+        resolver = DepartmentResolver(self.fm)
+        backup = BackupFile(path, encoding)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                counts = dict(zip(names, pool.map(lambda name: self._export_collection(backup, resolver, name),
+                                                  names)))
+                groups = [group for group, parent in BACKUP_SUBCOLLECTIONS.items() if parent in names]
+                counts.update(zip(groups, pool.map(lambda group: self._export_group(backup, resolver, group),
+                                                   groups)))
+            size = backup.close(counts)
+        except BaseException:
+            backup.abort()
+            raise
+        return {'documents': sum(counts.values()), 'collections': counts, 'chunks': len(backup.chunks),
+                'bytes': size, 'encoding': backup.encoding, 'seconds': round(time.monotonic() - started, 3)}
+
+    def _flush(self, backup: BackupFile, buffers: Dict[Optional[str], List[list]], collection_name: str,
+               department: Optional[str], parent: Optional[str] = None):
+        rows = buffers.pop(department, None)
+        if rows:
+            backup.write_chunk(collection_name, department, rows, parent)
+
+    def _export_collection(self, backup: BackupFile, resolver: DepartmentResolver, name: str) -> int:
+        buffers: Dict[Optional[str], List[list]] = {}
+        record_parents = name in BACKUP_SUBCOLLECTIONS.values()
+        count = 0
+        for snapshot in _iter_snapshots(self.fm.db.collection(name)):
+            data = snapshot.to_dict() or {}
+            department = resolver.department(name, snapshot.id, data)
+            if record_parents:
+                resolver.parents[f"{name}/{snapshot.id}"] = department
+            rows = buffers.setdefault(department, [])
+            rows.append([f"{name}/{snapshot.id}", data])
+            count += 1
+            if len(rows) >= CHUNK_DOCS:
+                self._flush(backup, buffers, name, department)
+        for department in list(buffers):
+            self._flush(backup, buffers, name, department)
+        return count
+
+    def _export_group(self, backup: BackupFile, resolver: DepartmentResolver, group: str) -> int:
+        buffers: Dict[Optional[str], List[list]] = {}
+        parent = BACKUP_SUBCOLLECTIONS[group]
+        count = 0
+        for snapshot in _iter_snapshots(self.fm.db.collection_group(group)):
+            doc_path = snapshot.reference.path
+            department = resolver.parent_department(doc_path)
+            rows = buffers.setdefault(department, [])
+            rows.append([doc_path, snapshot.to_dict() or {}])
+            count += 1
+            if len(rows) >= CHUNK_DOCS:
+                self._flush(backup, buffers, group, department, parent)
+        for department in list(buffers):
+            self._flush(backup, buffers, group, department, parent)
+        return count
+
+    def restore(self, path: str, collections: Optional[List[str]] = None, department: Optional[str] = None,
+                dry_run: bool = False) -> Dict[str, Any]:
+        started = time.monotonic()
+        reader = BackupReader(path)
+        chunks = reader.select(collections, department)
+        by_collection: Dict[str, List[Dict[str, Any]]] = {}
+        for chunk in chunks:
+            by_collection.setdefault(chunk['collection'], []).append(chunk)
+        planned = {name: sum(chunk['count'] for chunk in group) for name, group in by_collection.items()}
+        report = {'documents': sum(planned.values()), 'collections': planned, 'chunks': len(chunks),
+                  'chunks_total': len(reader.index['chunks']),
+                  'bytes_read': sum(chunk['length'] for chunk in chunks), 'dry_run': dry_run}
+        if not dry_run:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                stats = list(pool.map(lambda group: self._restore_chunks(reader, group), by_collection.values()))
+            report['writes'] = {key: sum(stat[key] for stat in stats)
+                                for key in ('operations', 'batches', 'retries', 'failed')}
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+    def _restore_chunks(self, reader: BackupReader, chunks: List[Dict[str, Any]]) -> Dict[str, int]:
+        # BatchWriter queues are not shared between threads, so each collection gets its own
+        writer = self.fm.bulk_writer(max_workers=2)
+        with writer:
+            for path, data in reader.iter_documents(chunks):
+                writer.set(self.fm.db.document(path), data)
+        return writer.stats
+
+def print_backup_report(report: Dict[str, Any], path: str, restore: bool = False):
+    """Print the outcome of a backup export or restore"""
+    if restore:
+        verb = 'Would restore' if report['dry_run'] else 'Restored'
+        print(f"\n📦 {verb} {report['documents']} documents from {path}: {report['chunks']} of "
+              f"{report['chunks_total']} chunks, {report['bytes_read'] / 1024:.0f} KiB read in {report['seconds']}s")
+    else:
+        print(f"\n📦 Backed up {report['documents']} documents to {path}: {report['chunks']} chunks, "
+              f"{report['bytes'] / 1024:.0f} KiB ({report['encoding']}) in {report['seconds']}s")
+    for name, count in sorted(report['collections'].items()):
+        print(f"   {name}: {count}")
+    failed = report.get('writes', {}).get('failed')
+    if failed:
+        print(f"   ❌ {failed} writes failed; re-running the restore rewrites every selected document")
+
+def backup_campus(fm: FirestoreManager, path: str, collections: Optional[List[str]] = None,
+                  max_workers: int = 8) -> Optional[Dict[str, Any]]:
+    """Export collections (default: all) to a backup file and print the report"""
+    try:
+        report = CampusBackup(fm, max_workers=max_workers).export(path, collections)
+    except Exception as e:
+        print(f"❌ Backup failed: {e}")
+        return None
+    print_backup_report(report, path)
+    return report
+
+def restore_campus(fm: FirestoreManager, path: str, collections: Optional[List[str]] = None,
+                   department: Optional[str] = None, dry_run: bool = False,
+                   max_workers: int = 8) -> Optional[Dict[str, Any]]:
+    """Restore a backup (or the chunks of some collections/one department) and print the report"""
+    try:
+        report = CampusBackup(fm, max_workers=max_workers).restore(path, collections, department, dry_run)
+    except Exception as e:
+        print(f"❌ Restore failed: {e}")
+        return None
+    print_backup_report(report, path, restore=True)
+    if department and not dry_run:
+        print("   ⚠️ Derived collections are not restored per department; "
+              "run --action index-notes and build-search-index")
+    return report
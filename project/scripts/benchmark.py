@@ -0,0 +1,324 @@
+"""Benchmarks FirestoreManager operations against the Firestore emulator.
+
+Usage (from the project directory, with the emulator running):
+
+    firebase emulators:start --only firestore
+    export FIRESTORE_EMULATOR_HOST=localhost:8080
+    python scripts/benchmark.py --scale 10k --output bench/10k.json
+    python scripts/benchmark.py --scale 10k --baseline bench/10k.json
+    python scripts/benchmark.py --startup      # no emulator needed
+
+Each operation runs in a fresh child process so its peak RSS is measured
+in isolation. Reads and writes are counted with instrumentation.Profiler.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Any, Optional
+
+DEFAULT_PROJECT = 'demo-campus-bench'
+
+# Synthetic campus sizes, keyed by number of notes
+SCALES = {
+    '1k': {'departments': 5, 'subclasses_per_department': 4, 'subjects_per_department': 20,
+           'users': 300, 'notes': 1000, 'assignments': 100},
+    '10k': {'departments': 10, 'subclasses_per_department': 6, 'subjects_per_department': 40,
+            'users': 3000, 'notes': 10000, 'assignments': 1000},
+    '100k': {'departments': 20, 'subclasses_per_department': 8, 'subjects_per_department': 60,
+             'users': 20000, 'notes': 100000, 'assignments': 10000},
+    '1m': {'departments': 40, 'subclasses_per_department': 10, 'subjects_per_department': 80,
+           'users': 100000, 'notes': 1000000, 'assignments': 100000},
+}
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds a CLI may take to start before --startup fails
+STARTUP_BUDGET_SECONDS = 0.5
+
+# Startup checks: interpreter arguments run from the project directory.
+# The import check exits non-zero if firebase_admin was imported eagerly.
+STARTUP_COMMANDS = {
+    'firestore_manager --help': [os.path.join(SCRIPTS_DIR, 'firestore_manager.py'), '--help'],
+    'check_notes --help': [os.path.join(SCRIPTS_DIR, 'check_notes.py'), '--help'],
+    'import firestore_manager': ['-c', "import sys, firestore_manager, catalog_importer, firestore_sync; "
+                                       "sys.exit('firebase_admin' in sys.modules)"],
+}
+
+# Metrics compared against a baseline, and whether lower is better
+COMPARED_METRICS = ['seconds', 'reads', 'writes', 'peak_rss_mb']
+
+def emulator_client(project: str):
+    """Firestore client for the emulator named by FIRESTORE_EMULATOR_HOST"""
+    if not os.environ.get('FIRESTORE_EMULATOR_HOST'):
+        raise SystemExit("❌ FIRESTORE_EMULATOR_HOST is not set; start the Firestore emulator first")
+    from google.cloud import firestore as cloud_firestore
+    return cloud_firestore.Client(project=project)
+
+def reset_emulator(project: str):
+    """Delete every document in the emulator project"""
+    import urllib.request
+    host = os.environ['FIRESTORE_EMULATOR_HOST']
+    request = urllib.request.Request(
+        f"http://{host}/emulator/v1/projects/{project}/databases/(default)/documents",
+        method='DELETE'
+    )
+    urllib.request.urlopen(request).read()
+
+def generate_campus(fm, scale: Dict[str, int], seed: int = 42) -> Dict[str, int]:
+    """Write a synthetic campus through BatchWriter and return document counts"""
+    rng = random.Random(seed)
+    roles = ['student'] * 18 + ['cr', 'admin']
+    departments = [f"D{i:02d}" for i in range(scale['departments'])]
+    subclasses: Dict[str, List[str]] = {}
+    subjects: List[str] = []
+    now = datetime.now()
+
+    with fm.bulk_writer(max_workers=8) as writer:
+        for dept in departments:
+            subclasses[dept] = [f"{dept}-S{j}" for j in range(scale['subclasses_per_department'])]
+            fm.create_department({'code': dept, 'name': f"Department {dept}",
+                                  'subclasses': subclasses[dept]}, writer)
+            for j, subclass_id in enumerate(subclasses[dept]):
+                fm.create_subclass({'id': subclass_id, 'name': subclass_id, 'department': dept,
+                                    'year': j % 4 + 1}, writer)
+            for k in range(scale['subjects_per_department']):
+                code = f"{dept}{k:03d}"
+                subjects.append(code)
+                shared = k % 10 == 0
+                fm.create_subject({
+                    'code': code, 'name': f"Subject {code}", 'department': dept,
+                    'year': k % 4 + 1, 'semester': k % 8 + 1, 'credits': 3 + k % 2,
+                    'isShared': shared,
+                    'sharedWith': rng.sample(departments, min(3, len(departments))) if shared else []
+                }, writer)
+
+        all_subclasses = [sub for subs in subclasses.values() for sub in subs]
+        users = fm.db.collection('users')
+        for i in range(scale['users']):
+            dept = rng.choice(departments)
+            writer.set(users.document(f"user{i:07d}"), {
+                'id': f"user{i:07d}", 'name': f"User {i}", 'email': f"user{i}@campus.test",
+                'role': rng.choice(roles), 'department': dept,
+                'subclass': rng.choice(subclasses[dept]), 'createdAt': now
+            })
+
+        notes = fm.db.collection('notes')
+        tags = ['exam', 'lab', 'unit-1', 'unit-2', 'assignment', 'summary', 'formula']
+        for i in range(scale['notes']):
+            writer.set(notes.document(f"note{i:08d}"), {
+                'title': f"Note {i}", 'description': f"Synthetic note {i} for benchmarking",
+                'subjectCode': rng.choice(subjects), 'subclassId': rng.choice(all_subclasses),
+                'fileUrl': f"https://drive.google.com/file/d/file{i}/view", 'fileName': f"note{i}.pdf",
+                'fileSize': rng.randint(10_000, 5_000_000), 'uploadedBy': f"user{rng.randrange(scale['users']):07d}",
+                'uploaderName': 'Bench', 'isShared': rng.random() < 0.2,
+                'tags': rng.sample(tags, 2), 'downloads': rng.randint(0, 500),
+                'approved': rng.random() < 0.9, 'driveFileId': f"file{i}",
+                'createdAt': now - timedelta(minutes=i)
+            })
+
+        assignments = fm.db.collection('assignments')
+        for i in range(scale['assignments']):
+            writer.set(assignments.document(f"assignment{i:07d}"), {
+                'title': f"Assignment {i}", 'subjectCode': rng.choice(subjects),
+                'subclassId': rng.choice(all_subclasses), 'status': 'pending',
+                'dueDate': now + timedelta(days=i % 30), 'createdAt': now
+            })
+
+    return {
+        'departments': len(departments), 'subclasses': len(all_subclasses), 'subjects': len(subjects),
+        'users': scale['users'], 'notes': scale['notes'], 'assignments': scale['assignments'],
+    }
+
+def _op_check_notes(fm):
+    import check_notes
+    check_notes.check_firestore_data(db=fm.db)
+
+# Operation name -> callable taking a FirestoreManager
+OPERATIONS = {
+    'get_statistics': lambda fm: fm.get_statistics(),
+    'get_breakdowns': lambda fm: fm.get_breakdowns(),
+    'get_all_departments': lambda fm: fm.get_all_departments(),
+    'get_all_subjects': lambda fm: fm.get_all_subjects(),
+    'cleanup_orphaned_data': lambda fm: fm.cleanup_orphaned_data(dry_run=True),
+    'rebuild_subject_catalogs': lambda fm: fm.rebuild_subject_catalogs(),
+    'rebuild_note_index': lambda fm: fm.rebuild_note_index(),
+    'check_notes': _op_check_notes,
+}
+
+def _current_rss_mb() -> float:
+    with open('/proc/self/statm') as fp:
+        return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / 1024
+
+def _run_operation(name: str, project: str, queue):
+    """Child process entry point: run one operation and report its metrics"""
+    import contextlib
+    import io
+    from firestore_manager import FirestoreManager
+    from instrumentation import Profiler
+
+    profiler = Profiler()
+    fm = FirestoreManager(db=emulator_client(project), profiler=profiler)
+    baseline_rss = _current_rss_mb() if os.path.exists('/proc/self/statm') else 0.0
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), profiler.command(name):
+        OPERATIONS[name](fm)
+    elapsed = time.perf_counter() - started
+    totals = profiler.totals(name)
+    queue.put({
+        'seconds': round(elapsed, 4),
+        'reads': totals['reads'],
+        'writes': totals['writes'],
+        'bytes_read': totals['bytes_read'],
+        'bytes_written': totals['bytes_written'],
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+        'baseline_rss_mb': round(baseline_rss, 1),
+    })
+
+def measure(name: str, project: str, repeat: int = 1) -> Dict[str, Any]:
+    """Run an operation ``repeat`` times in child processes; report medians"""
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        queue = context.Queue()
+        child = context.Process(target=_run_operation, args=(name, project, queue))
+        child.start()
+        child.join()
+        if child.exitcode != 0:
+            raise RuntimeError(f"{name} failed in child process (exit code {child.exitcode})")
+        runs.append(queue.get())
+    return {metric: statistics.median(run[metric] for run in runs) for metric in runs[0]}
+
+def measure_startup(repeat: int = 5) -> Dict[str, Dict[str, Any]]:
+    """Median wall time of each STARTUP_COMMANDS entry in a fresh interpreter"""
+    env = {**os.environ, 'PYTHONPATH': os.pathsep.join(filter(None, [SCRIPTS_DIR, os.environ.get('PYTHONPATH')]))}
+    results = {}
+    for name, command in STARTUP_COMMANDS.items():
+        timings, ok = [], True
+        for _ in range(repeat):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, *command], env=env,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            timings.append(time.perf_counter() - started)
+            ok = ok and completed.returncode == 0
+        results[name] = {'seconds': round(statistics.median(timings), 4), 'ok': ok}
+    return results
+
+def check_startup(repeat: int, budget: float) -> bool:
+    """Print startup times and report whether all are within ``budget``"""
+    print(f"🚀 Startup (median of {repeat}, budget {budget}s):")
+    within = True
+    for name, result in measure_startup(repeat).items():
+        over = result['seconds'] > budget or not result['ok']
+        within = within and not over
+        status = '❌' if over else '✅'
+        note = '' if result['ok'] else ' (failed or imported firebase_admin eagerly)'
+        print(f"   {status} {name}: {result['seconds']}s{note}")
+    return within
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+            threshold: float) -> List[str]:
+    """List metrics that grew by more than ``threshold`` (a fraction) over the baseline"""
+    regressions = []
+    for name, metrics in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        for metric in COMPARED_METRICS:
+            old, new = previous.get(metric), metrics.get(metric)
+            if old is None or new is None:
+                continue
+            # Ignore noise on tiny values (a few ms, a handful of reads)
+            floor = {'seconds': 0.05, 'peak_rss_mb': 5}.get(metric, 1)
+            if new > max(old, floor) * (1 + threshold):
+                regressions.append(f"{name}.{metric}: {old} -> {new}")
+    return regressions
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark FirestoreManager against the emulator')
+    parser.add_argument('--scale', choices=list(SCALES), default='1k', help='Synthetic campus size')
+    parser.add_argument('--project', default=DEFAULT_PROJECT, help='Emulator project ID')
+    parser.add_argument('--operations', nargs='+', choices=list(OPERATIONS), default=list(OPERATIONS),
+                        help='Operations to measure')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per operation (median is kept)')
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse data already in the emulator')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--baseline', help='Earlier results JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed growth over the baseline before failing (0.2 = 20%%)')
+    parser.add_argument('--startup', action='store_true',
+                        help='Only check CLI startup times against --startup-budget')
+    parser.add_argument('--startup-budget', type=float, default=STARTUP_BUDGET_SECONDS,
+                        help='Seconds each CLI may take to start')
+    args = parser.parse_args()
+
+    if args.startup:
+        sys.exit(0 if check_startup(args.repeat, args.startup_budget) else 1)
+
+    from firestore_manager import FirestoreManager
+    from instrumentation import Profiler
+    report: Dict[str, Any] = {
+        'scale': args.scale, 'revision': _git_revision(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'), 'results': {},
+    }
+
+    if not args.skip_seed:
+        reset_emulator(args.project)
+        profiler = Profiler()
+        fm = FirestoreManager(db=emulator_client(args.project), profiler=profiler)
+        print(f"🌱 Seeding {args.scale} campus...")
+        started = time.perf_counter()
+        with profiler.command('seed'):
+            report['campus'] = generate_campus(fm, SCALES[args.scale])
+        totals = profiler.totals('seed')
+        report['results']['seed'] = {'seconds': round(time.perf_counter() - started, 4),
+                                     'reads': totals['reads'], 'writes': totals['writes']}
+
+    for name in args.operations:
+        print(f"⏱️  {name}...")
+        report['results'][name] = measure(name, args.project, args.repeat)
+
+    print(f"\n📈 Results ({args.scale}):")
+    for name, metrics in report['results'].items():
+        rss = f", {metrics['peak_rss_mb']} MB peak" if 'peak_rss_mb' in metrics else ''
+        print(f"   {name}: {metrics['seconds']}s, {metrics['reads']} reads, "
+              f"{metrics['writes']} writes{rss}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=2)
+        print(f"\n💾 Saved results to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as fp:
+            baseline = json.load(fp)
+        regressions = compare(report['results'], baseline.get('results', {}), args.threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) over {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            sys.exit(1)
+        print(f"\n✅ No regressions over {args.threshold:.0%} against {args.baseline}")
+
+if __name__ == "__main__":
+    main()
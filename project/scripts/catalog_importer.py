@@ -0,0 +1,331 @@
+import csv
+import hashlib
+import json
+import os
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+from firestore_client import firestore
+from firestore_manager import (
+    FirestoreManager, department_fields, subclass_fields, subject_fields
+)
+
+# Collections in the order they are applied
+CATALOG_COLLECTIONS = ['departments', 'subclasses', 'subjects', 'users']
+
+# Accepted values of a record's "type"/"collection" key
+RECORD_TYPES = {
+    'department': 'departments', 'departments': 'departments',
+    'subclass': 'subclasses', 'subclasses': 'subclasses',
+    'subject': 'subjects', 'subjects': 'subjects',
+    'user': 'users', 'users': 'users',
+}
+
+HASH_FIELD = 'importHash'
+INT_FIELDS = {'year', 'semester', 'credits', 'capacity'}
+LIST_FIELDS = {'subclasses', 'sharedWith'}
+BOOL_FIELDS = {'isShared'}
+
+def user_fields(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored fields of a user profile managed by the catalog"""
+    fields = {
+        'id': user_data['id'],
+        'name': user_data['name'],
+        'email': user_data['email'],
+        'department': user_data['department'],
+    }
+    # Only a row with a role sets one; merging a default would demote admins and CRs
+    if user_data.get('role'):
+        fields['role'] = user_data['role']
+    if user_data.get('subclass'):
+        fields['subclass'] = user_data['subclass']
+    return fields
+
+DOCUMENT_BUILDERS = {
+    'departments': (department_fields, 'code'),
+    'subclasses': (subclass_fields, 'id'),
+    'subjects': (subject_fields, 'code'),
+    'users': (user_fields, 'id'),
+}
+
+def content_hash(fields: Dict[str, Any]) -> str:
+    """Stable hash of a document's catalog-managed fields"""
+    payload = json.dumps(fields, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def _coerce(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Convert CSV strings into the types the documents use"""
+    for key, value in list(record.items()):
+        if not isinstance(value, str):
+            continue
+        value = value.strip()
+        if key in INT_FIELDS:
+            record[key] = int(value) if value else None
+        elif key in BOOL_FIELDS:
+            record[key] = value.lower() in ('1', 'true', 'yes', 'y')
+        elif key in LIST_FIELDS:
+            record[key] = [item.strip() for item in value.replace('|', ';').split(';') if item.strip()]
+        else:
+            record[key] = value
+    return {key: value for key, value in record.items() if value is not None and value != ''}
+
+def _record_collection(record: Dict[str, Any], default: Optional[str] = None) -> Optional[str]:
+    kind = record.pop('collection', None) or record.pop('type', None) or default
+    return RECORD_TYPES.get(str(kind).lower()) if kind else None
+
+class _JsonStream:
+    """Incremental reader that decodes one JSON value at a time from a file.
+
+    Only the value currently being decoded is held in memory, so catalogs
+    with hundreds of thousands of records can be read in constant space.
+    """
+
+    def __init__(self, fp, chunk_size: int = 1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.fp.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Return the next non-whitespace character without consuming it"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at offset {self.pos} in catalog")
+        self.pos += 1
+
+    def value(self) -> Any:
+        """Decode the next complete JSON value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof or not isinstance(value, (int, float)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def array_items(self) -> Iterator[Any]:
+        """Yield the elements of the array starting at the current position"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"Malformed array in catalog near offset {self.pos}")
+
+def iter_json_records(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream (collection, record) pairs from a JSON catalog.
+
+    Accepts either ``{"departments": [...], "subjects": [...], ...}`` or a
+    top-level array of records carrying a ``type``/``collection`` key.
+    """
+    with open(path, encoding='utf-8') as fp:
+        stream = _JsonStream(fp)
+        if stream.peek() == '[':
+            for record in stream.array_items():
+                collection = _record_collection(record)
+                if collection:
+                    yield collection, record
+            return
+
+        stream.expect('{')
+        while stream.peek() != '}':
+            key = stream.value()
+            stream.expect(':')
+            collection = RECORD_TYPES.get(str(key).lower())
+            if collection and stream.peek() == '[':
+                for record in stream.array_items():
+                    yield collection, record
+            else:
+                stream.value()
+            if stream.peek() == ',':
+                stream.pos += 1
+        stream.expect('}')
+
+def iter_jsonl_records(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream (collection, record) pairs from a JSON Lines catalog"""
+    default = RECORD_TYPES.get(os.path.splitext(os.path.basename(path))[0].lower())
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            if line.strip():
+                record = json.loads(line)
+                collection = _record_collection(record, default)
+                if collection:
+                    yield collection, record
+
+def iter_csv_records(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream (collection, record) pairs from a CSV catalog.
+
+    The collection comes from a ``type``/``collection`` column or, failing
+    that, from the file name (e.g. ``subjects.csv``). List columns such as
+    ``sharedWith`` are separated with ``;`` or ``|``.
+    """
+    default = RECORD_TYPES.get(os.path.splitext(os.path.basename(path))[0].lower())
+    with open(path, newline='', encoding='utf-8') as fp:
+        for row in csv.DictReader(fp):
+            collection = _record_collection(row, default)
+            if collection:
+                yield collection, _coerce(row)
+
+READERS = {
+    '.json': iter_json_records,
+    '.jsonl': iter_jsonl_records,
+    '.ndjson': iter_jsonl_records,
+    '.csv': iter_csv_records,
+}
+
+def iter_catalog(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Stream records from a catalog file or a directory of catalog files"""
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in os.listdir(path)
+                 if os.path.splitext(name)[1].lower() in READERS]
+
+        def order(file_path):
+            stem = os.path.splitext(os.path.basename(file_path))[0].lower()
+            collection = RECORD_TYPES.get(stem)
+            rank = CATALOG_COLLECTIONS.index(collection) if collection else len(CATALOG_COLLECTIONS)
+            return rank, file_path
+
+        for file_path in sorted(files, key=order):
+            yield from iter_catalog(file_path)
+        return
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f"Unsupported catalog format: {extension}")
+    yield from READERS[extension](path)
+
+class CatalogImporter:
+    """Imports a catalog, writing only documents whose content changed.
+
+    Each written document stores a hash of its catalog-managed fields in
+    ``importHash``. Existing hashes are read with a single-field projection,
+    so an unchanged catalog costs one small read per document and no writes.
+    """
+
+    def __init__(self, fm: FirestoreManager, dry_run: bool = False):
+        self.fm = fm
+        self.dry_run = dry_run
+        self._existing: Dict[str, Dict[str, str]] = {}
+        self.report = {name: {'seen': 0, 'created': 0, 'updated': 0, 'unchanged': 0, 'invalid': 0}
+                       for name in CATALOG_COLLECTIONS}
+
+    def _existing_hashes(self, collection_name: str) -> Dict[str, str]:
+        if collection_name not in self._existing:
+            hashes = {}
+            for doc in self.fm.iter_collection(collection_name, fields=[HASH_FIELD]):
+                hashes[doc['id']] = doc.get(HASH_FIELD, '')
+            self._existing[collection_name] = hashes
+        return self._existing[collection_name]
+
+    def _apply(self, collection_name: str, record: Dict[str, Any], writer) -> None:
+        counts = self.report[collection_name]
+        counts['seen'] += 1
+        build, id_key = DOCUMENT_BUILDERS[collection_name]
+        try:
+            fields = build(record)
+            doc_id = str(record[id_key])
+        except (KeyError, TypeError) as e:
+            counts['invalid'] += 1
+            print(f"⚠️ Skipping invalid {collection_name} record (missing {e}): {record}")
+            return
+
+        digest = content_hash(fields)
+        existing = self._existing_hashes(collection_name)
+        previous = existing.get(doc_id)
+        if previous == digest:
+            counts['unchanged'] += 1
+            return
+
+        counts['created' if previous is None else 'updated'] += 1
+        existing[doc_id] = digest
+        if self.dry_run:
+            return
+
+        fields[HASH_FIELD] = digest
+        fields['updatedAt'] = firestore.SERVER_TIMESTAMP
+        ref = self.fm.db.collection(collection_name).document(doc_id)
+        if previous is None and collection_name != 'users':
+            fields['createdAt'] = datetime.now()
+            writer.set(ref, fields)
+        elif previous is None:
+            # A new user without a role column starts as a student
+            fields.setdefault('role', 'student')
+            writer.set(ref, fields, merge=True)
+        else:
+            # Merge so createdAt and fields written by the app are preserved
+            writer.set(ref, fields, merge=True)
+
+    def run(self, path: str) -> Dict[str, Dict[str, int]]:
+        """Import the catalog at ``path`` and return per-collection counts"""
+        writer = self.fm.bulk_writer()
+        # Departments are few; hold them back so their subclass lists can be
+        # derived from the subclass records that follow them in the file.
+        departments: List[Dict[str, Any]] = []
+        dept_subclasses: Dict[str, List[str]] = {}
+        try:
+            for collection_name, record in iter_catalog(path):
+                if collection_name == 'departments':
+                    departments.append(record)
+                    continue
+                if collection_name == 'subclasses' and 'id' in record and 'department' in record:
+                    dept_subclasses.setdefault(record['department'], []).append(record['id'])
+                self._apply(collection_name, record, writer)
+
+            for dept in departments:
+                if 'subclasses' not in dept and 'code' in dept:
+                    dept = {**dept, 'subclasses': sorted(dept_subclasses.get(dept['code'], []))}
+                self._apply('departments', dept, writer)
+        finally:
+            writer.close()
+            self.fm.cache.invalidate()
+        subjects = self.report['subjects']
+        if not self.dry_run and (subjects['created'] or subjects['updated']):
+            self.fm.rebuild_subject_catalogs()
+        return self.report
+
+def print_import_report(report: Dict[str, Dict[str, int]], dry_run: bool = False):
+    """Print per-collection import counts"""
+    print(f"\n📥 Catalog import{' (dry run)' if dry_run else ''}:")
+    for collection_name, counts in report.items():
+        if counts['seen']:
+            print(f"   {collection_name}: {counts['seen']} seen, {counts['created']} created, "
+                  f"{counts['updated']} updated, {counts['unchanged']} unchanged, "
+                  f"{counts['invalid']} invalid")
+
+def import_catalog(fm: FirestoreManager, path: str, dry_run: bool = False) -> Dict[str, Dict[str, int]]:
+    """Import a JSON, JSONL or CSV catalog (or a directory of them) into Firestore"""
+    report = CatalogImporter(fm, dry_run=dry_run).run(path)
+    print_import_report(report, dry_run)
+    return report
@@ -1,79 +1,404 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import statistics
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Dict, List, Any, Optional
 
-def check_firestore_data():
-    """Quick script to check what's in Firestore"""
-    try:
-        # Initialize Firebase (adjust path as needed)
-        cred = credentials.Certificate('src/config/serviceAccountKey.json')
-        if not firebase_admin._apps:
-            firebase_admin.initialize_app(cred)
-        db = firestore.client()
-        
-        print("🔍 Checking Firestore collections...")
-        
-        # Check collections
-        collections = ['users', 'departments', 'subclasses', 'notes', 'subjects']
-        
-        for collection_name in collections:
-            print(f"\n📂 {collection_name.upper()} Collection:")
+from firestore_client import DEFAULT_SERVICE_ACCOUNT
+from firestore_manager import FirestoreManager
+from instrumentation import AGGREGATION_ENTRIES_PER_READ, Profiler, instrument
+from storage_backend import BACKENDS, connect
+
+DIAGNOSTIC_COLLECTIONS = ['users', 'departments', 'subclasses', 'notes', 'subjects']
+DEFAULT_HISTORY_FILE = 'check_notes_history.json'
+HISTORY_RUNS = 50
+
+# Stratified samples draw from each value of a field, in proportion to its count;
+# the values are the IDs of the referenced collection
+STRATA = {
+    'users': ('department', 'departments'),
+    'subclasses': ('department', 'departments'),
+    'subjects': ('department', 'departments'),
+    'notes': ('subclassId', 'subclasses'),
+}
+
+# Fields shown for sampled documents, as the original check printed them
+SAMPLE_FIELDS = {
+    'notes': ['title', 'subjectCode', 'subclassId', 'isShared', 'createdAt', 'approved'],
+    'users': ['name', 'role', 'department', 'subclass'],
+    'subclasses': ['name', 'department', 'year'],
+    'subjects': ['code', 'name', 'department', 'isShared'],
+    'departments': ['code', 'name'],
+}
+
+# A query reading at least this share of its collection is a scan, and grows with it
+SCAN_RATIO = 0.5
+# Growth exponent of reads/latency versus collection size flagged between runs (1.0 = linear)
+GROWTH_EXPONENT = 0.8
+# Collection growth needed between runs before comparing them
+MIN_SIZE_GROWTH = 1.1
+# Growth below these is noise, not worth a warning
+MIN_FLAGGED_READS = 100
+MIN_FLAGGED_SECONDS = 0.01
+# IDs read from each end of a collection to learn the shape of its document IDs
+PROBE_IDS = 20
+
+def app_queries(params: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """The reads the web app issues, with parameters taken from the samples.
+
+    ``build`` gets the client and returns the query; ``scan`` marks the
+    unfiltered reads that --max-scan caps.
+    """
+    department = params.get('department')
+    return [
+        {'name': 'NotesLibrary notes scan', 'collection': 'notes', 'scan': True,
+         'source': 'NotesLibrary.tsx fetchNotes: getDocs(notes)',
+         'build': lambda db: db.collection('notes')},
+        {'name': 'NotesLibrary subjects scan', 'collection': 'subjects', 'scan': True,
+         'source': 'NotesLibrary.tsx fetchSubjects: getDocs(subjects)',
+         'build': lambda db: db.collection('subjects')},
+        {'name': 'useSubjects department', 'collection': 'subjects', 'requires': department,
+         'source': f"useSubjects.ts: where('department', '==', {department!r})",
+         'build': lambda db: db.collection('subjects').where('department', '==', department)},
+        {'name': 'useSubjects sharedWith', 'collection': 'subjects', 'requires': department,
+         'source': f"useSubjects.ts: where('isShared', '==', true), where('sharedWith', 'array-contains', {department!r})",
+         'build': lambda db: db.collection('subjects').where('isShared', '==', True)
+                                                      .where('sharedWith', 'array-contains', department)},
+        {'name': 'shared notes', 'collection': 'notes',
+         'source': "where('isShared', '==', true)",
+         'build': lambda db: db.collection('notes').where('isShared', '==', True)},
+    ]
+
+def key_space(ids: List[str]) -> List[List[str]]:
+    """Per-position alphabets of a set of document IDs.
+
+    Each position gets every character seen anywhere in ``ids`` that lies
+    between the lowest and highest character seen at that position, so
+    random auto-IDs give ~62 choices everywhere while sequential IDs
+    (``note00001523``) keep their fixed prefix and digit positions.
+    """
+    chars = sorted(set(''.join(ids)))
+    space = []
+    for position in range(max(len(doc_id) for doc_id in ids)):
+        seen = [doc_id[position] for doc_id in ids if len(doc_id) > position]
+        space.append([char for char in chars if min(seen) <= char <= max(seen)])
+    return space
+
+def random_key(space: List[List[str]], rng: random.Random) -> str:
+    key = ''.join(rng.choice(alphabet) for alphabet in space).replace('/', '')
+    # '.', '..' and '__*__' are reserved document IDs
+    return '' if key in ('.', '..') or (key.startswith('__') and key.endswith('__')) else key
+
+class Diagnostics:
+    """Counts, samples and query timings for the collections the app reads.
+
+    Counts are server-side aggregations, so they cost one read per 1000
+    documents instead of one per document. Random samples jump to random
+    document-ID cursors (``sample_size`` single-document reads plus a small
+    ID probe, however large the collection); stratified samples do the
+    same within each value of a field, allocated by that value's count.
+    """
+
+    def __init__(self, fm: FirestoreManager, sample_size: int = 5, sampling: str = 'random',
+                 repeat: int = 3, max_scan: int = 2000, seed: Optional[int] = None):
+        self.fm = fm
+        self.sample_size = sample_size
+        self.sampling = sampling
+        self.repeat = repeat
+        self.max_scan = max_scan
+        self.rng = random.Random(seed)
+
+    def _key_space(self, query) -> Optional[List[List[str]]]:
+        """Key space of a query's IDs, from the first and last ``PROBE_IDS`` of them"""
+        ids = [doc.id for direction in ('ASCENDING', 'DESCENDING')
+               for doc in query.select([]).order_by('__name__', direction=direction).limit(PROBE_IDS).stream()]
+        return key_space(ids) if ids else None
+
+    def random_sample(self, name: str, size: int, query=None) -> List[Any]:
+        """Up to ``size`` distinct documents of ``query`` (default: the collection), picked at random"""
+        collection = self.fm.db.collection(name)
+        query = query if query is not None else collection
+        space = self._key_space(query) if size > 0 else None
+        if space is None:
+            return []
+        picked: Dict[str, Any] = {}
+        # Several cursors can land on the same document; give up after a few misses
+        for _ in range(size * 3):
+            if len(picked) >= size:
+                break
+            key = random_key(space, self.rng)
+            docs = list(query.where('__name__', '>=', collection.document(key)).order_by('__name__')
+                        .limit(1).stream()) if key else []
+            if not docs:
+                docs = list(query.order_by('__name__').limit(1).stream())
+            for doc in docs:
+                picked.setdefault(doc.id, doc)
+        return list(picked.values())
+
+    def stratified_sample(self, name: str) -> tuple:
+        """A sample spread over the values of the collection's stratum field, and the strata counts"""
+        field, reference = STRATA[name]
+        values = [doc['id'] for doc in self.fm.iter_collection(reference, fields=[])]
+        counts = self.fm.count_by(name, field, values)
+        counts.pop('(other)', None)
+        population = sum(counts.values())
+        if not population:
+            return [], counts
+        # Largest-remainder allocation: shares proportional to counts, summing to sample_size
+        quotas = {value: self.sample_size * count / population for value, count in counts.items()}
+        shares = {value: int(quota) for value, quota in quotas.items()}
+        leftover = self.sample_size - sum(shares.values())
+        for value in sorted(quotas, key=lambda value: quotas[value] - shares[value], reverse=True)[:leftover]:
+            shares[value] += 1
+        sample: List[Any] = []
+        for value, share in sorted(shares.items()):
+            if share:
+                sample.extend(self.random_sample(name, share, self.fm.db.collection(name).where(field, '==', value)))
+        return sample, counts
+
+    def inspect_collection(self, name: str) -> Dict[str, Any]:
+        """True count, a sample, and how often each field is present in it"""
+        count = self.fm.count_documents(self.fm.db.collection(name))
+        result: Dict[str, Any] = {'count': count}
+        if self.sampling == 'stratified' and name in STRATA:
+            docs, result['strata'] = self.stratified_sample(name)
+        else:
+            docs = self.random_sample(name, min(self.sample_size, count))
+        fields: Dict[str, int] = {}
+        for doc in docs:
+            for field in (doc.to_dict() or {}):
+                fields[field] = fields.get(field, 0) + 1
+        result['sampled'] = len(docs)
+        result['field_presence'] = {field: round(seen / len(docs), 2) for field, seen in sorted(fields.items())}
+        result['samples'] = [{'id': doc.id, **{field: (doc.to_dict() or {}).get(field)
+                                                for field in SAMPLE_FIELDS.get(name, [])}}
+                             for doc in docs]
+        return result
+
+    def time_query(self, spec: Dict[str, Any], collection_size: int) -> Dict[str, Any]:
+        """Median latency and billed reads of one app query over ``repeat`` runs.
+
+        Unfiltered scans larger than ``max_scan`` are timed on their first
+        ``max_scan`` documents and extrapolated to the whole collection.
+        """
+        query = spec['build'](self.fm.db)
+        capped = spec.get('scan') and self.max_scan and collection_size > self.max_scan
+        if capped:
+            query = query.limit(self.max_scan)
+        timings, returned = [], 0
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            returned = sum(1 for _ in query.stream())
+            timings.append(time.perf_counter() - started)
+        seconds = statistics.median(timings)
+        reads = max(returned, 1)
+        if capped and returned:
+            seconds *= collection_size / returned
+            reads = collection_size
+        return {'name': spec['name'], 'collection': spec['collection'], 'source': spec['source'],
+                'seconds': round(seconds, 4), 'reads': reads, 'documents': returned,
+                'collection_size': collection_size, 'extrapolated': bool(capped)}
+
+    def run(self, collections: List[str] = DIAGNOSTIC_COLLECTIONS) -> Dict[str, Any]:
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(collections)) as pool:
+            inspected = dict(zip(collections, pool.map(self._inspect_safely, collections)))
+        departments = [doc['id'] for doc in inspected.get('departments', {}).get('samples', [])]
+        params = {'department': departments[0] if departments else None}
+        sizes = {name: result.get('count', 0) for name, result in inspected.items()}
+        queries = []
+        # Timed one after another so concurrent queries do not skew each other's latency
+        for spec in app_queries(params):
+            if 'requires' in spec and not spec['requires']:
+                continue
             try:
-                docs = db.collection(collection_name).limit(5).get()
-                print(f"   Total documents found: {len(docs)}")
-                
-                for i, doc in enumerate(docs):
-                    data = doc.to_dict()
-                    print(f"   {i+1}. ID: {doc.id}")
-                    
-                    if collection_name == 'notes':
-                        print(f"      Title: {data.get('title', 'N/A')}")
-                        print(f"      Subject: {data.get('subjectCode', 'N/A')}")
-                        print(f"      Subclass: {data.get('subclassId', 'N/A')}")
-                        print(f"      Shared: {data.get('isShared', 'N/A')}")
-                        print(f"      Created: {data.get('createdAt', 'N/A')}")
-                        print(f"      Approved: {data.get('approved', 'N/A')}")
-                    
-                    elif collection_name == 'users':
-                        print(f"      Name: {data.get('name', 'N/A')}")
-                        print(f"      Role: {data.get('role', 'N/A')}")
-                        print(f"      Department: {data.get('department', 'N/A')}")
-                        print(f"      Subclass: {data.get('subclass', 'N/A')}")
-                    
-                    elif collection_name == 'subclasses':
-                        print(f"      Name: {data.get('name', 'N/A')}")
-                        print(f"      Department: {data.get('department', 'N/A')}")
-                        print(f"      Year: {data.get('year', 'N/A')}")
-                    
-                    print()
-                        
+                size = sizes.get(spec['collection'])
+                if size is None:
+                    size = self.fm.count_documents(self.fm.db.collection(spec['collection']))
+                queries.append(self.time_query(spec, size))
             except Exception as e:
-                print(f"   ❌ Error accessing {collection_name}: {e}")
-        
-        # Specific notes query test
-        print("\n🔍 Testing Notes Queries:")
-        notes_ref = db.collection('notes')
-        
-        # Test simple query
-        try:
-            simple_query = notes_ref.limit(3).get()
-            print(f"✅ Simple query successful: {len(simple_query)} notes")
-        except Exception as e:
-            print(f"❌ Simple query failed: {e}")
-        
-        # Test where query
+                queries.append({'name': spec['name'], 'collection': spec['collection'],
+                                'source': spec['source'], 'error': str(e)})
+        count_reads = sum(max(1, math.ceil(size / AGGREGATION_ENTRIES_PER_READ)) for size in sizes.values())
+        return {'time': datetime.now().isoformat(timespec='seconds'), 'sampling': self.sampling,
+                'parameters': params, 'collections': inspected, 'queries': queries,
+                'count_reads': count_reads, 'seconds': round(time.monotonic() - started, 3)}
+
+    def _inspect_safely(self, name: str) -> Dict[str, Any]:
         try:
-            where_query = notes_ref.where('isShared', '==', True).limit(3).get()
-            print(f"✅ Where query successful: {len(where_query)} shared notes")
+            return self.inspect_collection(name)
         except Exception as e:
-            print(f"❌ Where query failed: {e}")
-            
+            return {'error': str(e)}
+
+def flag_growth(report: Dict[str, Any], history: List[Dict[str, Any]]) -> List[str]:
+    """Warnings for queries whose reads or latency grow with their collection.
+
+    A query reading most of its collection is flagged on any run. Against
+    the most recent earlier run with a smaller collection, reads or
+    latency growing at least ``GROWTH_EXPONENT`` times as fast (in log
+    terms) as the collection is flagged too.
+    """
+    warnings = []
+    for query in report['queries']:
+        if 'error' in query:
+            continue
+        size = query['collection_size']
+        if size >= 1000 and query['reads'] >= SCAN_RATIO * size:
+            warnings.append(f"{query['name']} reads {query['reads']} of {size} {query['collection']} "
+                            f"documents: its cost grows linearly with the collection")
+            continue
+        previous = next((old for run in reversed(history) for old in run.get('queries', [])
+                         if old.get('name') == query['name'] and 'error' not in old
+                         and size >= MIN_SIZE_GROWTH * old['collection_size'] > 0), None)
+        if previous is None:
+            continue
+        size_growth = math.log(size / previous['collection_size'])
+        for metric, unit, floor in (('reads', ' reads', MIN_FLAGGED_READS), ('seconds', 's', MIN_FLAGGED_SECONDS)):
+            if previous[metric] > 0 and query[metric] > max(previous[metric], floor):
+                exponent = math.log(query[metric] / previous[metric]) / size_growth
+                if exponent >= GROWTH_EXPONENT:
+                    warnings.append(f"{query['name']}: {metric} {previous[metric]}{unit} -> {query[metric]}{unit} "
+                                    f"while {query['collection']} grew {previous['collection_size']} -> {size} "
+                                    f"(growth exponent {exponent:.2f})")
+    return warnings
+
+def load_history(path: Optional[str]) -> List[Dict[str, Any]]:
+    if not path or not os.path.exists(path):
+        return []
+    try:
+        with open(path, encoding='utf-8') as fp:
+            return json.load(fp)
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Ignoring unreadable history file {path}: {e}")
+        return []
+
+def save_history(path: str, history: List[Dict[str, Any]], report: Dict[str, Any]):
+    """Append the run's sizes and query timings, keeping the last ``HISTORY_RUNS`` runs"""
+    entry = {'time': report['time'],
+             'counts': {name: result.get('count') for name, result in report['collections'].items()},
+             'queries': [{key: query[key] for key in ('name', 'collection', 'seconds', 'reads', 'collection_size')}
+                         for query in report['queries'] if 'error' not in query]}
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump((history + [entry])[-HISTORY_RUNS:], fp, indent=2)
+    os.replace(tmp_path, path)
+
+def print_diagnostics(report: Dict[str, Any], warnings: List[str]):
+    """Print counts, samples, query timings and growth warnings"""
+    for name, result in report['collections'].items():
+        print(f"\n📂 {name.upper()} Collection:")
+        if 'error' in result:
+            print(f"   ❌ Error accessing {name}: {result['error']}")
+            continue
+        print(f"   Total documents: {result['count']}")
+        if result.get('strata'):
+            print(f"   Strata: {len(result['strata'])} values, largest "
+                  f"{max(result['strata'].values())}, smallest {min(result['strata'].values())}")
+        print(f"   Sampled {result['sampled']} ({report['sampling']})")
+        missing = [field for field, share in result['field_presence'].items() if share < 1]
+        if missing:
+            print(f"   ⚠️ Fields missing from some samples: "
+                  f"{', '.join(f'{field} ({share:.0%})' for field, share in result['field_presence'].items() if share < 1)}")
+        for i, sample in enumerate(result['samples'][:5]):
+            details = ', '.join(f"{field}={value}" for field, value in sample.items() if field != 'id')
+            print(f"   {i + 1}. {sample['id']}: {details}")
+
+    print("\n⏱️  App queries:")
+    for query in report['queries']:
+        if 'error' in query:
+            print(f"   ❌ {query['name']}: {query['error']}")
+            continue
+        estimate = ' (extrapolated)' if query['extrapolated'] else ''
+        print(f"   {query['name']:<28} {query['seconds'] * 1000:>9.1f} ms{estimate}  {query['reads']:>8} reads "
+              f"of {query['collection_size']} {query['collection']}")
+        print(f"      {query['source']}")
+    print(f"\n   Counts cost {report['count_reads']} reads; checked in {report['seconds']}s")
+
+    for warning in warnings:
+        print(f"⚠️ {warning}")
+    if not warnings:
+        print("✅ No query grows with collection size")
+
+def check_firestore_data(db=None, sample_size: int = 5, sampling: str = 'random', repeat: int = 3,
+                         max_scan: int = 2000, history_path: Optional[str] = None,
+                         report_path: Optional[str] = None, seed: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Check what's in Firestore and how the app's queries perform (optionally on a given client)"""
+    try:
+        if db is None:
+            db = connect('firestore', DEFAULT_SERVICE_ACCOUNT)
+        print("🔍 Checking Firestore collections...")
+        diagnostics = Diagnostics(FirestoreManager(db=db), sample_size=sample_size, sampling=sampling,
+                                  repeat=repeat, max_scan=max_scan, seed=seed)
+        report = diagnostics.run()
+        history = load_history(history_path)
+        report['warnings'] = flag_growth(report, history)
+        print_diagnostics(report, report['warnings'])
+        if history_path:
+            save_history(history_path, history, report)
+        if report_path:
+            with open(report_path, 'w', encoding='utf-8') as fp:
+                json.dump(report, fp, indent=2, default=str)
+            print(f"💾 Saved diagnostics to {report_path}")
         print("\n✅ Data check complete!")
-        
+        return report
     except Exception as e:
-        print(f"❌ Failed to connect to Firestore: {e}")
+        print(f"❌ Failed to check Firestore: {e}")
         print("Make sure your serviceAccountKey.json is in the correct location")
+        return None
 
 if __name__ == "__main__":
-    check_firestore_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Check what is in Firestore')
+    parser.add_argument('--sample-size', type=int, default=5,
+                      help='Documents sampled per collection')
+    parser.add_argument('--sampling', choices=['random', 'stratified'], default='random',
+                      help='Random documents, or documents spread over departments/subclasses')
+    parser.add_argument('--repeat', type=int, default=3,
+                      help='Runs per timed query (the median is reported)')
+    parser.add_argument('--max-scan', type=int, default=2000,
+                      help='Documents read by full-collection queries before extrapolating (0 for no cap)')
+    parser.add_argument('--history-file', default=DEFAULT_HISTORY_FILE,
+                      help="Run history used to flag queries growing with collection size ('' to disable)")
+    parser.add_argument('--report-file', help='Also write the diagnostics as JSON')
+    parser.add_argument('--seed', type=int, help='Random seed, for repeatable samples')
+    parser.add_argument('--backend', choices=BACKENDS, default='firestore',
+                      help="Storage backend; 'memory' checks a --snapshot instead of Firestore")
+    parser.add_argument('--snapshot', help='With --backend memory, dump to load')
+    parser.add_argument('--profile', action='store_true',
+                      help='Print the Firestore reads/writes/latency the check cost')
+    parser.add_argument('--log-calls', action='store_true',
+                      help='Log every Firestore call as a JSON line on stderr')
+    parser.add_argument('--metrics-file',
+                      help='Write call metrics as a Prometheus textfile to this path')
+    parser.add_argument('--openmetrics', action='store_true',
+                      help='Write --metrics-file in OpenMetrics format instead')
+    args = parser.parse_args()
+
+    try:
+        db = connect(args.backend, DEFAULT_SERVICE_ACCOUNT, args.snapshot)
+    except Exception as e:
+        print(f"❌ Failed to connect to Firestore: {e}")
+        sys.exit(1)
+    options = dict(sample_size=args.sample_size, sampling=args.sampling, repeat=args.repeat,
+                   max_scan=args.max_scan, history_path=args.history_file or None,
+                   report_path=args.report_file, seed=args.seed)
+
+    if not (args.profile or args.log_calls or args.metrics_file):
+        sys.exit(0 if check_firestore_data(db, **options) is not None else 1)
+
+    if args.log_calls:
+        logging.basicConfig(level=logging.INFO, format='%(message)s')
+    profiler = Profiler(log_calls=args.log_calls)
+    with profiler.command('check-notes'):
+        report = check_firestore_data(instrument(db, profiler), **options)
+    if args.profile:
+        profiler.print_summary()
+    if args.metrics_file:
+        profiler.write_metrics(args.metrics_file, openmetrics=args.openmetrics)
+    sys.exit(0 if report is not None else 1)
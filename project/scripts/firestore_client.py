@@ -0,0 +1,93 @@
+import importlib
+import threading
+from typing import Any, Dict, Tuple
+
+DEFAULT_SERVICE_ACCOUNT = 'src/config/serviceAccountKey.json'
+
+class LazyModule:
+    """Stand-in for a module that is only imported on first attribute access.
+
+    ``firebase_admin`` pulls in gRPC and google-cloud, which takes a second
+    or more; scripts that fail argument parsing or only print ``--help``
+    should not pay for it. If the module is not installed, attributes come
+    from ``fallback`` instead.
+    """
+
+    def __init__(self, name: str, fallback=None):
+        self._name = name
+        self._fallback = fallback
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self._name)
+            except ImportError:
+                if self._fallback is None:
+                    raise
+                self._module = self._fallback
+        return getattr(self._module, attr)
+
+class _Sentinel:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self):
+        return self.name
+
+class LocalTransforms:
+    """Field transforms for the memory engine when the Firebase SDK is not installed"""
+
+    SERVER_TIMESTAMP = _Sentinel('SERVER_TIMESTAMP')
+    DELETE_FIELD = _Sentinel('DELETE_FIELD')
+
+    class ArrayUnion:
+        def __init__(self, values):
+            self.values = list(values)
+
+    class ArrayRemove:
+        def __init__(self, values):
+            self.values = list(values)
+
+    class Increment:
+        def __init__(self, value):
+            self.value = value
+
+firestore = LazyModule('firebase_admin.firestore', fallback=LocalTransforms)
+
+_clients: Dict[Tuple[str, str], object] = {}
+_lock = threading.Lock()
+
+def _initialize_app(service_account_path: str):
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(service_account_path))
+
+def get_client(service_account_path: str = DEFAULT_SERVICE_ACCOUNT):
+    """Firestore client shared by every caller in this process, created on first use"""
+    key = ('sync', service_account_path)
+    with _lock:
+        if key not in _clients:
+            _initialize_app(service_account_path)
+            from firebase_admin import firestore as admin_firestore
+            _clients[key] = admin_firestore.client()
+        return _clients[key]
+
+def verify_id_token(id_token: str, service_account_path: str = DEFAULT_SERVICE_ACCOUNT) -> Dict[str, Any]:
+    """Claims of a Firebase Auth ID token sent by the web app; raises if it is invalid or expired"""
+    with _lock:
+        _initialize_app(service_account_path)
+    from firebase_admin import auth
+    return auth.verify_id_token(id_token)
+
+def get_async_client(service_account_path: str = DEFAULT_SERVICE_ACCOUNT):
+    """Async counterpart of get_client()"""
+    key = ('async', service_account_path)
+    with _lock:
+        if key not in _clients:
+            _initialize_app(service_account_path)
+            from firebase_admin import firestore_async
+            _clients[key] = firestore_async.client()
+        return _clients[key]
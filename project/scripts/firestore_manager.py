@@ -1,93 +1,517 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import json
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator, Callable
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+import copy
+import logging
+import os
+import random
 import sys
+import threading
+import time
+import zlib
 import argparse
 
-class FirestoreManager:
-    def __init__(self, service_account_path: str = 'src/config/serviceAccountKey.json'):
-        """Initialize Firestore connection"""
+from firestore_client import DEFAULT_SERVICE_ACCOUNT, firestore
+from instrumentation import Profiler, estimate_size, instrument, profiled
+from storage_backend import BACKENDS, BackendUnavailable, connect, export_snapshot
+
+STAT_COLLECTIONS = ['departments', 'subclasses', 'subjects', 'users', 'notes', 'assignments']
+
+# name -> (collection, field, values). Values are either a fixed list or the
+# name of a reference collection whose document IDs are the possible values.
+STAT_BREAKDOWNS = {
+    'notes_by_subclass': ('notes', 'subclassId', 'subclasses'),
+    'users_by_role': ('users', 'role', ['student', 'cr', 'admin']),
+    'users_by_department': ('users', 'department', 'departments'),
+}
+
+def department_fields(dept_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored fields of a department document (without timestamps)"""
+    return {
+        'id': dept_data['code'],
+        'name': dept_data['name'],
+        'code': dept_data['code'],
+        'subclasses': dept_data.get('subclasses', []),
+    }
+
+def subclass_fields(subclass_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored fields of a subclass document (without timestamps)"""
+    return {
+        'id': subclass_data['id'],
+        'name': subclass_data['name'],
+        'department': subclass_data['department'],
+        'year': subclass_data['year'],
+        'semester': subclass_data.get('semester', (subclass_data['year'] * 2) - 1),
+        'capacity': subclass_data.get('capacity', 60),
+    }
+
+def subject_fields(subject_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Stored fields of a subject document (without timestamps)"""
+    return {
+        'id': subject_data['code'],
+        'name': subject_data['name'],
+        'code': subject_data['code'],
+        'department': subject_data['department'],
+        'year': subject_data['year'],
+        'semester': subject_data['semester'],
+        'credits': subject_data['credits'],
+        'isShared': subject_data.get('isShared', False),
+        'sharedWith': subject_data.get('sharedWith', []),
+        'description': subject_data.get('description', ''),
+    }
+
+NOTE_INDEX_COLLECTION = 'noteVisibility'
+SHARED_NOTES_DOC = '_shared'
+# Each index group (a subclass or _shared) is split into pages {group}-{n}
+# by a hash of the note ID; the manifest holds the page count of each group.
+# An entry is ~1 KB, so 250 entries keep a page far from the 1 MiB limit and
+# the watcher repartitions once a group averages NOTE_INDEX_PAGE_MAX_ENTRIES.
+NOTE_INDEX_MANIFEST_DOC = '_manifest'
+NOTE_INDEX_PAGE_ENTRIES = 250
+NOTE_INDEX_PAGE_MAX_ENTRIES = 500
+NOTE_INDEX_WARN_BYTES = 800_000
+
+USER_ROLES = ['student', 'cr', 'admin']
+
+# Download counts: clients increment a random one of DOWNLOAD_SHARDS shards in
+# notes/{noteId}/downloadShards, and rollup_download_counters sums them back
+# into notes.downloads. The 'base' shard holds the count from before sharding.
+DOWNLOAD_SHARD_COLLECTION = 'downloadShards'
+DOWNLOAD_SHARDS = 10
+DOWNLOAD_BASE_SHARD = 'base'
+ROLLUP_STATE_COLLECTION = 'rollups'
+ROLLUP_NOTE_FIELDS = ['downloads', 'downloadShards', 'subclassId', 'isShared']
+
+# Fields NotesLibrary renders; descriptions are trimmed to keep index docs small
+NOTE_SUMMARY_FIELDS = ['title', 'subjectCode', 'fileUrl', 'fileName', 'fileSize', 'uploadedBy',
+                       'uploaderName', 'subclassId', 'isShared', 'tags', 'downloads', 'approved',
+                       'createdAt', 'driveFileId', 'viewUrl', 'downloadUrl']
+NOTE_SUMMARY_DESCRIPTION_LENGTH = 200
+
+def note_summary(note_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact copy of a note for the visibility index"""
+    summary = {field: note_data[field] for field in NOTE_SUMMARY_FIELDS if field in note_data}
+    summary['description'] = (note_data.get('description') or '')[:NOTE_SUMMARY_DESCRIPTION_LENGTH]
+    return summary
+
+def note_index_docs(note_data: Dict[str, Any]) -> List[str]:
+    """Index groups a note belongs in (its subclass and/or the shared feed)"""
+    doc_ids = []
+    if note_data.get('subclassId'):
+        doc_ids.append(note_data['subclassId'])
+    if note_data.get('isShared'):
+        doc_ids.append(SHARED_NOTES_DOC)
+    return doc_ids
+
+def note_index_page(group: str, note_id: str, pages: int) -> str:
+    """ID of the page of an index group that lists a note"""
+    return f"{group}-{zlib.crc32(note_id.encode('utf-8')) % max(pages, 1)}"
+
+def note_index_pages(count: int) -> int:
+    """Pages a group of ``count`` entries is split into"""
+    return max(1, -(-count // NOTE_INDEX_PAGE_ENTRIES))
+
+SUBJECT_CATALOG_COLLECTION = 'subjectCatalogs'
+CATALOG_SUBJECT_FIELDS = ['code', 'name', 'department', 'year', 'semester', 'credits',
+                          'isShared', 'sharedWith', 'description']
+
+def subject_departments(subject_data: Dict[str, Any]) -> set:
+    """Departments whose catalog lists a subject (its own plus any it is shared with)"""
+    departments = {subject_data['department']} if subject_data.get('department') else set()
+    if subject_data.get('isShared'):
+        departments.update(subject_data.get('sharedWith') or [])
+    return departments
+
+def build_catalog(subjects: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Deduplicate subjects by code and sort them like useSubjects (year, semester, name)"""
+    by_code = {}
+    for subject in subjects:
+        entry = {field: subject[field] for field in CATALOG_SUBJECT_FIELDS if field in subject}
+        entry['id'] = subject['id']
+        by_code.setdefault(subject.get('code', subject['id']), entry)
+    return sorted(by_code.values(),
+                  key=lambda s: (s.get('year', 0), s.get('semester', 0), s.get('name', '')))
+
+class BatchWriter:
+    """Queues writes and commits them as batches of up to 500 operations.
+
+    Full batches are committed on a bounded thread pool while more writes are
+    queued. A failed batch is retried with exponential backoff. Batches may
+    commit in any order, so call ``flush()`` between dependent phases.
+    Callbacks registered with ``on_flush`` run once the writes queued
+    before them have committed.
+    """
+
+    MAX_BATCH_SIZE = 500
+
+    def __init__(self, db, batch_size: int = MAX_BATCH_SIZE, max_workers: int = 4,
+                 max_retries: int = 5, backoff: float = 0.5):
+        self.db = db
+        self.batch_size = min(batch_size, self.MAX_BATCH_SIZE)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._pending = []
+        self._futures = []
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_workers * 2)
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self.stats = {'operations': 0, 'batches': 0, 'retries': 0, 'failed': 0}
+        self._flush_callbacks: Dict[Any, Callable[[], None]] = {}
+
+    def set(self, ref, data: Dict[str, Any], merge: bool = False):
+        self._enqueue(('set', ref, data, merge))
+
+    def update(self, ref, data: Dict[str, Any]):
+        self._enqueue(('update', ref, data, None))
+
+    def delete(self, ref):
+        self._enqueue(('delete', ref, None, None))
+
+    def _enqueue(self, op):
+        self._pending.append(op)
+        if len(self._pending) >= self.batch_size:
+            self._submit()
+
+    def _submit(self):
+        if not self._pending:
+            return
+        chunk, self._pending = self._pending, []
+        # Blocks once enough chunks are in flight, keeping memory bounded
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._commit, chunk))
+
+    def _commit(self, chunk):
         try:
-            cred = credentials.Certificate(service_account_path)
-            if not firebase_admin._apps:
-                firebase_admin.initialize_app(cred)
-            self.db = firestore.client()
-            print("✅ Connected to Firestore successfully")
-        except Exception as e:
-            print(f"❌ Failed to connect to Firestore: {e}")
-            sys.exit(1)
+            for attempt in range(self.max_retries + 1):
+                try:
+                    batch = self.db.batch()
+                    for kind, ref, data, merge in chunk:
+                        if kind == 'set':
+                            batch.set(ref, data, merge=merge)
+                        elif kind == 'update':
+                            batch.update(ref, data)
+                        else:
+                            batch.delete(ref)
+                    batch.commit()
+                    with self._lock:
+                        self.stats['operations'] += len(chunk)
+                        self.stats['batches'] += 1
+                    return
+                except Exception as e:
+                    if attempt == self.max_retries:
+                        print(f"❌ Batch of {len(chunk)} writes failed after {attempt + 1} attempts: {e}")
+                        with self._lock:
+                            self.stats['failed'] += len(chunk)
+                        return
+                    with self._lock:
+                        self.stats['retries'] += 1
+                    time.sleep(self.backoff * (2 ** attempt) * (1 + random.random()))
+        finally:
+            self._slots.release()
+
+    def on_flush(self, key, callback: Callable[[], None]):
+        """Run ``callback`` after the next flush; a later callback with the same key replaces it"""
+        self._flush_callbacks[key] = callback
+
+    def flush(self):
+        """Commit everything queued so far and wait for it to finish"""
+        self._submit()
+        futures, self._futures = self._futures, []
+        for future in futures:
+            future.result()
+        callbacks, self._flush_callbacks = self._flush_callbacks, {}
+        for callback in callbacks.values():
+            callback()
+
+    def close(self) -> Dict[str, Any]:
+        """Flush remaining writes, stop the pool and print a throughput summary"""
+        self.flush()
+        self._pool.shutdown()
+        elapsed = time.monotonic() - self._started
+        self.stats['seconds'] = round(elapsed, 3)
+        self.stats['ops_per_second'] = round(self.stats['operations'] / elapsed, 1) if elapsed else 0.0
+        print(f"✅ Committed {self.stats['operations']} writes in {self.stats['batches']} batches "
+              f"({self.stats['ops_per_second']} ops/s, {self.stats['retries']} retries, "
+              f"{self.stats['failed']} failed)")
+        return self.stats
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class ReferenceCache:
+    """Read-through cache for reference lookups with TTL and LRU eviction.
+
+    Keys are ``(collection, filter)`` tuples so a whole collection can be
+    invalidated at once. Entries carry wall-clock timestamps, which lets a
+    snapshot saved by one process stay valid (within the TTL) in the next.
+    """
+
+    def __init__(self, ttl: float = 300, max_entries: int = 128,
+                 snapshot_path: Optional[str] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.snapshot_path = snapshot_path
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if snapshot_path:
+            self.load()
+
+    def get(self, key: tuple) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return copy.deepcopy(entry[1])
+
+    def put(self, key: tuple, value: Any):
+        self._entries[key] = (time.time(), copy.deepcopy(value))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, collection_name: Optional[str] = None):
+        """Drop entries for one collection, or everything if none is given"""
+        for key in list(self._entries):
+            if collection_name is None or key[0] == collection_name:
+                del self._entries[key]
+
+    def stats(self) -> Dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._entries)}
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, datetime):
+            return {'__datetime__': value.isoformat()}
+        return str(value)
+
+    @staticmethod
+    def _decode(obj):
+        if '__datetime__' in obj:
+            return datetime.fromisoformat(obj['__datetime__'])
+        return obj
+
+    def save(self):
+        """Write unexpired entries to the snapshot file"""
+        if not self.snapshot_path:
+            return
+        now = time.time()
+        entries = [[list(key), stamp, value] for key, (stamp, value) in self._entries.items()
+                   if now - stamp <= self.ttl]
+        tmp_path = self.snapshot_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(entries, fp, default=self._encode)
+        os.replace(tmp_path, self.snapshot_path)
 
-    def create_department(self, dept_data: Dict[str, Any]) -> str:
-        """Create a new department"""
+    def load(self):
+        """Warm the cache from the snapshot file, skipping expired entries"""
+        try:
+            with open(self.snapshot_path, encoding='utf-8') as fp:
+                entries = json.load(fp, object_hook=self._decode)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        for key, stamp, value in entries:
+            if now - stamp <= self.ttl:
+                self._entries[tuple(key)] = (stamp, value)
+
+class FirestoreManager:
+    def __init__(self, service_account_path: str = DEFAULT_SERVICE_ACCOUNT,
+                 max_workers: int = 8, cache: Optional[ReferenceCache] = None, db=None,
+                 profiler: Optional[Profiler] = None, backend: str = 'firestore',
+                 snapshot: Optional[str] = None):
+        """Set up the manager; the storage backend is opened on first use.
+
+        ``backend`` is 'firestore' or 'memory' (see storage_backend; the
+        memory engine starts from ``snapshot`` if given). Pass ``db`` to use
+        a given client instead (e.g. an emulator client). With a
+        ``profiler``, every call made through ``self.db`` is timed and its
+        document reads/writes are recorded.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(f"backend must be one of {', '.join(BACKENDS)}")
+        self.service_account_path = service_account_path
+        self.backend = backend
+        self.snapshot = snapshot
+        self.max_workers = max_workers
+        self.cache = cache if cache is not None else ReferenceCache()
+        self.profiler = profiler
+        # A firestore_sync.LocalMirror; when set, reads are served from it
+        self.mirror = None
+        # Page counts of the note visibility index groups, read from its manifest
+        self._note_index_pages: Optional[Dict[str, int]] = None
+        # Search index changes waiting for a BatchWriter to flush: writer -> (notes, previous)
+        self._pending_search: Dict[BatchWriter, tuple] = {}
+        self._aggregation_supported = True
+        self._sum_supported = True
+        self._db = None
+        self._connect_lock = threading.Lock()
+        if db is not None:
+            self._db = instrument(db, profiler) if profiler is not None else db
+
+    @property
+    def db(self):
+        """The backend client, connected on first access (Firestore's is shared process-wide).
+
+        Raises BackendUnavailable if it cannot be opened.
+        """
+        if self._db is None:
+            with self._connect_lock:
+                if self._db is None:
+                    try:
+                        db = connect(self.backend, self.service_account_path, self.snapshot)
+                    except BackendUnavailable as e:
+                        print(f"❌ {e}")
+                        raise
+                    except Exception as e:
+                        print(f"❌ Failed to connect to Firestore: {e}")
+                        raise BackendUnavailable(f"could not connect to Firestore: {e}") from e
+                    if self.backend == 'firestore':
+                        print("✅ Connected to Firestore successfully")
+                    self._db = instrument(db, self.profiler) if self.profiler is not None else db
+        return self._db
+
+    def bulk_writer(self, **kwargs) -> BatchWriter:
+        """Create a BatchWriter bound to this client"""
+        return BatchWriter(self.db, **kwargs)
+
+    def _invalidate(self, collection_name: str, writer: Optional[BatchWriter] = None):
+        """Drop cached reads of a collection once a write to it has committed"""
+        if writer is None:
+            self.cache.invalidate(collection_name)
+        else:
+            # Invalidating at enqueue time would let a read before the flush cache the old data
+            writer.on_flush(('invalidate', collection_name), lambda: self.cache.invalidate(collection_name))
+
+    def _write(self, ref, data: Dict[str, Any], writer: Optional[BatchWriter]):
+        if writer is not None:
+            writer.set(ref, data)
+        else:
+            ref.set(data)
+
+    def create_department(self, dept_data: Dict[str, Any], writer: Optional[BatchWriter] = None) -> str:
+        """Create a new department (queued on ``writer`` if given)"""
         try:
             dept_ref = self.db.collection('departments').document(dept_data['code'])
-            dept_ref.set({
-                'id': dept_data['code'],
-                'name': dept_data['name'],
-                'code': dept_data['code'],
-                'subclasses': dept_data.get('subclasses', []),
-                'createdAt': datetime.now()
-            })
-            print(f"✅ Created department: {dept_data['name']}")
+            self._write(dept_ref, {**department_fields(dept_data), 'createdAt': datetime.now(),
+                                   'updatedAt': firestore.SERVER_TIMESTAMP}, writer)
+            self._invalidate('departments', writer)
+            if writer is None:
+                print(f"✅ Created department: {dept_data['name']}")
             return dept_data['code']
         except Exception as e:
             print(f"❌ Failed to create department: {e}")
             return None
 
-    def create_subclass(self, subclass_data: Dict[str, Any]) -> str:
-        """Create a new subclass"""
+    def create_subclass(self, subclass_data: Dict[str, Any], writer: Optional[BatchWriter] = None) -> str:
+        """Create a new subclass (queued on ``writer`` if given)"""
         try:
             subclass_ref = self.db.collection('subclasses').document(subclass_data['id'])
-            subclass_ref.set({
-                'id': subclass_data['id'],
-                'name': subclass_data['name'],
-                'department': subclass_data['department'],
-                'year': subclass_data['year'],
-                'semester': subclass_data.get('semester', (subclass_data['year'] * 2) - 1),
-                'capacity': subclass_data.get('capacity', 60),
-                'createdAt': datetime.now()
-            })
-            print(f"✅ Created subclass: {subclass_data['name']}")
+            self._write(subclass_ref, {**subclass_fields(subclass_data), 'createdAt': datetime.now(),
+                                   'updatedAt': firestore.SERVER_TIMESTAMP}, writer)
+            self._invalidate('subclasses', writer)
+            if writer is None:
+                print(f"✅ Created subclass: {subclass_data['name']}")
             return subclass_data['id']
         except Exception as e:
             print(f"❌ Failed to create subclass: {e}")
             return None
 
-    def create_subject(self, subject_data: Dict[str, Any]) -> str:
-        """Create a new subject"""
+    def create_subject(self, subject_data: Dict[str, Any], writer: Optional[BatchWriter] = None) -> str:
+        """Create a new subject (queued on ``writer`` if given).
+
+        Written directly, the affected department catalogs are refreshed
+        right away; callers queueing on a writer should call
+        rebuild_subject_catalogs once the writer is closed.
+        """
         try:
             subject_ref = self.db.collection('subjects').document(subject_data['code'])
-            subject_ref.set({
-                'id': subject_data['code'],
-                'name': subject_data['name'],
-                'code': subject_data['code'],
-                'department': subject_data['department'],
-                'year': subject_data['year'],
-                'semester': subject_data['semester'],
-                'credits': subject_data['credits'],
-                'isShared': subject_data.get('isShared', False),
-                'sharedWith': subject_data.get('sharedWith', []),
-                'description': subject_data.get('description', ''),
-                'createdAt': datetime.now()
-            })
-            print(f"✅ Created subject: {subject_data['name']} ({subject_data['code']})")
+            self._write(subject_ref, {**subject_fields(subject_data), 'createdAt': datetime.now(),
+                                   'updatedAt': firestore.SERVER_TIMESTAMP}, writer)
+            self._invalidate('subjects', writer)
+            if writer is None:
+                self.refresh_subject_catalogs(subject_departments(subject_data))
+                print(f"✅ Created subject: {subject_data['name']} ({subject_data['code']})")
             return subject_data['code']
         except Exception as e:
             print(f"❌ Failed to create subject: {e}")
             return None
 
+    def iter_collection(self, collection_name: str, filters: Optional[List[tuple]] = None,
+                        fields: Optional[List[str]] = None,
+                        page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream a collection page by page.
+
+        ``filters`` is a list of ``(field, op, value)`` tuples and ``fields``
+        projects each document to the given fields (``[]`` for IDs only).
+        Pages are fetched with a ``start_after`` cursor on the document ID, so
+        only one page is held in memory and results arrive before the scan ends.
+        """
+        if self.mirror is not None:
+            yield from self.mirror.iter_collection(collection_name, filters, fields)
+            return
+
+        query = self.db.collection(collection_name)
+        for field, op, value in filters or []:
+            query = query.where(field, op, value)
+        if fields is not None:
+            query = query.select(fields)
+        query = query.order_by('__name__').limit(page_size)
+
+        last_doc = None
+        while True:
+            page = query.start_after(last_doc) if last_doc is not None else query
+            count = 0
+            for doc in page.stream():
+                data = doc.to_dict() or {}
+                data['id'] = doc.id
+                yield data
+                last_doc = doc
+                count += 1
+            if count < page_size:
+                return
+
+    def iter_departments(self, fields: Optional[List[str]] = None,
+                         page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream departments"""
+        return self.iter_collection('departments', fields=fields, page_size=page_size)
+
+    def iter_subclasses(self, department: Optional[str] = None, fields: Optional[List[str]] = None,
+                        page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream subclasses, optionally filtered by department"""
+        filters = [('department', '==', department)] if department else None
+        return self.iter_collection('subclasses', filters, fields, page_size)
+
+    def iter_subjects(self, department: Optional[str] = None, fields: Optional[List[str]] = None,
+                      page_size: int = 500) -> Iterator[Dict[str, Any]]:
+        """Stream subjects, optionally filtered by department"""
+        filters = [('department', '==', department)] if department else None
+        return self.iter_collection('subjects', filters, fields, page_size)
+
+    def _cached(self, key: tuple, load) -> List[Dict[str, Any]]:
+        result = self.cache.get(key)
+        if result is None:
+            result = list(load())
+            self.cache.put(key, result)
+        return result
+
     def get_all_departments(self) -> List[Dict[str, Any]]:
         """Get all departments"""
         try:
-            docs = self.db.collection('departments').get()
-            departments = []
-            for doc in docs:
-                dept_data = doc.to_dict()
-                dept_data['id'] = doc.id
-                departments.append(dept_data)
-            return departments
+            return self._cached(('departments', None), self.iter_departments)
         except Exception as e:
             print(f"❌ Failed to get departments: {e}")
             return []
@@ -95,17 +519,7 @@ class FirestoreManager:
     def get_all_subclasses(self, department: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all subclasses, optionally filtered by department"""
         try:
-            query = self.db.collection('subclasses')
-            if department:
-                query = query.where('department', '==', department)
-            
-            docs = query.get()
-            subclasses = []
-            for doc in docs:
-                subclass_data = doc.to_dict()
-                subclass_data['id'] = doc.id
-                subclasses.append(subclass_data)
-            return subclasses
+            return self._cached(('subclasses', department), lambda: self.iter_subclasses(department))
         except Exception as e:
             print(f"❌ Failed to get subclasses: {e}")
             return []
@@ -113,110 +527,1070 @@ class FirestoreManager:
     def get_all_subjects(self, department: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get all subjects, optionally filtered by department"""
         try:
-            query = self.db.collection('subjects')
-            if department:
-                query = query.where('department', '==', department)
-            
-            docs = query.get()
-            subjects = []
-            for doc in docs:
-                subject_data = doc.to_dict()
-                subject_data['id'] = doc.id
-                subjects.append(subject_data)
-            return subjects
+            return self._cached(('subjects', department), lambda: self.iter_subjects(department))
         except Exception as e:
             print(f"❌ Failed to get subjects: {e}")
             return []
 
-    def update_department_subclasses(self, dept_code: str, subclasses: List[str]):
-        """Update department's subclasses list"""
+    def update_department_subclasses(self, dept_code: str, subclasses: List[str],
+                                     writer: Optional[BatchWriter] = None):
+        """Update department's subclasses list (queued on ``writer`` if given)"""
         try:
             dept_ref = self.db.collection('departments').document(dept_code)
-            dept_ref.update({'subclasses': subclasses})
+            if writer is not None:
+                writer.update(dept_ref, {'subclasses': subclasses, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                self._invalidate('departments', writer)
+                return
+            dept_ref.update({'subclasses': subclasses, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            self._invalidate('departments')
             print(f"✅ Updated {dept_code} subclasses: {subclasses}")
         except Exception as e:
             print(f"❌ Failed to update department subclasses: {e}")
 
-    def assign_user_role(self, user_id: str, role: str):
-        """Assign role to user (student, cr, admin)"""
+    def assign_user_role(self, user_id: str, role: str, writer: Optional[BatchWriter] = None):
+        """Assign role to user (student, cr, admin), queued on ``writer`` if given"""
         try:
             user_ref = self.db.collection('users').document(user_id)
-            user_ref.update({'role': role})
+            if writer is not None:
+                writer.update(user_ref, {'role': role, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                return
+            user_ref.update({'role': role, 'updatedAt': firestore.SERVER_TIMESTAMP})
             print(f"✅ Assigned role '{role}' to user {user_id}")
         except Exception as e:
             print(f"❌ Failed to assign role: {e}")
 
+    def count_documents(self, query) -> int:
+        """Count documents matching a query without downloading them.
+
+        Uses a server-side count aggregation. Backends without aggregation
+        support fall back to streaming document IDs only (``select([])``).
+        """
+        if self._aggregation_supported:
+            try:
+                result = query.count(alias='total').get()
+                return int(result[0][0].value)
+            except Exception as e:
+                print(f"⚠️ Count aggregation unavailable, streaming IDs instead: {e}")
+                self._aggregation_supported = False
+        return sum(1 for _ in query.select([]).stream())
+
+    def sum_field(self, query, field: str) -> int:
+        """Sum a numeric field over a query with a server-side sum aggregation.
+
+        Backends without sum aggregations fall back to streaming only that field.
+        """
+        if self._sum_supported:
+            try:
+                result = query.sum(field, alias='total').get()
+                return int(result[0][0].value or 0)
+            except Exception as e:
+                print(f"⚠️ Sum aggregation unavailable, streaming '{field}' instead: {e}")
+                self._sum_supported = False
+        return sum(int((doc.to_dict() or {}).get(field) or 0) for doc in query.select([field]).stream())
+
+    def _get_all(self, refs: List[Any], field_paths: Optional[List[str]] = None) -> Iterator[Any]:
+        """Batched document reads, one get_all call per BatchWriter.MAX_BATCH_SIZE references"""
+        for start in range(0, len(refs), BatchWriter.MAX_BATCH_SIZE):
+            yield from self.db.get_all(refs[start:start + BatchWriter.MAX_BATCH_SIZE], field_paths=field_paths)
+
+    def _list_ids(self, collection_name: str) -> List[str]:
+        """List document IDs of a collection without fetching their fields"""
+        return [doc['id'] for doc in self.iter_collection(collection_name, fields=[])]
+
     def get_statistics(self) -> Dict[str, int]:
-        """Get database statistics"""
+        """Get database statistics (document count per collection)"""
         try:
-            stats = {}
-            collections = ['departments', 'subclasses', 'subjects', 'users', 'notes', 'assignments']
-            
-            for collection_name in collections:
-                docs = self.db.collection(collection_name).get()
-                stats[collection_name] = len(docs)
-            
-            return stats
+            if self.mirror is not None:
+                stats = {name: self.mirror.count(name) for name in STAT_COLLECTIONS}
+                stats['downloads'] = sum(int(doc.get('downloads') or 0)
+                                         for doc in self.mirror.iter_collection('notes', fields=['downloads']))
+                return stats
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                downloads = pool.submit(self.sum_field, self.db.collection('notes'), 'downloads')
+                counts = pool.map(
+                    lambda name: self.count_documents(self.db.collection(name)),
+                    STAT_COLLECTIONS
+                )
+                stats = dict(zip(STAT_COLLECTIONS, counts))
+                stats['downloads'] = downloads.result()
+                return stats
         except Exception as e:
             print(f"❌ Failed to get statistics: {e}")
             return {}
 
-    def cleanup_orphaned_data(self):
-        """Clean up orphaned subclasses and subjects"""
+    def count_by(self, collection_name: str, field: str, values: List[Any]) -> Dict[str, int]:
+        """Count documents per value of ``field``.
+
+        Runs one count aggregation per value concurrently. Documents whose
+        value is not in ``values`` (or missing) are reported under ``(other)``.
+        Without aggregation support, a single ``select([field])`` pass is used.
+        """
+        if self.mirror is not None:
+            return self.mirror.count_by(collection_name, field, values)
+
+        collection = self.db.collection(collection_name)
+        if self._aggregation_supported:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                total_future = pool.submit(self.count_documents, collection)
+                counts = list(pool.map(
+                    lambda value: self.count_documents(collection.where(field, '==', value)),
+                    values
+                ))
+                total = total_future.result()
+            breakdown = {str(value): count for value, count in zip(values, counts)}
+            breakdown['(other)'] = total - sum(counts)
+            return breakdown
+
+        tally = Counter()
+        known = set(values)
+        for doc in collection.select([field]).stream():
+            value = (doc.to_dict() or {}).get(field)
+            tally[str(value) if value in known else '(other)'] += 1
+        breakdown = {str(value): tally.get(str(value), 0) for value in values}
+        breakdown['(other)'] = tally.get('(other)', 0)
+        return breakdown
+
+    def get_breakdowns(self) -> Dict[str, Dict[str, int]]:
+        """Get per-field statistics (notes per subclass, users per role/department, unapproved notes)"""
         try:
-            # Get all departments
-            departments = {dept['code']: dept for dept in self.get_all_departments()}
-            
-            # Check subclasses
-            subclasses = self.get_all_subclasses()
-            orphaned_subclasses = []
-            
-            for subclass in subclasses:
-                if subclass['department'] not in departments:
-                    orphaned_subclasses.append(subclass['id'])
-            
-            # Check subjects
-            subjects = self.get_all_subjects()
-            orphaned_subjects = []
-            
-            for subject in subjects:
-                if subject['department'] not in departments:
-                    orphaned_subjects.append(subject['id'])
-            
-            print(f"Found {len(orphaned_subclasses)} orphaned subclasses")
-            print(f"Found {len(orphaned_subjects)} orphaned subjects")
-            
-            # Optional: Delete orphaned data (uncomment if needed)
-            # for subclass_id in orphaned_subclasses:
-            #     self.db.collection('subclasses').document(subclass_id).delete()
-            # for subject_id in orphaned_subjects:
-            #     self.db.collection('subjects').document(subject_id).delete()
-            
+            breakdowns = {}
+            for name, (collection_name, field, values) in STAT_BREAKDOWNS.items():
+                if isinstance(values, str):
+                    values = self._list_ids(values)
+                breakdowns[name] = self.count_by(collection_name, field, values)
+
+            if self.mirror is not None:
+                unapproved = self.mirror.count('notes', [('approved', '==', False)])
+            else:
+                unapproved = self.count_documents(self.db.collection('notes').where('approved', '==', False))
+            breakdowns['notes_by_approval'] = {'unapproved': unapproved}
+            return breakdowns
+        except Exception as e:
+            print(f"❌ Failed to get statistics breakdowns: {e}")
+            return {}
+
+    def cleanup_orphaned_data(self, dry_run: bool = True, progress_every: int = 10000,
+                              sample_size: int = 10) -> Dict[str, Dict[str, Any]]:
+        """Find and fix dangling references across collections.
+
+        Reference collections are reduced to ID sets using projections; notes
+        and users are streamed page by page and checked against those sets, so
+        memory stays bounded by the number of departments/subclasses/subjects.
+        Fixes are queued on a BatchWriter as they are found unless ``dry_run``.
+
+        Checks (and fixes):
+          - subclasses/subjects whose department does not exist (deleted,
+            along with their subject catalog and search entries)
+          - notes whose subjectCode is unknown, or whose subclassId is unknown
+            and that are not shared (deleted)
+          - users whose subclass does not exist (subclass field removed)
+          - department subclass lists naming missing subclasses (pruned)
+        """
+        report = {}
+        writer = None if dry_run else self.bulk_writer()
+        deleted_subjects = set()
+
+        def scan(check: str, docs: Iterator[Dict[str, Any]], is_broken, fix) -> Dict[str, Any]:
+            result = {'scanned': 0, 'found': 0, 'sample': []}
+            for doc in docs:
+                result['scanned'] += 1
+                if is_broken(doc):
+                    result['found'] += 1
+                    if len(result['sample']) < sample_size:
+                        result['sample'].append(doc['id'])
+                    if writer is not None:
+                        fix(doc)
+                if progress_every and result['scanned'] % progress_every == 0:
+                    print(f"   ... {check}: scanned {result['scanned']}, found {result['found']}")
+            report[check] = result
+            return result
+
+        def delete_from(collection_name):
+            return lambda doc: writer.delete(self.db.collection(collection_name).document(doc['id']))
+
+        try:
+            departments = {dept['id'] for dept in self.iter_departments(fields=[])}
+
+            subclasses = set()
+            def orphaned_subclass(doc):
+                if doc.get('department') in departments:
+                    subclasses.add(doc['id'])
+                    return False
+                return True
+            scan('orphaned_subclasses', self.iter_subclasses(fields=['department']),
+                 orphaned_subclass, delete_from('subclasses'))
+
+            subjects = set()
+            def orphaned_subject(doc):
+                if doc.get('department') in departments:
+                    subjects.add(doc['id'])
+                    return False
+                return True
+            def delete_subject(doc):
+                delete_from('subjects')(doc)
+                deleted_subjects.add(doc.get('code') or doc['id'])
+            scan('orphaned_subjects', self.iter_subjects(fields=['department', 'code']),
+                 orphaned_subject, delete_subject)
+
+            def orphaned_note(doc):
+                if doc.get('subjectCode') not in subjects:
+                    return True
+                return doc.get('subclassId') not in subclasses and not doc.get('isShared')
+            def delete_note(doc):
+                delete_from('notes')(doc)
+                self.delete_download_shards(doc, writer)
+                self.unindex_note(doc['id'], doc, writer)
+            scan('orphaned_notes',
+                 self.iter_collection('notes', fields=['subclassId', 'subjectCode', 'isShared', 'downloadShards']),
+                 orphaned_note, delete_note)
+
+            scan('users_with_unknown_subclass',
+                 self.iter_collection('users', fields=['subclass']),
+                 lambda doc: bool(doc.get('subclass')) and doc['subclass'] not in subclasses,
+                 lambda doc: writer.update(self.db.collection('users').document(doc['id']),
+                                           {'subclass': firestore.DELETE_FIELD,
+                                            'updatedAt': firestore.SERVER_TIMESTAMP}))
+
+            scan('department_subclass_lists',
+                 self.iter_departments(fields=['subclasses']),
+                 lambda doc: any(sub not in subclasses for sub in doc.get('subclasses') or []),
+                 lambda doc: writer.update(self.db.collection('departments').document(doc['id']), {
+                     'subclasses': [sub for sub in doc.get('subclasses') or [] if sub in subclasses],
+                     'updatedAt': firestore.SERVER_TIMESTAMP
+                 }))
         except Exception as e:
             print(f"❌ Failed to cleanup: {e}")
+        finally:
+            if writer is not None:
+                writer.close()
+                self.cache.invalidate()
+                if deleted_subjects:
+                    self.rebuild_subject_catalogs()
+                    from search_index import SearchIndex
+                    SearchIndex(self).remove_subjects(deleted_subjects)
+
+        print(f"\n🧹 Integrity report{' (dry run)' if dry_run else ''}:")
+        for check, result in report.items():
+            print(f"   {check}: {result['found']} of {result['scanned']}")
+            if result['sample']:
+                print(f"      e.g. {', '.join(result['sample'])}")
+        return report
+
+    def _note_index_ref(self, doc_id: str):
+        return self.db.collection(NOTE_INDEX_COLLECTION).document(doc_id)
+
+    def index_note(self, note_id: str, previous: Optional[Dict[str, Any]] = None,
+                   writer: Optional[BatchWriter] = None, note_data: Optional[Dict[str, Any]] = None):
+        """Add or refresh one note in the visibility index.
+
+        The pages ``noteVisibility/{subclassId}-{n}`` hold a ``notes`` map of
+        the notes of one subclass and ``noteVisibility/_shared-{n}`` every
+        shared note; ``noteVisibility/_manifest`` lists the page counts, so a
+        student reads a few documents instead of scanning notes. Pass the
+        note's ``previous`` data when its subclass or sharing changed so
+        stale entries are removed, and ``note_data`` if already read. The
+        note's search index shards are refreshed too; with a ``writer``,
+        once it has flushed, together with every other note queued on it.
+        """
+        try:
+            if note_data is None:
+                snapshot = self.db.collection('notes').document(note_id).get()
+                if not snapshot.exists:
+                    self.unindex_note(note_id, previous or {}, writer)
+                    return
+                note_data = snapshot.to_dict()
+            self._write_note_entries(note_id, note_data, previous, writer)
+            self._queue_search_update(note_id, note_data, previous, writer)
+        except Exception as e:
+            print(f"❌ Failed to index note {note_id}: {e}")
+
+    def index_notes(self, changes: Dict[str, tuple]) -> bool:
+        """Re-index many notes given ``{note_id: (previous, current)}`` data (``current`` None if deleted).
+
+        Index entries go through one BatchWriter and the search index is
+        updated once afterwards, instead of a transaction per note. Returns
+        False if any index write failed.
+        """
+        if not changes:
+            return True
+        try:
+            with self.bulk_writer() as writer:
+                for note_id, (previous, current) in changes.items():
+                    if current is None:
+                        self.unindex_note(note_id, previous or {}, writer)
+                    else:
+                        self._write_note_entries(note_id, current, previous, writer)
+                        self._queue_search_update(note_id, current, previous, writer)
+            return not writer.stats['failed']
+        except Exception as e:
+            print(f"❌ Failed to index {len(changes)} notes: {e}")
+            return False
+
+    def _write_note_entries(self, note_id: str, note_data: Dict[str, Any], previous: Optional[Dict[str, Any]],
+                            writer: Optional[BatchWriter]):
+        targets = note_index_docs(note_data)
+        stale = [group for group in note_index_docs(previous or {}) if group not in targets]
+        summary = note_summary(note_data)
+        for group in targets:
+            self._write_index_entry(group, note_id, summary, writer)
+        for group in stale:
+            self._write_index_entry(group, note_id, firestore.DELETE_FIELD, writer)
+
+    def unindex_note(self, note_id: str, note_data: Dict[str, Any], writer: Optional[BatchWriter] = None):
+        """Remove a note from the index documents it was listed in"""
+        for doc_id in note_index_docs(note_data):
+            self._write_index_entry(doc_id, note_id, firestore.DELETE_FIELD, writer)
+        self._queue_search_update(note_id, None, note_data, writer)
+
+    def _queue_search_update(self, note_id: str, note_data: Optional[Dict[str, Any]],
+                             previous: Optional[Dict[str, Any]], writer: Optional[BatchWriter]):
+        """Refresh a note's search shards now, or in one pass after ``writer`` flushes"""
+        if writer is None:
+            self._update_search_index({note_id: note_data}, {note_id: previous} if previous else None)
+            return
+        if writer not in self._pending_search:
+            self._pending_search[writer] = ({}, {})
+            writer.on_flush(('search-index',),
+                            lambda: self._update_search_index(*self._pending_search.pop(writer)))
+        notes, previous_data = self._pending_search[writer]
+        notes[note_id] = note_data
+        if previous and note_id not in previous_data:
+            # Keep the oldest data so the note leaves every shard it was in
+            previous_data[note_id] = previous
+
+    def _update_search_index(self, notes: Dict[str, Optional[Dict[str, Any]]],
+                             previous: Optional[Dict[str, Dict[str, Any]]] = None):
+        if not notes:
+            return
+        from search_index import SearchIndex
+        SearchIndex(self).update_notes(notes, previous)
+
+    def _index_pages(self) -> Dict[str, int]:
+        if self._note_index_pages is None:
+            snapshot = self._note_index_ref(NOTE_INDEX_MANIFEST_DOC).get()
+            self._note_index_pages = dict((snapshot.to_dict() or {}).get('pages', {})) if snapshot.exists else {}
+        return self._note_index_pages
+
+    def _note_index_page(self, group: str, note_id: str) -> str:
+        pages = self._index_pages()
+        if group not in pages:
+            # A group first seen since the last rebuild starts with one page
+            pages[group] = 1
+            self._note_index_ref(NOTE_INDEX_MANIFEST_DOC).set({'pages': {group: 1}}, merge=True)
+        return note_index_page(group, note_id, pages[group])
+
+    def _write_index_entry(self, group: str, note_id: str, value: Any, writer: Optional[BatchWriter]):
+        ref = self._note_index_ref(self._note_index_page(group, note_id))
+        data = {'notes': {note_id: value}, 'updatedAt': firestore.SERVER_TIMESTAMP}
+        if writer is not None:
+            writer.set(ref, data, merge=True)
+        else:
+            ref.set(data, merge=True)
+
+    def approve_note(self, note_id: str, approved: bool = True):
+        """Set a note's approval and refresh its index entries"""
+        try:
+            self.db.collection('notes').document(note_id).update({
+                'approved': approved, 'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            self.index_note(note_id)
+            print(f"✅ Note {note_id} {'approved' if approved else 'rejected'}")
+        except Exception as e:
+            print(f"❌ Failed to update approval: {e}")
+
+    def delete_note(self, note_id: str):
+        """Delete a note and remove it from the visibility index"""
+        try:
+            note_ref = self.db.collection('notes').document(note_id)
+            snapshot = note_ref.get()
+            if not snapshot.exists:
+                print(f"❌ Note {note_id} not found")
+                return
+            note_data = snapshot.to_dict()
+            batch = self.db.batch()
+            batch.delete(note_ref)
+            for shard_ref in self._download_shard_refs(note_id, note_data.get('downloadShards') or DOWNLOAD_SHARDS):
+                batch.delete(shard_ref)
+            batch.commit()
+            self.unindex_note(note_id, note_data)
+            print(f"✅ Deleted note {note_id}")
+        except Exception as e:
+            print(f"❌ Failed to delete note: {e}")
+
+    def rebuild_note_index(self, notes: Optional[Iterator[Dict[str, Any]]] = None) -> Dict[str, int]:
+        """Backfill the visibility index from a single pass over ``notes``.
+
+        Every index page is rewritten from scratch and each group is
+        repartitioned for its size, which also repairs entries left behind
+        by writes that bypassed index_note. Pass ``notes`` (dicts with an
+        ``id``) to index those instead of reading the collection.
+        """
+        try:
+            groups: Dict[str, Dict[str, Any]] = {SHARED_NOTES_DOC: {}}
+            if notes is None:
+                notes = self.iter_collection('notes', fields=NOTE_SUMMARY_FIELDS + ['description'])
+            for note in notes:
+                summary = note_summary(note)
+                for group in note_index_docs(note):
+                    groups.setdefault(group, {})[note['id']] = summary
+
+            pages = {group: note_index_pages(len(entries)) for group, entries in groups.items()}
+            documents: Dict[str, Dict[str, Any]] = {}
+            for group, entries in groups.items():
+                for page in range(pages[group]):
+                    documents[f"{group}-{page}"] = {}
+                for note_id, summary in entries.items():
+                    documents[note_index_page(group, note_id, pages[group])][note_id] = summary
+            largest = max(estimate_size({'notes': entries}) for entries in documents.values())
+            if largest > NOTE_INDEX_WARN_BYTES:
+                print(f"⚠️ Largest note index page is {largest / 1024:.0f} KiB; "
+                      "lower NOTE_INDEX_PAGE_ENTRIES")
+
+            existing = {doc['id'] for doc in self.iter_collection(NOTE_INDEX_COLLECTION, fields=[])}
+            with self.bulk_writer() as writer:
+                for doc_id, entries in documents.items():
+                    writer.set(self._note_index_ref(doc_id), {
+                        'notes': entries, 'updatedAt': firestore.SERVER_TIMESTAMP
+                    })
+                writer.set(self._note_index_ref(NOTE_INDEX_MANIFEST_DOC), {
+                    'pages': pages, 'updatedAt': firestore.SERVER_TIMESTAMP
+                })
+                for doc_id in existing - set(documents) - {NOTE_INDEX_MANIFEST_DOC}:
+                    writer.delete(self._note_index_ref(doc_id))
+            self._note_index_pages = dict(pages)
+
+            counts = {group: len(entries) for group, entries in groups.items()}
+            print(f"✅ Rebuilt note index: {len(counts)} groups in {len(documents)} pages, "
+                  f"{sum(counts.values())} entries")
+            return counts
+        except Exception as e:
+            print(f"❌ Failed to rebuild note index: {e}")
+            return {}
+
+    def watch_note_index(self, seconds: float):
+        """Keep the visibility index current from a listener on ``notes`` for ``seconds``.
+
+        The app creates notes (UploadNotes) and approves them (NotesLibrary)
+        from the browser, which never calls index_note. The listener's first
+        snapshot rebuilds the index; after that each added, changed or
+        removed note is re-indexed, and a group that outgrows its pages is
+        repartitioned. Starting costs one read per note, then one per change.
+        """
+        # Summaries of the notes seen, to know what a change moved or removed
+        known: Dict[str, Dict[str, Any]] = {}
+        lock = threading.Lock()
+
+        def callback(snapshots, changes, read_time):
+            with lock:
+                first = not known and all(change.type.name == 'ADDED' for change in changes)
+                # Another run may have repartitioned the index since the last change
+                self._note_index_pages = None
+                for change in changes:
+                    note_id = change.document.id
+                    previous = known.get(note_id)
+                    if change.type.name == 'REMOVED':
+                        known.pop(note_id, None)
+                        if previous is not None:
+                            self.unindex_note(note_id, previous)
+                        continue
+                    data = change.document.to_dict() or {}
+                    known[note_id] = {**note_summary(data), 'id': note_id}
+                    if first or (previous is not None and
+                                 {**note_summary(data), 'id': note_id} == previous):
+                        continue
+                    self.index_note(note_id, previous=previous, note_data=data)
+                if first:
+                    self.rebuild_note_index(known.values())
+                    return
+                pages = self._index_pages()
+                counts = Counter(group for note in known.values() for group in note_index_docs(note))
+                if any(count > pages.get(group, 1) * NOTE_INDEX_PAGE_MAX_ENTRIES for group, count in counts.items()):
+                    self.rebuild_note_index(known.values())
+
+        watch = self.db.collection('notes').on_snapshot(callback)
+        print(f"👀 Keeping the note index current for {seconds:g}s (Ctrl-C stops)")
+        try:
+            time.sleep(seconds)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watch.unsubscribe()
+
+    def _download_shard_refs(self, note_id: str, shards: int = DOWNLOAD_SHARDS) -> List[Any]:
+        counters = self.db.collection('notes').document(note_id).collection(DOWNLOAD_SHARD_COLLECTION)
+        return [counters.document(DOWNLOAD_BASE_SHARD)] + [counters.document(str(i)) for i in range(shards)]
+
+    def download_counts(self, notes: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Live download count of each note: its shards once migrated, else its ``downloads``"""
+        counts = {note['id']: 0 if note.get('downloadShards') is not None else int(note.get('downloads') or 0)
+                  for note in notes}
+        refs = [ref for note in notes if note.get('downloadShards') is not None
+                for ref in self._download_shard_refs(note['id'], note['downloadShards'])]
+        for snapshot in self._get_all(refs, ['count']):
+            if snapshot.exists:
+                counts[snapshot.reference.parent.parent.id] += int((snapshot.to_dict() or {}).get('count') or 0)
+        return counts
+
+    def add_base_downloads(self, note_id: str, count: int, writer: BatchWriter):
+        """Queue adding ``count`` to a note's base shard, which every rollup includes"""
+        writer.set(self._download_shard_refs(note_id, 0)[0], {
+            'count': firestore.Increment(count), 'updatedAt': firestore.SERVER_TIMESTAMP
+        }, merge=True)
+
+    def delete_download_shards(self, note: Dict[str, Any], writer: BatchWriter):
+        """Queue deleting the counter shards of a note being deleted"""
+        for shard_ref in self._download_shard_refs(note['id'], note.get('downloadShards') or DOWNLOAD_SHARDS):
+            writer.delete(shard_ref)
+
+    def _write_base_shards(self, notes: List[Dict[str, Any]], writer: BatchWriter) -> bool:
+        """Copy each note's ``downloads`` into its base shard; False if any write failed.
+
+        The base shards are flushed before the caller sets the
+        ``downloadShards`` marker, so a note is never marked migrated
+        without its old count in place.
+        """
+        failed = writer.stats['failed']
+        for note in notes:
+            writer.set(self._download_shard_refs(note['id'], 0)[0], {
+                'count': int(note.get('downloads') or 0), 'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+        writer.flush()
+        if writer.stats['failed'] > failed:
+            print(f"❌ {writer.stats['failed'] - failed} counter migrations failed; nothing was marked migrated")
+            return False
+        return True
+
+    def migrate_download_counters(self, dry_run: bool = False) -> Dict[str, int]:
+        """Move existing ``downloads`` counts into sharded counters.
+
+        Notes already carrying the ``downloadShards`` marker are skipped, so
+        the migration can be re-run safely until every note is converted.
+        """
+        report = {'scanned': 0, 'migrated': 0, 'downloads': 0}
+        try:
+            pending = []
+            for note in self.iter_collection('notes', fields=['downloads', 'downloadShards']):
+                report['scanned'] += 1
+                if note.get('downloadShards') is None:
+                    pending.append(note)
+                    report['downloads'] += int(note.get('downloads') or 0)
+            if not dry_run and pending:
+                with self.bulk_writer() as writer:
+                    if not self._write_base_shards(pending, writer):
+                        return report
+                    for note in pending:
+                        writer.update(self.db.collection('notes').document(note['id']),
+                                      {'downloadShards': DOWNLOAD_SHARDS})
+            report['migrated'] = len(pending)
+            print(f"✅ {'Would migrate' if dry_run else 'Migrated'} {report['migrated']} of "
+                  f"{report['scanned']} notes ({report['downloads']} downloads) to "
+                  f"{DOWNLOAD_SHARDS} counter shards")
+        except Exception as e:
+            print(f"❌ Failed to migrate download counters: {e}")
+        return report
+
+    def rollup_download_counters(self, full: bool = False) -> Dict[str, Any]:
+        """Sum download counter shards back into ``notes.downloads``.
+
+        After the first run, only notes with a shard written since the last
+        rollup are visited: a collection-group query on the shards'
+        ``updatedAt`` (which needs a collection-group index exemption on
+        that field) finds them, and their shards are read with batched
+        get_all calls. The first run, or ``full``, sums every shard in one
+        collection-group scan. Notes not yet migrated are migrated on the
+        way. Changed totals are written to the notes and to their visibility
+        index entries; the watermark only advances when every write landed.
+        """
+        started = time.monotonic()
+        report = {'notes': 0, 'updated': 0, 'migrated': 0, 'shards_read': 0}
+        state_ref = self.db.collection(ROLLUP_STATE_COLLECTION).document('downloads')
+        try:
+            state = state_ref.get()
+            watermark = None if full or not state.exists else (state.to_dict() or {}).get('watermark')
+            shards = self.db.collection_group(DOWNLOAD_SHARD_COLLECTION)
+            totals, bases = Counter(), Counter()
+            newest = watermark
+
+            def add_shard(snapshot):
+                nonlocal newest
+                report['shards_read'] += 1
+                data = snapshot.to_dict() or {}
+                note_id = snapshot.reference.parent.parent.id
+                if snapshot.id == DOWNLOAD_BASE_SHARD:
+                    bases[note_id] += int(data.get('count') or 0)
+                else:
+                    totals[note_id] += int(data.get('count') or 0)
+                if data.get('updatedAt') and (newest is None or data['updatedAt'] > newest):
+                    newest = data['updatedAt']
+
+            if watermark is None:
+                for snapshot in shards.select(['count', 'updatedAt']).stream():
+                    add_shard(snapshot)
+                notes = list(self.iter_collection('notes', fields=ROLLUP_NOTE_FIELDS))
+            else:
+                changed = set()
+                for snapshot in shards.where('updatedAt', '>', watermark).select(['updatedAt']).stream():
+                    changed.add(snapshot.reference.parent.parent.id)
+                note_refs = [self.db.collection('notes').document(note_id) for note_id in sorted(changed)]
+                notes = [{**(snapshot.to_dict() or {}), 'id': snapshot.id}
+                         for snapshot in self._get_all(note_refs, ROLLUP_NOTE_FIELDS) if snapshot.exists]
+                shard_refs = [ref for note in notes for ref in
+                              self._download_shard_refs(note['id'], note.get('downloadShards') or DOWNLOAD_SHARDS)]
+                for snapshot in self._get_all(shard_refs, ['count', 'updatedAt']):
+                    if snapshot.exists:
+                        add_shard(snapshot)
+                    else:
+                        report['shards_read'] += 1
+
+            report['notes'] = len(notes)
+            changes = {}
+            with self.bulk_writer() as writer:
+                unmigrated = [note for note in notes if note.get('downloadShards') is None]
+                if unmigrated and not self._write_base_shards(unmigrated, writer):
+                    return report
+                for note in notes:
+                    fields = {}
+                    if note.get('downloadShards') is None:
+                        # The base shard was just set to the old count
+                        total = int(note.get('downloads') or 0) + totals[note['id']]
+                        fields['downloadShards'] = DOWNLOAD_SHARDS
+                        report['migrated'] += 1
+                    else:
+                        total = bases[note['id']] + totals[note['id']]
+                    if total != int(note.get('downloads') or 0):
+                        fields['downloads'] = total
+                        changes[note['id']] = (note, total)
+                    if fields:
+                        writer.update(self.db.collection('notes').document(note['id']),
+                                      {**fields, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                self._refresh_indexed_downloads(changes, writer)
+            report['updated'] = len(changes)
+            if writer.stats['failed']:
+                print(f"❌ {writer.stats['failed']} rollup writes failed; the next run retries them")
+                return report
+            if newest is not None and newest != watermark:
+                state_ref.set({'watermark': newest, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            report['seconds'] = round(time.monotonic() - started, 3)
+            print(f"✅ Rolled up downloads of {report['notes']} notes: {report['updated']} updated, "
+                  f"{report['migrated']} migrated, {report['shards_read']} shards read "
+                  f"in {report['seconds']}s")
+        except Exception as e:
+            print(f"❌ Failed to roll up download counters: {e}")
+        return report
+
+    def _refresh_indexed_downloads(self, changes: Dict[str, tuple], writer: BatchWriter):
+        """Update ``downloads`` of the visibility index entries of notes that are indexed"""
+        by_doc: Dict[str, Dict[str, tuple]] = {}
+        for note_id, (note, total) in changes.items():
+            for group in note_index_docs(note):
+                by_doc.setdefault(self._note_index_page(group, note_id), {})[note_id] = (group, total)
+        refs = [self._note_index_ref(doc_id) for doc_id in sorted(by_doc)]
+        for snapshot in self._get_all(refs, ['notes']):
+            listed = (snapshot.to_dict() or {}).get('notes', {}) if snapshot.exists else {}
+            for note_id, (group, total) in by_doc[snapshot.id].items():
+                # Entries are only merged into, never created, so unindexed notes stay out
+                if note_id in listed:
+                    self._write_index_entry(group, note_id, {'downloads': total}, writer)
+
+    def rebuild_department_catalog(self, dept_code: str, writer: Optional[BatchWriter] = None):
+        """Rebuild one department's subject catalog from the two useSubjects queries"""
+        subjects = list(self.iter_subjects(dept_code, fields=CATALOG_SUBJECT_FIELDS))
+        subjects += self.iter_collection('subjects', [('isShared', '==', True),
+                                                      ('sharedWith', 'array-contains', dept_code)],
+                                         CATALOG_SUBJECT_FIELDS)
+        ref = self.db.collection(SUBJECT_CATALOG_COLLECTION).document(dept_code)
+        data = {'department': dept_code, 'subjects': build_catalog(subjects),
+                'updatedAt': firestore.SERVER_TIMESTAMP}
+        if writer is not None:
+            writer.set(ref, data)
+        else:
+            ref.set(data)
+
+    def refresh_subject_catalogs(self, departments: set):
+        """Rebuild the catalogs of the given departments"""
+        try:
+            for dept_code in sorted(departments):
+                self.rebuild_department_catalog(dept_code)
+        except Exception as e:
+            print(f"❌ Failed to refresh subject catalogs: {e}")
+
+    def update_subject_sharing(self, subject_code: str, shared_with: List[str],
+                               is_shared: Optional[bool] = None):
+        """Change which departments a subject is shared with and refresh affected catalogs"""
+        try:
+            subject_ref = self.db.collection('subjects').document(subject_code)
+            snapshot = subject_ref.get()
+            if not snapshot.exists:
+                print(f"❌ Subject {subject_code} not found")
+                return
+            before = snapshot.to_dict()
+            updates = {'sharedWith': shared_with, 'updatedAt': firestore.SERVER_TIMESTAMP}
+            if is_shared is not None:
+                updates['isShared'] = is_shared
+            subject_ref.update(updates)
+            self.cache.invalidate('subjects')
+
+            after = {**before, **updates}
+            self.refresh_subject_catalogs(subject_departments(before) | subject_departments(after))
+            print(f"✅ {subject_code} now shared with: {shared_with}")
+        except Exception as e:
+            print(f"❌ Failed to update subject sharing: {e}")
+
+    def rebuild_subject_catalogs(self) -> Dict[str, int]:
+        """Rebuild every department catalog from a single pass over ``subjects``"""
+        try:
+            per_department: Dict[str, List[Dict[str, Any]]] = {
+                dept['id']: [] for dept in self.iter_departments(fields=[])
+            }
+            for subject in self.iter_subjects(fields=CATALOG_SUBJECT_FIELDS):
+                for dept_code in subject_departments(subject):
+                    per_department.setdefault(dept_code, []).append(subject)
+
+            existing = {doc['id'] for doc in self.iter_collection(SUBJECT_CATALOG_COLLECTION, fields=[])}
+            with self.bulk_writer() as writer:
+                for dept_code, subjects in per_department.items():
+                    writer.set(self.db.collection(SUBJECT_CATALOG_COLLECTION).document(dept_code), {
+                        'department': dept_code, 'subjects': build_catalog(subjects),
+                        'updatedAt': firestore.SERVER_TIMESTAMP
+                    })
+                for dept_code in existing - set(per_department):
+                    writer.delete(self.db.collection(SUBJECT_CATALOG_COLLECTION).document(dept_code))
+
+            counts = {dept_code: len(subjects) for dept_code, subjects in per_department.items()}
+            print(f"✅ Rebuilt {len(counts)} subject catalogs")
+            return counts
+        except Exception as e:
+            print(f"❌ Failed to rebuild subject catalogs: {e}")
+            return {}
+
+# Actions that change data only report what they would change unless --apply is given
+PREVIEW_ACTIONS = ['init', 'cleanup', 'batch', 'assign-roles', 'rollover', 'dedup-notes',
+                   'migrate-downloads', 'restore']
 
 def main():
     parser = argparse.ArgumentParser(description='Firestore Management Tool')
-    parser.add_argument('--action', choices=['init', 'stats', 'cleanup', 'interactive'], 
+    parser.add_argument('--action', choices=['init', 'stats', 'cleanup', 'sync', 'index-notes',
+                                             'build-catalogs', 'batch', 'assign-roles', 'rollover',
+                                             'audit-files', 'dedup-notes', 'build-search-index',
+                                             'migrate-downloads', 'rollup-downloads', 'export-snapshot',
+                                             'backup', 'restore', 'interactive'], 
                       default='interactive', help='Action to perform')
     parser.add_argument('--config', default='config/college_data.json', 
                       help='Path to college configuration file')
+    parser.add_argument('--breakdown', action='store_true',
+                      help='With --action stats, also count notes/users per field')
+    parser.add_argument('--script', default='-',
+                      help="With --action batch, file of commands to run ('-' for stdin)")
+    parser.add_argument('--role', choices=USER_ROLES,
+                      help='With --action assign-roles, the role to give every targeted user')
+    parser.add_argument('--department',
+                      help='With --action assign-roles, target users of this department; '
+                           'with --action restore, restore only this department')
+    parser.add_argument('--subclass', help='With --action assign-roles, target users of this subclass')
+    parser.add_argument('--current-role', choices=USER_ROLES,
+                      help='With --action assign-roles, target users currently holding this role')
+    parser.add_argument('--ids-file', help='With --action assign-roles, file of user IDs to target')
+    parser.add_argument('--checkpoint', default='role_assignment.checkpoint.json',
+                      help='With --action assign-roles, progress file used to resume an interrupted run')
+    parser.add_argument('--files-api',
+                      help='With --action audit-files/dedup-notes, upload server API base URL (default $VITE_API_BASE_URL)')
+    parser.add_argument('--files-dir',
+                      help='With --action audit-files/dedup-notes, read a local directory of files named by file ID instead')
+    parser.add_argument('--audit-cache', default='note_audit_cache.json',
+                      help='With --action audit-files, results cache so only new or changed notes are re-checked')
+    parser.add_argument('--recheck', action='store_true',
+                      help='With --action audit-files, ignore cached results')
+    parser.add_argument('--workers', type=int, default=16,
+                      help='With --action audit-files/dedup-notes, concurrent file lookups; '
+                           'with --action backup/restore, collections processed at once')
+    parser.add_argument('--report-file', help='With --action audit-files, also write the report as JSON')
+    parser.add_argument('--deleted-file-id',
+                      help='With --action audit-files, a Drive file ID known to be deleted; the audit only runs '
+                           'if the server reports it as dead (default: an ID that cannot exist)')
+    parser.add_argument('--search-file',
+                      help='With --action build-search-index, also write the index to this file (.json or .json.gz)')
+    parser.add_argument('--interval', type=float, default=0,
+                      help='With --action rollup-downloads, repeat every N seconds until interrupted')
+    parser.add_argument('--full-rollup', action='store_true',
+                      help='With --action rollup-downloads, sum every counter shard instead of recent ones')
+    parser.add_argument('--rehash', action='store_true',
+                      help='With --action dedup-notes, hash every note file again, not only unhashed ones')
+    parser.add_argument('--delete-files', action='store_true',
+                      help='With --action dedup-notes --apply, delete files no note references after merging')
+    parser.add_argument('--backup-file', help='With --action backup/restore, the backup file')
+    parser.add_argument('--collection', action='append',
+                      help='With --action backup/restore, only this collection (repeatable)')
+    parser.add_argument('--apply', action='store_true',
+                      help=f"With --action {'/'.join(PREVIEW_ACTIONS)}, write the changes; "
+                           'without it these actions only report what they would change')
+    parser.add_argument('--term', help='With --action rollover, label of the term being started (e.g. 2026-odd)')
+    parser.add_argument('--mapping', help='With --action rollover, JSON file of old -> new subclass IDs')
+    parser.add_argument('--max-semester', type=int, default=8,
+                      help='With --action rollover, subclasses past this semester graduate')
+    parser.add_argument('--reset-crs', action='store_true',
+                      help='With --action rollover, turn class representatives back into students')
+    parser.add_argument('--diff-limit', type=int, default=50,
+                      help='With --action rollover, changes shown per phase (0 for all)')
+    parser.add_argument('--cache-file',
+                      help='Snapshot file used to start the reference cache warm between runs')
+    parser.add_argument('--cache-ttl', type=float, default=300,
+                      help='Seconds a cached department/subclass/subject list stays valid')
+    parser.add_argument('--backend', choices=BACKENDS, default='firestore',
+                      help="Storage backend; 'memory' runs what-if actions without touching Firestore")
+    parser.add_argument('--snapshot',
+                      help='With --backend memory, dump to load (JSON export or --mirror file); '
+                           'with --action export-snapshot, file to write')
+    parser.add_argument('--mirror',
+                      help='SQLite mirror file; synced incrementally and used for stats and dry-run cleanup reads')
+    parser.add_argument('--full-sync', action='store_true',
+                      help='With --mirror, re-pull whole collections (also picks up deletions)')
+    parser.add_argument('--watch', type=float, default=0,
+                      help='With --action sync, keep applying live changes for N seconds; with '
+                           '--action index-notes, keep the note index current for N seconds')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                      help='Run stats/cleanup on the async client with concurrent queries')
+    
+    parser.add_argument('--profile', action='store_true',
+                      help='Print the Firestore reads/writes/latency each command cost')
+    parser.add_argument('--log-calls', action='store_true',
+                      help='Log every Firestore call as a JSON line on stderr')
+    parser.add_argument('--metrics-file',
+                      help='Write call metrics as a Prometheus textfile to this path')
+    parser.add_argument('--openmetrics', action='store_true',
+                      help='Write --metrics-file in OpenMetrics format instead')
     
     args = parser.parse_args()
     
-    fm = FirestoreManager()
+    if args.apply and args.action not in PREVIEW_ACTIONS:
+        print(f"❌ --apply only applies to --action {', '.join(PREVIEW_ACTIONS)}")
+        sys.exit(1)
+    error = check_action_args(args)
+    if error:
+        print(f"❌ {error}")
+        sys.exit(1)
+    
+    if args.use_async and args.action in ('stats', 'cleanup'):
+        run_async_action(args)
+        return
+    
+    profiler = None
+    if args.profile or args.log_calls or args.metrics_file:
+        profiler = Profiler(log_calls=args.log_calls)
+        if args.log_calls:
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    # A memory backend must not share the reference cache file with real Firestore runs
+    cache_file = args.cache_file if args.backend == 'firestore' else None
+    fm = FirestoreManager(cache=ReferenceCache(ttl=args.cache_ttl, snapshot_path=cache_file),
+                          profiler=profiler, backend=args.backend, snapshot=args.snapshot)
+    if args.backend == 'memory':
+        print("⚠️ Memory backend: changes are not written back to Firestore")
     
-    if args.action == 'stats':
-        stats = fm.get_statistics()
-        print("\n📊 Database Statistics:")
-        for collection, count in stats.items():
-            print(f"   {collection}: {count}")
+    try:
+        status = run_with_mirror(fm, args, profiler)
+    except BackendUnavailable:
+        # FirestoreManager.db already said why
+        sys.exit(1)
+    
+    fm.cache.save()
+    if profiler is not None:
+        if args.profile:
+            profiler.print_summary()
+        if args.metrics_file:
+            profiler.write_metrics(args.metrics_file, openmetrics=args.openmetrics)
+    if status:
+        sys.exit(status)
+
+def check_action_args(args) -> Optional[str]:
+    """Why the arguments cannot run the selected --action, or None; checked before connecting"""
+    if args.action == 'init' and not os.path.exists(args.config):
+        return f"Config not found: {args.config}"
+    if args.action == 'sync' and not args.mirror:
+        return "--action sync requires --mirror <path>"
+    if args.action == 'assign-roles' and not args.role:
+        return "--action assign-roles requires --role"
+    if args.action == 'rollover' and not args.term:
+        return "--action rollover requires --term"
+    if args.action == 'export-snapshot' and not args.snapshot:
+        return "--action export-snapshot requires --snapshot <path>"
+    if args.action in ('backup', 'restore') and not args.backup_file:
+        return f"--action {args.action} requires --backup-file <path>"
+    return None
+
+def run_with_mirror(fm: FirestoreManager, args, profiler: Optional[Profiler]) -> int:
+    """Sync the --mirror if one is given, then run the action; returns an exit status"""
+    # Connect up front: the actions report their own failures and would swallow this one
+    fm.db
+    if args.mirror:
+        from firestore_sync import LocalMirror, SyncEngine, print_sync_report
+        with profiled(profiler, 'sync'):
+            engine = SyncEngine(fm, LocalMirror(args.mirror))
+            sync_report = engine.sync(full=args.full_sync)
+            print_sync_report(sync_report)
+            if args.watch:
+                engine.watch(args.watch)
+        unsynced = [name for name in engine.collections if name not in sync_report]
+        if args.action == 'cleanup' and args.apply:
+            # An incremental mirror misses deletions and documents without updatedAt;
+            # deleting notes or clearing fields based on it could destroy live data
+            print("⚠️ cleanup --apply reads Firestore directly; the mirror is only used for dry runs")
+        elif args.action in ('stats', 'cleanup') and unsynced:
+            print(f"⚠️ {', '.join(unsynced)} failed to sync; reading Firestore instead of the mirror")
+        elif args.action in ('stats', 'cleanup'):
+            fm.mirror = engine.mirror
+            if args.action == 'cleanup' and not args.full_sync:
+                print("⚠️ An incremental mirror misses deletions; re-run with --full-sync "
+                      "before trusting reported orphans")
+    
+    with profiled(profiler, args.action):
+        return run_action(fm, args)
+
+def run_action(fm: FirestoreManager, args) -> int:
+    """Dispatch the --action selected on the command line; returns an exit status"""
+    if args.action == 'init':
+        from catalog_importer import import_catalog
+        import_catalog(fm, args.config, dry_run=not args.apply)
+    
+    elif args.action == 'stats':
+        print_statistics(fm.get_statistics(), fm.get_breakdowns() if args.breakdown else None)
     
     elif args.action == 'cleanup':
-        fm.cleanup_orphaned_data()
+        fm.cleanup_orphaned_data(dry_run=not args.apply)
+    
+    elif args.action == 'index-notes':
+        if args.watch:
+            fm.watch_note_index(args.watch)
+        else:
+            fm.rebuild_note_index()
+    
+    elif args.action == 'build-catalogs':
+        fm.rebuild_subject_catalogs()
+    
+    elif args.action == 'batch':
+        from admin_shell import open_script, run_script
+        with open_script(args.script) as source:
+            summary = run_script(fm, source, dry_run=not args.apply)
+        if summary['errors']:
+            return 1
+    
+    elif args.action == 'assign-roles':
+        from role_engine import assign_roles, read_id_file
+        try:
+            report = assign_roles(
+                fm, args.role, dry_run=not args.apply, department=args.department,
+                subclass=args.subclass, current_role=args.current_role,
+                user_ids=read_id_file(args.ids_file) if args.ids_file else None,
+                checkpoint_path=args.checkpoint
+            )
+        except (OSError, ValueError) as e:
+            print(f"❌ Role assignment failed: {e}")
+            return 1
+        if not report['completed']:
+            return 1
+    
+    elif args.action == 'rollover':
+        from rollover import run_rollover
+        try:
+            stats = run_rollover(fm, args.term, mapping_path=args.mapping, dry_run=not args.apply,
+                                 max_semester=args.max_semester, reset_crs=args.reset_crs,
+                                 diff_limit=args.diff_limit or None)
+        except (OSError, ValueError) as e:
+            print(f"❌ Rollover failed: {e}")
+            return 1
+        if stats is None:
+            return 1
+    
+    elif args.action == 'audit-files':
+        from note_auditor import DEFAULT_FILES_API, audit_note_files
+        report = audit_note_files(fm, files_api=args.files_api or DEFAULT_FILES_API,
+                                  files_dir=args.files_dir, cache_path=args.audit_cache,
+                                  max_workers=args.workers, recheck=args.recheck,
+                                  report_path=args.report_file, deleted_file_id=args.deleted_file_id)
+        if report is None or any(status != 'ok' for status in report['statuses']):
+            return 1
+    
+    elif args.action == 'dedup-notes':
+        from note_dedup import DEFAULT_FILES_API, dedup_notes
+        result = dedup_notes(fm, files_api=args.files_api or DEFAULT_FILES_API, files_dir=args.files_dir,
+                             apply=args.apply, delete_files=args.delete_files, rehash=args.rehash,
+                             max_workers=args.workers)
+        if result['hashes']['hash_errors']:
+            return 1
+    
+    elif args.action == 'build-search-index':
+        from search_index import SearchIndex
+        if not SearchIndex(fm).rebuild(output_path=args.search_file):
+            return 1
+    
+    elif args.action == 'migrate-downloads':
+        fm.migrate_download_counters(dry_run=not args.apply)
+    
+    elif args.action == 'rollup-downloads':
+        full = args.full_rollup
+        while True:
+            fm.rollup_download_counters(full=full)
+            if not args.interval:
+                break
+            full = False
+            try:
+                time.sleep(args.interval)
+            except KeyboardInterrupt:
+                break
+    
+    elif args.action == 'export-snapshot':
+        export_snapshot(fm.db, args.snapshot, subcollections=[DOWNLOAD_SHARD_COLLECTION])
+    
+    elif args.action in ('backup', 'restore'):
+        from backup import backup_campus, restore_campus
+        if args.action == 'backup':
+            report = backup_campus(fm, args.backup_file, collections=args.collection, max_workers=args.workers)
+        else:
+            report = restore_campus(fm, args.backup_file, collections=args.collection,
+                                    department=args.department, dry_run=not args.apply,
+                                    max_workers=args.workers)
+        if report is None or report.get('writes', {}).get('failed'):
+            return 1
     
     elif args.action == 'interactive':
         interactive_mode(fm)
+    return 0
+
+def run_async_action(args):
+    """Run stats or cleanup through AsyncFirestoreManager"""
+    import asyncio
+    from async_firestore_manager import AsyncFirestoreManager
+    
+    async def run():
+        afm = AsyncFirestoreManager()
+        if args.action == 'stats':
+            if args.breakdown:
+                stats, breakdowns = await asyncio.gather(afm.get_statistics(), afm.get_breakdowns())
+            else:
+                stats, breakdowns = await afm.get_statistics(), None
+            print_statistics(stats, breakdowns)
+        else:
+            await afm.cleanup_orphaned_data(dry_run=not args.apply)
+    
+    asyncio.run(run())
+
+def print_statistics(stats: Dict[str, int], breakdowns: Optional[Dict[str, Dict[str, int]]] = None):
+    """Print collection counts and optional per-field breakdowns"""
+    print("\n📊 Database Statistics:")
+    for collection, count in stats.items():
+        print(f"   {collection}: {count}")
+    
+    for name, counts in (breakdowns or {}).items():
+        print(f"\n   {name}:")
+        for value, count in counts.items():
+            if count:
+                print(f"      {value}: {count}")
+
+# Profiler command names of the interactive menu entries
+MENU_COMMANDS = {
+    '1': 'stats', '2': 'list-departments', '3': 'list-subclasses', '4': 'list-subjects',
+    '5': 'add-department', '6': 'add-subclass', '7': 'add-subject', '8': 'assign-role',
+    '9': 'init-sample', '10': 'stats-breakdown',
+}
 
 def interactive_mode(fm: FirestoreManager):
     """Interactive mode for managing Firestore"""
@@ -231,67 +1605,77 @@ def interactive_mode(fm: FirestoreManager):
         print("7. Add Subject")
         print("8. Assign User Role")
         print("9. Initialize with Sample Data")
+        print("10. View Statistics with Breakdowns")
         print("0. Exit")
         
-        choice = input("\nEnter your choice (0-9): ").strip()
+        choice = input("\nEnter your choice (0-10): ").strip()
         
         if choice == '0':
+            cache_stats = fm.cache.stats()
+            print(f"📦 Reference cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
             break
-        elif choice == '1':
-            stats = fm.get_statistics()
-            print("\n📊 Database Statistics:")
-            for collection, count in stats.items():
-                print(f"   {collection}: {count}")
         
-        elif choice == '2':
-            departments = fm.get_all_departments()
-            print(f"\n🏢 Departments ({len(departments)}):")
-            for dept in departments:
-                print(f"   {dept['code']}: {dept['name']}")
+        with profiled(fm.profiler, MENU_COMMANDS.get(choice, 'interactive')):
+            if choice == '1':
+                print_statistics(fm.get_statistics())
+
+            elif choice == '10':
+                # One count query per subclass, role and department, so not part of option 1
+                print_statistics(fm.get_statistics(), fm.get_breakdowns())
         
-        elif choice == '3':
-            departments = fm.get_all_departments()
-            print("\nSelect department (or press Enter for all):")
-            for i, dept in enumerate(departments):
-                print(f"{i+1}. {dept['code']}")
+            elif choice == '2':
+                departments = fm.get_all_departments()
+                print(f"\n🏢 Departments ({len(departments)}):")
+                for dept in departments:
+                    print(f"   {dept['code']}: {dept['name']}")
+        
+            elif choice == '3':
+                departments = fm.get_all_departments()
+                print("\nSelect department (or press Enter for all):")
+                for i, dept in enumerate(departments):
+                    print(f"{i+1}. {dept['code']}")
             
-            choice_dept = input("Enter number or press Enter: ").strip()
-            dept_filter = None
-            if choice_dept.isdigit() and 1 <= int(choice_dept) <= len(departments):
-                dept_filter = departments[int(choice_dept)-1]['code']
+                choice_dept = input("Enter number or press Enter: ").strip()
+                dept_filter = None
+                if choice_dept.isdigit() and 1 <= int(choice_dept) <= len(departments):
+                    dept_filter = departments[int(choice_dept)-1]['code']
             
-            subclasses = fm.get_all_subclasses(dept_filter)
-            print(f"\n🎓 Subclasses ({len(subclasses)}):")
-            for subclass in subclasses:
-                print(f"   {subclass['id']}: {subclass['name']} (Year {subclass['year']})")
+                print("\n🎓 Subclasses:")
+                count = 0
+                for subclass in fm.iter_subclasses(dept_filter):
+                    print(f"   {subclass['id']}: {subclass['name']} (Year {subclass['year']})")
+                    count += 1
+                print(f"   ({count} total)")
         
-        elif choice == '4':
-            departments = fm.get_all_departments()
-            print("\nSelect department (or press Enter for all):")
-            for i, dept in enumerate(departments):
-                print(f"{i+1}. {dept['code']}")
+            elif choice == '4':
+                departments = fm.get_all_departments()
+                print("\nSelect department (or press Enter for all):")
+                for i, dept in enumerate(departments):
+                    print(f"{i+1}. {dept['code']}")
             
-            choice_dept = input("Enter number or press Enter: ").strip()
-            dept_filter = None
-            if choice_dept.isdigit() and 1 <= int(choice_dept) <= len(departments):
-                dept_filter = departments[int(choice_dept)-1]['code']
+                choice_dept = input("Enter number or press Enter: ").strip()
+                dept_filter = None
+                if choice_dept.isdigit() and 1 <= int(choice_dept) <= len(departments):
+                    dept_filter = departments[int(choice_dept)-1]['code']
             
-            subjects = fm.get_all_subjects(dept_filter)
-            print(f"\n📚 Subjects ({len(subjects)}):")
-            for subject in subjects:
-                shared_text = " (Shared)" if subject.get('isShared') else ""
-                print(f"   {subject['code']}: {subject['name']}{shared_text}")
+                print("\n📚 Subjects:")
+                count = 0
+                for subject in fm.iter_subjects(dept_filter):
+                    shared_text = " (Shared)" if subject.get('isShared') else ""
+                    print(f"   {subject['code']}: {subject['name']}{shared_text}")
+                    count += 1
+                print(f"   ({count} total)")
         
-        elif choice == '5':
-            add_department_interactive(fm)
-        elif choice == '6':
-            add_subclass_interactive(fm)
-        elif choice == '7':
-            add_subject_interactive(fm)
-        elif choice == '8':
-            assign_role_interactive(fm)
-        elif choice == '9':
-            initialize_sample_data(fm)
+            elif choice == '5':
+                add_department_interactive(fm)
+            elif choice == '6':
+                add_subclass_interactive(fm)
+            elif choice == '7':
+                add_subject_interactive(fm)
+            elif choice == '8':
+                assign_role_interactive(fm)
+            elif choice == '9':
+                initialize_sample_data(fm)
 
 def add_department_interactive(fm: FirestoreManager):
     """Interactive department addition"""
@@ -414,15 +1798,15 @@ def assign_role_interactive(fm: FirestoreManager):
     print("3. admin")
     
     choice = input("Select role number: ").strip()
-    roles = {'1': 'student', '2': 'cr', '3': 'admin'}
+    roles = {str(i + 1): role for i, role in enumerate(USER_ROLES)}
     
     if choice in roles:
         fm.assign_user_role(user_id, roles[choice])
     else:
         print("❌ Invalid choice")
 
-def initialize_sample_data(fm: FirestoreManager):
-    """Initialize with comprehensive sample data"""
+def initialize_sample_data(fm: FirestoreManager) -> bool:
+    """Initialize with comprehensive sample data; returns False if any write failed"""
     print("\n🚀 Initializing with sample data...")
     
     # Sample departments
@@ -434,9 +1818,11 @@ def initialize_sample_data(fm: FirestoreManager):
         {'code': 'ECE', 'name': 'Electronics & Communication'}
     ]
     
+    writer = fm.bulk_writer()
+    
     # Create departments
     for dept in departments:
-        fm.create_department(dept)
+        fm.create_department(dept, writer)
     
     # Sample subclasses
     subclasses = [
@@ -459,7 +1845,10 @@ def initialize_sample_data(fm: FirestoreManager):
     
     # Create subclasses
     for subclass in subclasses:
-        fm.create_subclass(subclass)
+        fm.create_subclass(subclass, writer)
+    
+    # Departments must exist before their subclass lists can be updated
+    writer.flush()
     
     # Update department subclass lists
     dept_subclasses = {
@@ -469,7 +1858,7 @@ def initialize_sample_data(fm: FirestoreManager):
     }
     
     for dept_code, subclass_list in dept_subclasses.items():
-        fm.update_department_subclasses(dept_code, subclass_list)
+        fm.update_department_subclasses(dept_code, subclass_list, writer)
     
     # Sample subjects
     subjects = [
@@ -495,9 +1884,15 @@ def initialize_sample_data(fm: FirestoreManager):
     
     # Create subjects
     for subject in subjects:
-        fm.create_subject(subject)
+        fm.create_subject(subject, writer)
     
+    failed = writer.close()['failed']
+    if failed:
+        print(f"❌ {failed} sample data writes failed; run the initialization again")
+        return False
+    fm.rebuild_subject_catalogs()
     print("✅ Sample data initialization complete!")
+    return True
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
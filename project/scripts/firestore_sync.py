@@ -0,0 +1,239 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Dict, List, Any, Optional, Iterator
+
+from firestore_manager import FirestoreManager, STAT_COLLECTIONS
+from storage_backend import json_default, json_object_hook
+
+WATERMARK_FIELD = 'updatedAt'
+
+def _matches(data: Dict[str, Any], field: str, op: str, value: Any) -> bool:
+    current = data.get(field)
+    if op == '==':
+        return current == value
+    if op == '!=':
+        return current != value
+    if op == 'in':
+        return current in value
+    if op == 'array-contains':
+        return isinstance(current, list) and value in current
+    if op == 'array-contains-any':
+        return isinstance(current, list) and any(item in current for item in value)
+    raise ValueError(f"Unsupported mirror filter operator: {op}")
+
+class LocalMirror:
+    """SQLite mirror of selected Firestore collections.
+
+    Each document is stored as one JSON row keyed by (collection, id), and
+    ``sync_state`` keeps the per-collection watermark used by incremental
+    pulls. Reads use the same ``(field, op, value)`` filter tuples as
+    FirestoreManager.iter_collection.
+    """
+
+    def __init__(self, path: str = 'firestore_mirror.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript('''
+            CREATE TABLE IF NOT EXISTS documents (
+                collection TEXT NOT NULL,
+                id TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (collection, id)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS sync_state (
+                collection TEXT PRIMARY KEY,
+                watermark TEXT,
+                synced_at REAL
+            );
+        ''')
+
+    def close(self):
+        self.conn.close()
+
+    def upsert(self, collection_name: str, docs: List[Dict[str, Any]]):
+        rows = [(collection_name, doc['id'], json.dumps(doc, default=json_default)) for doc in docs]
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO documents (collection, id, data) VALUES (?, ?, ?)', rows
+            )
+
+    def delete(self, collection_name: str, doc_ids: List[str]):
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM documents WHERE collection = ? AND id = ?',
+                                  [(collection_name, doc_id) for doc_id in doc_ids])
+
+    def replace_collection(self, collection_name: str, keep_ids: set):
+        """Delete mirrored documents of a collection that are not in ``keep_ids``"""
+        stale = [row[0] for row in self.conn.execute(
+            'SELECT id FROM documents WHERE collection = ?', (collection_name,)
+        ) if row[0] not in keep_ids]
+        self.delete(collection_name, stale)
+        return len(stale)
+
+    def get_watermark(self, collection_name: str) -> Optional[datetime]:
+        row = self.conn.execute('SELECT watermark FROM sync_state WHERE collection = ?',
+                                (collection_name,)).fetchone()
+        return datetime.fromisoformat(row[0]) if row and row[0] else None
+
+    def set_watermark(self, collection_name: str, watermark: Optional[datetime]):
+        with self._lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO sync_state (collection, watermark, synced_at) VALUES (?, ?, ?)',
+                (collection_name, watermark.isoformat() if watermark else None, time.time())
+            )
+
+    def iter_collection(self, collection_name: str, filters: Optional[List[tuple]] = None,
+                        fields: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Stream mirrored documents in ID order, like FirestoreManager.iter_collection"""
+        sql = 'SELECT data FROM documents WHERE collection = ?'
+        params: List[Any] = [collection_name]
+        python_filters = []
+        for field, op, value in filters or []:
+            if op == '==' and isinstance(value, (str, int, float, bool)):
+                sql += " AND json_extract(data, ?) = ?"
+                params += [f'$.{field}', value]
+            else:
+                python_filters.append((field, op, value))
+        sql += ' ORDER BY id'
+
+        for (raw,) in self.conn.execute(sql, params):
+            data = json.loads(raw, object_hook=json_object_hook)
+            if all(_matches(data, *f) for f in python_filters):
+                if fields is not None:
+                    data = {**{key: data[key] for key in fields if key in data}, 'id': data['id']}
+                yield data
+
+    def count(self, collection_name: str, filters: Optional[List[tuple]] = None) -> int:
+        if not filters:
+            return self.conn.execute('SELECT COUNT(*) FROM documents WHERE collection = ?',
+                                     (collection_name,)).fetchone()[0]
+        return sum(1 for _ in self.iter_collection(collection_name, filters, fields=[]))
+
+    def count_by(self, collection_name: str, field: str, values: List[Any]) -> Dict[str, int]:
+        tally = Counter(
+            value for (value,) in self.conn.execute(
+                'SELECT json_extract(data, ?) FROM documents WHERE collection = ?',
+                (f'$.{field}', collection_name)
+            )
+        )
+        breakdown = {str(value): tally.get(value, 0) for value in values}
+        breakdown['(other)'] = sum(tally.values()) - sum(breakdown.values())
+        return breakdown
+
+class SyncEngine:
+    """Keeps a LocalMirror up to date with Firestore.
+
+    The first pull of a collection is a full paginated scan. Later pulls
+    only ask for documents whose ``updatedAt`` is at or after the stored
+    watermark, so their cost is proportional to what changed. Watermark
+    pulls cannot see deletions; run a full pull periodically, or use
+    ``watch()``, whose listeners also deliver removals.
+    """
+
+    def __init__(self, fm: FirestoreManager, mirror: LocalMirror,
+                 collections: Optional[List[str]] = None, page_size: int = 500):
+        self.fm = fm
+        self.mirror = mirror
+        self.collections = collections or list(STAT_COLLECTIONS)
+        self.page_size = page_size
+
+    def _pull(self, collection_name: str, query) -> Dict[str, Any]:
+        watermark = self.mirror.get_watermark(collection_name)
+        seen_ids = set()
+        page, pulled = [], 0
+        last_doc = None
+        query = query.limit(self.page_size)
+        while True:
+            current = query.start_after(last_doc) if last_doc is not None else query
+            count = 0
+            for doc in current.stream():
+                data = doc.to_dict() or {}
+                data['id'] = doc.id
+                stamp = data.get(WATERMARK_FIELD)
+                if isinstance(stamp, datetime) and (watermark is None or stamp > watermark):
+                    watermark = stamp
+                page.append(data)
+                seen_ids.add(doc.id)
+                last_doc = doc
+                count += 1
+            if page:
+                self.mirror.upsert(collection_name, page)
+                pulled += len(page)
+                page = []
+            if count < self.page_size:
+                break
+        self.mirror.set_watermark(collection_name, watermark)
+        return {'pulled': pulled, 'seen_ids': seen_ids, 'watermark': watermark}
+
+    def full_pull(self, collection_name: str) -> Dict[str, int]:
+        """Mirror a whole collection, dropping rows deleted remotely"""
+        query = self.fm.db.collection(collection_name).order_by('__name__')
+        result = self._pull(collection_name, query)
+        removed = self.mirror.replace_collection(collection_name, result['seen_ids'])
+        return {'pulled': result['pulled'], 'removed': removed}
+
+    def incremental_pull(self, collection_name: str) -> Dict[str, int]:
+        """Pull only documents changed since the stored watermark"""
+        watermark = self.mirror.get_watermark(collection_name)
+        if watermark is None:
+            return self.full_pull(collection_name)
+        query = (self.fm.db.collection(collection_name)
+                 .where(WATERMARK_FIELD, '>=', watermark)
+                 .order_by(WATERMARK_FIELD))
+        return {'pulled': self._pull(collection_name, query)['pulled'], 'removed': 0}
+
+    def sync(self, full: bool = False) -> Dict[str, Dict[str, int]]:
+        """Bring every configured collection up to date"""
+        report = {}
+        for collection_name in self.collections:
+            started = time.monotonic()
+            try:
+                if full:
+                    report[collection_name] = self.full_pull(collection_name)
+                else:
+                    report[collection_name] = self.incremental_pull(collection_name)
+            except Exception as e:
+                print(f"❌ Failed to sync {collection_name}: {e}")
+                continue
+            report[collection_name]['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+    def watch(self, seconds: float):
+        """Apply real-time listener updates to the mirror for ``seconds``"""
+        def on_snapshot(collection_name):
+            def callback(snapshots, changes, read_time):
+                upserts, removals = [], []
+                for change in changes:
+                    if change.type.name == 'REMOVED':
+                        removals.append(change.document.id)
+                    else:
+                        data = change.document.to_dict() or {}
+                        data['id'] = change.document.id
+                        upserts.append(data)
+                if upserts:
+                    self.mirror.upsert(collection_name, upserts)
+                if removals:
+                    self.mirror.delete(collection_name, removals)
+            return callback
+
+        watches = [self.fm.db.collection(name).on_snapshot(on_snapshot(name))
+                   for name in self.collections]
+        try:
+            time.sleep(seconds)
+        finally:
+            for watch in watches:
+                watch.unsubscribe()
+
+def print_sync_report(report: Dict[str, Dict[str, int]]):
+    """Print documents pulled per collection"""
+    print("\n🔄 Sync report:")
+    for collection_name, result in report.items():
+        print(f"   {collection_name}: {result['pulled']} pulled, {result['removed']} removed "
+              f"({result['seconds']}s)")
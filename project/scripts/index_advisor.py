@@ -0,0 +1,428 @@
+"""Works out the Firestore indexes the app's queries need.
+
+Every query the web app and the admin scripts issue is declared in
+QUERY_CATALOG. The advisor decides which ones need a composite index (or
+a collection-group field override), compares that with the project's
+``firestore.indexes.json`` and can rewrite the file. It also estimates
+each query's read cost on a synthetic campus with and without the index:
+the cost with it is the page the query returns; without it, the best the
+client can do is read everything one automatic single-field index
+matches (or the whole collection) and filter and sort locally.
+
+    python scripts/index_advisor.py                      # report, exit 1 if indexes are missing
+    python scripts/index_advisor.py --write              # add missing indexes to firestore.indexes.json
+    python scripts/index_advisor.py --scale 100k         # estimate on a larger synthetic campus
+    python scripts/index_advisor.py --backend memory --snapshot dump.json.gz   # ... or on real data
+    python scripts/index_advisor.py --probe              # run each query against Firestore
+
+--probe needs a real project: the emulator serves every query whether or
+not it is indexed.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+from typing import Dict, List, Any, Optional, Tuple
+
+from firestore_client import DEFAULT_SERVICE_ACCOUNT
+from notes_api import feed_query_catalog
+
+DEFAULT_INDEXES_FILE = 'firestore.indexes.json'
+
+EQUALITY_OPS = {'==', 'in'}
+ARRAY_OPS = {'array-contains', 'array-contains-any'}
+RANGE_OPS = {'<', '<=', '>', '>=', '!=', 'not-in'}
+
+# Parameter bindings tried per query; each comes from a document the query could match
+BINDINGS_PER_QUERY = 5
+BINDING_CANDIDATES = 2000
+
+# Values starting with '$' are parameters, bound from sampled documents of the collection.
+# ``replaces`` names the client-side scan a query would stand in for.
+QUERY_CATALOG: List[Dict[str, Any]] = [
+    {'name': 'useSubjects department', 'source': 'src/hooks/useSubjects.ts', 'collection': 'subjects',
+     'filters': [['department', '==', '$department']]},
+    {'name': 'useSubjects sharedWith', 'source': 'src/hooks/useSubjects.ts', 'collection': 'subjects',
+     'filters': [['isShared', '==', True], ['sharedWith', 'array-contains', '$department']]},
+    {'name': 'Dashboard assignments', 'source': 'src/components/Dashboard/Dashboard.tsx',
+     'collection': 'assignments', 'filters': [['subclassId', '==', '$subclass']]},
+    {'name': 'Dashboard notes', 'source': 'src/components/Dashboard/Dashboard.tsx', 'collection': 'notes',
+     'filters': [['subclassId', '==', '$subclass']]},
+    {'name': 'NotesLibrary class notes, newest', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['subclassId', '==', '$subclass']],
+     'order_by': [['createdAt', 'DESCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary class notes, oldest', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['subclassId', '==', '$subclass']],
+     'order_by': [['createdAt', 'ASCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary class notes, most downloaded', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['subclassId', '==', '$subclass']],
+     'order_by': [['downloads', 'DESCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary class notes, by title', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['subclassId', '==', '$subclass']],
+     'order_by': [['title', 'ASCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary class notes by subject', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['subclassId', '==', '$subclass'], ['subjectCode', '==', '$subject']],
+     'order_by': [['createdAt', 'DESCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary shared notes, newest', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'filters': [['isShared', '==', True]],
+     'order_by': [['createdAt', 'DESCENDING']], 'limit': 50, 'replaces': 'NotesLibrary full scan'},
+    {'name': 'NotesLibrary admin view, newest', 'source': 'src/components/Notes/NotesLibrary.tsx',
+     'collection': 'notes', 'order_by': [['createdAt', 'DESCENDING']], 'limit': 50,
+     'replaces': 'NotesLibrary full scan'},
+    {'name': 'download counter rollup', 'source': 'scripts/firestore_manager.py rollup_download_counters',
+     'collection': 'downloadShards', 'group': True, 'filters': [['updatedAt', '>', '$watermark']]},
+]
+# Every filter and sort combination of the notes feed API
+QUERY_CATALOG += feed_query_catalog()
+
+def _is_parameter(value) -> bool:
+    return isinstance(value, str) and value.startswith('$')
+
+def _normalize(query: Dict[str, Any]) -> Dict[str, Any]:
+    """Catalog entry with defaults filled in and operators spelled the console way"""
+    return {**query, 'filters': [[field, op.replace('_', '-'), value] for field, op, value in query.get('filters', [])],
+            'order_by': [list(order) for order in query.get('order_by', [])],
+            'group': bool(query.get('group')), 'limit': query.get('limit')}
+
+def required_index(query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The composite index a query needs, or None if automatic indexes serve it.
+
+    Single-field indexes serve one filter or one sort; several equality
+    filters alone are served by merging them. Anything else (array-contains
+    or a range with another clause, equality with a sort, several sorts)
+    needs a composite index: equality fields first, then the array field,
+    then range fields, then sorts.
+    """
+    query = _normalize(query)
+    equality = [field for field, op, _ in query['filters'] if op in EQUALITY_OPS]
+    arrays = [field for field, op, _ in query['filters'] if op in ARRAY_OPS]
+    ranges = list(dict.fromkeys(field for field, op, _ in query['filters'] if op in RANGE_OPS))
+    orders = [(field, direction) for field, direction in query['order_by'] if field not in equality]
+    clauses = len(equality) + len(arrays) + len(ranges)
+    order_fields = [field for field, _ in orders]
+
+    needs_composite = (
+        (arrays and clauses + len(orders) > 1)
+        or len(ranges) > 1
+        or (ranges and (equality or any(field not in ranges for field in order_fields)))
+        or (orders and (equality or len(orders) > 1))
+    )
+    if not needs_composite:
+        return None
+    directions = dict(orders)
+    fields = [{'fieldPath': field, 'order': 'ASCENDING'} for field in dict.fromkeys(equality)]
+    fields += [{'fieldPath': field, 'arrayConfig': 'CONTAINS'} for field in arrays]
+    fields += [{'fieldPath': field, 'order': directions.get(field, 'ASCENDING')} for field in ranges]
+    fields += [{'fieldPath': field, 'order': direction} for field, direction in orders if field not in ranges]
+    return {'collectionGroup': query['collection'],
+            'queryScope': 'COLLECTION_GROUP' if query['group'] else 'COLLECTION', 'fields': fields}
+
+def required_field_override(query: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Collection-group queries on one field need that field indexed at group scope, which is opt-in"""
+    query = _normalize(query)
+    if not query['group'] or required_index(query) is not None:
+        return None
+    fields = [(field, op) for field, op, _ in query['filters']] + [(field, None) for field, _ in query['order_by']]
+    if not fields:
+        return None
+    field, op = fields[0]
+    scope = {'arrayConfig': 'CONTAINS'} if op in ARRAY_OPS else {'order': 'ASCENDING'}
+    if query['order_by']:
+        scope = {'order': query['order_by'][0][1]}
+    # An override replaces the field's automatic indexes, so those are declared again
+    indexes = [{'order': 'ASCENDING', 'queryScope': 'COLLECTION'},
+               {'order': 'DESCENDING', 'queryScope': 'COLLECTION'},
+               {'arrayConfig': 'CONTAINS', 'queryScope': 'COLLECTION'},
+               {**scope, 'queryScope': 'COLLECTION_GROUP'}]
+    return {'collectionGroup': query['collection'], 'fieldPath': field, 'indexes': indexes}
+
+def _field_key(field: Dict[str, Any]) -> Tuple[str, str]:
+    return field['fieldPath'], field.get('order') or field.get('arrayConfig')
+
+def equality_count(query: Dict[str, Any]) -> int:
+    """Number of leading index fields that come from equality filters"""
+    return len({field for field, op, _ in _normalize(query)['filters'] if op in EQUALITY_OPS})
+
+def index_serves(existing: Dict[str, Any], required: Dict[str, Any], unordered: int = 0) -> bool:
+    """Whether a declared index serves a required one; its first ``unordered`` fields may come in any order"""
+    if (existing.get('collectionGroup'), existing.get('queryScope', 'COLLECTION')) != \
+            (required['collectionGroup'], required['queryScope']):
+        return False
+    have = [_field_key(field) for field in existing.get('fields', []) if field['fieldPath'] != '__name__']
+    need = [_field_key(field) for field in required['fields']]
+    return (len(have) == len(need) and set(have[:unordered]) == set(need[:unordered])
+            and have[unordered:] == need[unordered:])
+
+def override_serves(existing: Dict[str, Any], required: Dict[str, Any]) -> bool:
+    if (existing.get('collectionGroup'), existing.get('fieldPath')) != \
+            (required['collectionGroup'], required['fieldPath']):
+        return False
+    declared = [{key: value for key, value in index.items()} for index in existing.get('indexes', [])]
+    return all(index in declared for index in required['indexes'] if index['queryScope'] == 'COLLECTION_GROUP')
+
+def load_index_config(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {'indexes': [], 'fieldOverrides': []}
+    with open(path, encoding='utf-8') as fp:
+        config = json.load(fp)
+    config.setdefault('indexes', [])
+    config.setdefault('fieldOverrides', [])
+    return config
+
+def plan_indexes(catalog: List[Dict[str, Any]], config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Per query: the index or override it needs and whether ``config`` already declares it"""
+    plans = []
+    for query in catalog:
+        index, override = required_index(query), required_field_override(query)
+        unordered = equality_count(query)
+        declared = True
+        if index is not None:
+            declared = any(index_serves(existing, index, unordered) for existing in config['indexes'])
+        elif override is not None:
+            declared = any(override_serves(existing, override) for existing in config['fieldOverrides'])
+        plans.append({'query': query, 'index': index, 'override': override, 'unordered': unordered,
+                      'declared': declared})
+    return plans
+
+def merge_config(config: Dict[str, Any], plans: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], int]:
+    """``config`` with every missing index and override added (declared ones are kept as they are)"""
+    merged = {**config, 'indexes': list(config['indexes']), 'fieldOverrides': list(config['fieldOverrides'])}
+    added = 0
+    for plan in plans:
+        if plan['declared']:
+            continue
+        if plan['index'] is not None and not any(index_serves(existing, plan['index'], plan['unordered'])
+                                                 for existing in merged['indexes']):
+            merged['indexes'].append(plan['index'])
+            added += 1
+        elif plan['override'] is not None:
+            merged['fieldOverrides'] = [existing for existing in merged['fieldOverrides']
+                                        if (existing.get('collectionGroup'), existing.get('fieldPath')) !=
+                                        (plan['override']['collectionGroup'], plan['override']['fieldPath'])]
+            merged['fieldOverrides'].append(plan['override'])
+            added += 1
+    merged['indexes'].sort(key=lambda index: (index['collectionGroup'], json.dumps(index['fields'])))
+    merged['fieldOverrides'].sort(key=lambda override: (override['collectionGroup'], override['fieldPath']))
+    return merged, added
+
+class CostEstimator:
+    """Read costs of catalog queries on a client the memory engine (or emulator) serves unindexed.
+
+    Parameters are bound from documents the query's constant filters match,
+    so each binding finds data. Costs are averaged over the bindings.
+    """
+
+    def __init__(self, fm, bindings: int = BINDINGS_PER_QUERY, seed: int = 42):
+        self.fm = fm
+        self.bindings = bindings
+        self.rng = random.Random(seed)
+        self._sizes: Dict[Tuple[str, bool], int] = {}
+
+    def _base(self, query: Dict[str, Any]):
+        db = self.fm.db
+        return db.collection_group(query['collection']) if query['group'] else db.collection(query['collection'])
+
+    def _size(self, query: Dict[str, Any]) -> int:
+        key = (query['collection'], query['group'])
+        if key not in self._sizes:
+            self._sizes[key] = self.fm.count_documents(self._base(query))
+        return self._sizes[key]
+
+    def _bindings(self, query: Dict[str, Any]) -> List[List[list]]:
+        """Filter lists with every '$parameter' replaced by a value from a sampled document"""
+        if not any(_is_parameter(value) for _, _, value in query['filters']):
+            return [query['filters']]
+        base = self._base(query)
+        for field, op, value in query['filters']:
+            if not _is_parameter(value):
+                base = base.where(field, op, value)
+        docs = [doc.to_dict() or {} for doc in base.limit(BINDING_CANDIDATES).stream()]
+        bound = []
+        for data in self.rng.sample(docs, min(self.bindings, len(docs))):
+            filters = []
+            for field, op, value in query['filters']:
+                if _is_parameter(value):
+                    value = data.get(field)
+                    if op in ARRAY_OPS:
+                        value = self.rng.choice(value) if value else None
+                        value = [value] if op == 'array-contains-any' else value
+                    elif op == 'in':
+                        value = [value]
+                filters.append([field, op, value])
+            bound.append(filters)
+        return bound
+
+    def _count(self, query: Dict[str, Any], filters: List[list]) -> int:
+        ref = self._base(query)
+        for field, op, value in filters:
+            ref = ref.where(field, op, value)
+        return self.fm.count_documents(ref)
+
+    def estimate(self, query: Dict[str, Any]) -> Dict[str, Any]:
+        """Average reads with the index, with the best single-field fallback, and with a full scan"""
+        query = _normalize(query)
+        size = self._size(query)
+        indexed, fallback = [], []
+        for filters in self._bindings(query):
+            matches = self._count(query, filters) if filters else size
+            page = min(matches, query['limit']) if query['limit'] else matches
+            indexed.append(max(page, 1))
+            if required_index(query) is None:
+                fallback.append(max(page, 1))
+                continue
+            # Without the composite index the client fetches what one automatic index
+            # can serve (one filter, or one sort over everything) and finishes locally
+            options = [self._count(query, [f]) for f in filters]
+            if not filters:
+                options.append(size)
+            fallback.append(max(min(options) if options else size, 1))
+        return {'collection_size': size,
+                'indexed_reads': round(statistics.mean(indexed), 1) if indexed else None,
+                'fallback_reads': round(statistics.mean(fallback), 1) if fallback else None,
+                'scan_reads': max(size, 1)}
+
+def probe_queries(db, catalog: List[Dict[str, Any]]) -> Dict[str, Optional[str]]:
+    """Run each query (limit 1, parameters bound to placeholders) and capture index errors.
+
+    Firestore rejects an unindexed query with FAILED_PRECONDITION and a
+    console link that creates the index; the emulator never does.
+    """
+    results = {}
+    for query in map(_normalize, catalog):
+        ref = db.collection_group(query['collection']) if query['group'] else db.collection(query['collection'])
+        for field, op, value in query['filters']:
+            if _is_parameter(value):
+                value = ['_probe'] if op in ('in', 'not-in', 'array-contains-any') else '_probe'
+            ref = ref.where(field, op, value)
+        for field, direction in query['order_by']:
+            ref = ref.order_by(field, direction=direction)
+        try:
+            list(ref.limit(1).stream())
+            results[query['name']] = None
+        except Exception as e:
+            results[query['name']] = str(e)
+    return results
+
+def describe_index(index: Dict[str, Any]) -> str:
+    fields = ', '.join(f"{field['fieldPath']} {field.get('order') or field.get('arrayConfig')}"
+                       for field in index['fields'])
+    scope = ' (collection group)' if index['queryScope'] == 'COLLECTION_GROUP' else ''
+    return f"{index['collectionGroup']}: {fields}{scope}"
+
+def print_advice(plans: List[Dict[str, Any]], costs: Dict[str, Dict[str, Any]],
+                 probes: Optional[Dict[str, Optional[str]]], config_path: str):
+    print(f"\n🗂️  Index advice against {config_path}:")
+    for plan in plans:
+        query = plan['query']
+        if plan['index'] is not None:
+            need = describe_index(plan['index'])
+        elif plan['override'] is not None:
+            need = f"{query['collection']}.{plan['override']['fieldPath']} at collection-group scope"
+        else:
+            need = None
+        status = '✅' if plan['declared'] else '❌'
+        print(f"\n   {status} {query['name']}  ({query['source']})")
+        print(f"      needs: {need or 'automatic single-field indexes'}"
+              f"{'' if plan['declared'] else '  — MISSING'}")
+        cost = costs.get(query['name'])
+        if cost and cost['indexed_reads'] is None:
+            print(f"      reads: not estimated, no {query['collection']} documents in the data")
+        elif cost:
+            print(f"      reads: {cost['indexed_reads']} indexed, {cost['fallback_reads']} without the index, "
+                  f"{cost['scan_reads']} scanning all {cost['collection_size']} {query['collection']}")
+            if query.get('replaces') and cost['indexed_reads']:
+                print(f"      replaces {query['replaces']}: {cost['scan_reads'] / cost['indexed_reads']:.0f}x fewer reads")
+        if probes and probes.get(query['name']):
+            print(f"      ⚠️ Firestore rejected it: {probes[query['name']]}")
+
+def write_index_config(path: str, config: Dict[str, Any]):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fp:
+        json.dump(config, fp, indent=2)
+        fp.write('\n')
+    os.replace(tmp_path, path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Derive the Firestore indexes the app's queries need")
+    parser.add_argument('--indexes', default=DEFAULT_INDEXES_FILE, help='Index config to check and update')
+    parser.add_argument('--write', action='store_true', help='Add missing indexes to the index config')
+    parser.add_argument('--catalog', help='JSON list of queries to use instead of the built-in catalog')
+    parser.add_argument('--scale', default='10k', help='Synthetic campus size for cost estimates (see benchmark.py)')
+    parser.add_argument('--no-costs', action='store_true', help='Skip the cost estimates')
+    parser.add_argument('--backend', choices=['synthetic', 'memory', 'firestore'], default='synthetic',
+                        help="Data for cost estimates: a synthetic campus, a --snapshot, or the Firestore "
+                             "project/emulator (FIRESTORE_EMULATOR_HOST)")
+    parser.add_argument('--snapshot', help='With --backend memory, dump to load')
+    parser.add_argument('--probe', action='store_true',
+                        help='Run each query against --backend firestore to catch index errors')
+    parser.add_argument('--report-file', help='Also write the advice as JSON')
+    args = parser.parse_args()
+
+    catalog = QUERY_CATALOG
+    if args.catalog:
+        with open(args.catalog, encoding='utf-8') as fp:
+            catalog = json.load(fp)
+    try:
+        config = load_index_config(args.indexes)
+    except (OSError, ValueError) as e:
+        print(f"❌ Could not read {args.indexes}: {e}")
+        sys.exit(1)
+    plans = plan_indexes(catalog, config)
+
+    costs: Dict[str, Dict[str, Any]] = {}
+    probes = None
+    if not args.no_costs or args.probe:
+        from firestore_manager import FirestoreManager
+        from storage_backend import BackendUnavailable, MemoryClient, connect
+        try:
+            if args.backend == 'synthetic':
+                from benchmark import SCALES, generate_campus
+                if args.scale not in SCALES:
+                    print(f"❌ Unknown scale {args.scale} (expected one of {', '.join(SCALES)})")
+                    sys.exit(1)
+                fm = FirestoreManager(db=MemoryClient())
+                print(f"🌱 Generating a {args.scale} synthetic campus...")
+                generate_campus(fm, SCALES[args.scale])
+            else:
+                fm = FirestoreManager(db=connect(args.backend, DEFAULT_SERVICE_ACCOUNT, args.snapshot))
+        except BackendUnavailable as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        if args.probe:
+            if args.backend != 'firestore':
+                print("⚠️ --probe only detects missing indexes with --backend firestore")
+            probes = probe_queries(fm.db, catalog)
+        if not args.no_costs:
+            estimator = CostEstimator(fm)
+            for query in catalog:
+                try:
+                    costs[query['name']] = estimator.estimate(query)
+                except Exception as e:
+                    print(f"⚠️ Could not estimate {query['name']}: {e}")
+
+    print_advice(plans, costs, probes, args.indexes)
+    missing = [plan for plan in plans if not plan['declared']]
+    if args.report_file:
+        with open(args.report_file, 'w', encoding='utf-8') as fp:
+            json.dump({'plans': [{'query': plan['query']['name'], 'index': plan['index'],
+                                  'override': plan['override'], 'declared': plan['declared'],
+                                  'cost': costs.get(plan['query']['name'])} for plan in plans]},
+                      fp, indent=2, default=str)
+        print(f"💾 Saved index advice to {args.report_file}")
+
+    if not missing:
+        print(f"\n✅ {args.indexes} declares every index the catalog needs")
+        return
+    if args.write:
+        merged, added = merge_config(config, plans)
+        write_index_config(args.indexes, merged)
+        print(f"\n💾 Added {added} indexes/overrides to {args.indexes}; deploy with "
+              "`firebase deploy --only firestore:indexes`")
+        return
+    print(f"\n❌ {len(missing)} queries need indexes {args.indexes} does not declare (pass --write to add them)")
+    sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Any, Optional, Tuple
+
+logger = logging.getLogger('firestore.calls')
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Reads billed per count aggregation: one per 1000 index entries matched
+AGGREGATION_ENTRIES_PER_READ = 1000
+
+def estimate_size(data: Optional[Dict[str, Any]]) -> int:
+    """Approximate encoded size of a document's fields in bytes"""
+    if not data:
+        return 0
+    return len(json.dumps(data, default=str, separators=(',', ':')).encode('utf-8'))
+
+class _Stats:
+    __slots__ = ('calls', 'seconds', 'reads', 'writes', 'bytes_read', 'bytes_written', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.reads = 0
+        self.writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+class Profiler:
+    """Collects latency, document and byte counts for Firestore calls.
+
+    Records are keyed by ``(command, call, collection)``: the admin command
+    running at the time (see ``command()``), the kind of call such as
+    ``query.stream`` or ``batch.commit``, and the collection it touched.
+    """
+
+    def __init__(self, log_calls: bool = False):
+        self.log_calls = log_calls
+        self.current_command = 'default'
+        self._records: Dict[Tuple[str, str, str], _Stats] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def command(self, name: str):
+        """Attribute calls made inside the block to the admin command ``name``"""
+        previous, self.current_command = self.current_command, name
+        try:
+            yield self
+        finally:
+            self.current_command = previous
+
+    def record(self, call: str, collection: str, seconds: float, reads: int = 0, writes: int = 0,
+               bytes_read: int = 0, bytes_written: int = 0):
+        key = (self.current_command, call, collection)
+        bucket = next((i for i, bound in enumerate(LATENCY_BUCKETS) if seconds <= bound),
+                      len(LATENCY_BUCKETS))
+        with self._lock:
+            stats = self._records.get(key)
+            if stats is None:
+                stats = self._records[key] = _Stats()
+            stats.calls += 1
+            stats.seconds += seconds
+            stats.reads += reads
+            stats.writes += writes
+            stats.bytes_read += bytes_read
+            stats.bytes_written += bytes_written
+            stats.buckets[bucket] += 1
+        if self.log_calls:
+            logger.info(json.dumps({
+                'command': key[0], 'call': call, 'collection': collection,
+                'ms': round(seconds * 1000, 3), 'reads': reads, 'writes': writes,
+                'bytesRead': bytes_read, 'bytesWritten': bytes_written,
+            }))
+
+    def totals(self, command: Optional[str] = None) -> Dict[str, Any]:
+        """Summed counters, optionally for one command only"""
+        total = {'calls': 0, 'seconds': 0.0, 'reads': 0, 'writes': 0, 'bytes_read': 0, 'bytes_written': 0}
+        with self._lock:
+            for (cmd, _, _), stats in self._records.items():
+                if command is None or cmd == command:
+                    for field in total:
+                        total[field] += getattr(stats, field)
+        return total
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """One row per (command, call, collection), slowest first"""
+        with self._lock:
+            rows = [{
+                'command': cmd, 'call': call, 'collection': collection, 'calls': stats.calls,
+                'seconds': stats.seconds, 'reads': stats.reads, 'writes': stats.writes,
+                'bytes_read': stats.bytes_read, 'bytes_written': stats.bytes_written,
+                'p95_ms': self._percentile_ms(stats, 0.95),
+            } for (cmd, call, collection), stats in self._records.items()]
+        return sorted(rows, key=lambda row: row['seconds'], reverse=True)
+
+    @staticmethod
+    def _percentile_ms(stats: _Stats, quantile: float) -> Optional[float]:
+        """Upper bound of the histogram bucket holding the given quantile"""
+        target = math.ceil(stats.calls * quantile)
+        seen = 0
+        for bound, count in zip(LATENCY_BUCKETS + [math.inf], stats.buckets):
+            seen += count
+            if seen >= target:
+                return None if bound == math.inf else bound * 1000
+        return None
+
+    def print_summary(self):
+        """Print a per-command cost summary"""
+        commands = sorted({row['command'] for row in self.summary()})
+        print("\n🧾 Firestore cost profile:")
+        for command in commands:
+            total = self.totals(command)
+            print(f"   {command}: {total['reads']} reads, {total['writes']} writes, "
+                  f"{total['bytes_read'] / 1024:.1f} KiB in, {total['bytes_written'] / 1024:.1f} KiB out, "
+                  f"{total['calls']} calls, {total['seconds']:.3f}s")
+            for row in self.summary():
+                if row['command'] == command:
+                    p95 = f"≤{row['p95_ms']:g}ms" if row['p95_ms'] is not None else '>10s'
+                    print(f"      {row['call']:<18} {row['collection']:<16} x{row['calls']:<5} "
+                          f"{row['reads']:>7} reads {row['writes']:>6} writes  p95 {p95}")
+
+    def write_metrics(self, path: str, openmetrics: bool = False):
+        """Write a Prometheus textfile (or OpenMetrics exposition) of the counters"""
+        lines = [
+            '# HELP firestore_call_duration_seconds Latency of Firestore calls.',
+            '# TYPE firestore_call_duration_seconds histogram',
+        ]
+        counter_lines = {
+            'firestore_documents_read': ('reads', 'Documents read (billed reads).'),
+            'firestore_documents_written': ('writes', 'Documents written.'),
+            'firestore_bytes_read': ('bytes_read', 'Approximate document bytes received.'),
+            'firestore_bytes_written': ('bytes_written', 'Approximate document bytes sent.'),
+        }
+        counters = {name: [] for name in counter_lines}
+        with self._lock:
+            records = list(self._records.items())
+        for (command, call, collection), stats in records:
+            labels = f'command="{command}",call="{call}",collection="{collection}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                lines.append(f'firestore_call_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'firestore_call_duration_seconds_bucket{{{labels},le="+Inf"}} {stats.calls}')
+            lines.append(f'firestore_call_duration_seconds_sum{{{labels}}} {stats.seconds:.6f}')
+            lines.append(f'firestore_call_duration_seconds_count{{{labels}}} {stats.calls}')
+            for name, (field, _) in counter_lines.items():
+                counters[name].append(f'{name}_total{{{labels}}} {getattr(stats, field)}')
+        for name, (_, help_text) in counter_lines.items():
+            lines.append(f'# HELP {name}_total {help_text}' if not openmetrics else f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name}_total counter' if not openmetrics else f'# TYPE {name} counter')
+            lines.extend(counters[name])
+        if openmetrics:
+            lines.append('# EOF')
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, path)
+
+def profiled(profiler: Optional[Profiler], command: str):
+    """``profiler.command(command)``, or a no-op context when not profiling"""
+    return profiler.command(command) if profiler is not None else nullcontext()
+
+# Object types whose methods are treated as batched writes
+_BATCH_TYPES = ('WriteBatch', 'Transaction', 'AsyncWriteBatch', 'Batch', 'MemoryWriteBatch', 'MemoryTransaction')
+
+def _kind(target) -> str:
+    name = type(target).__name__
+    if name in _BATCH_TYPES:
+        return 'batch'
+    if 'Aggregation' in name:
+        return 'aggregation'
+    if 'Document' in name:
+        return 'document'
+    if 'Client' in name:
+        return 'client'
+    return 'query'
+
+def instrument(client, profiler: Profiler):
+    """Wrap a Firestore client so every call it makes is recorded by ``profiler``"""
+    return _Instrumented(client, profiler, '-')
+
+def unwrap(value):
+    """The underlying object of an instrumented wrapper (or of each one in a list)"""
+    if isinstance(value, (list, tuple)):
+        return type(value)(unwrap(item) for item in value)
+    return value._target if isinstance(value, _Instrumented) else value
+
+class _Instrumented:
+    """Proxy that times calls and counts documents, wrapping returned objects too"""
+
+    def __init__(self, target, profiler: Profiler, collection: str):
+        self._target = target
+        self._profiler = profiler
+        self._collection = collection
+        self._pending = [0, 0, None]  # operations, bytes and collection queued on a batch
+        self._counts_documents = True  # False for sum/avg aggregations, whose value is not a count
+
+    def __getattr__(self, name):
+        value = getattr(self._target, name)
+        if not callable(value) or isinstance(value, type):
+            return value
+
+        def call(*args, **kwargs):
+            return self._call(name, value, args, kwargs)
+        return call
+
+    def __iter__(self):
+        return iter(self._target)
+
+    def __len__(self):
+        return len(self._target)
+
+    def _call(self, name, method, args, kwargs):
+        kind = _kind(self._target)
+        args = tuple(unwrap(arg) for arg in args)
+        kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+        collection = self._collection
+        if name in ('collection', 'collection_group') and args:
+            collection = str(args[0]).split('/')[-1]
+
+        if kind == 'batch' and name in ('set', 'update', 'delete', 'create'):
+            self._pending[0] += 1
+            self._pending[1] += estimate_size(args[1] if len(args) > 1 else None)
+            parent = getattr(getattr(args[0], 'parent', None), 'id', None) if args else None
+            if self._pending[2] is None:
+                self._pending[2] = parent
+            elif parent != self._pending[2]:
+                self._pending[2] = 'mixed'
+            return method(*args, **kwargs)
+
+        started = time.perf_counter()
+        result = method(*args, **kwargs)
+
+        if name == 'stream':
+            return self._timed_stream(result, f'{kind}.stream', started)
+        elapsed = time.perf_counter() - started
+
+        if name == 'commit':
+            ops, size, batch_collection = self._pending
+            self._pending = [0, 0, None]
+            self._profiler.record(f'{kind}.commit', batch_collection or collection, elapsed,
+                                  writes=ops, bytes_written=size)
+            return result
+        if name == 'get':
+            if kind == 'aggregation':
+                total = sum(int(agg.value) for row in result for agg in row) if self._counts_documents else 0
+                reads = max(1, math.ceil(total / AGGREGATION_ENTRIES_PER_READ))
+                self._profiler.record('aggregation.get', collection, elapsed, reads=reads)
+            elif isinstance(result, list):
+                size = sum(estimate_size(doc.to_dict()) for doc in result)
+                reads = max(len(result), 1) if kind == 'query' else len(result)
+                self._profiler.record(f'{kind}.get', collection, elapsed, reads=reads, bytes_read=size)
+            else:
+                data = result.to_dict() if getattr(result, 'exists', True) else None
+                self._profiler.record(f'{kind}.get', collection, elapsed, reads=1,
+                                      bytes_read=estimate_size(data))
+            return result
+        if name in ('set', 'update', 'delete', 'create'):
+            self._profiler.record(f'{kind}.{name}', collection, elapsed, writes=1,
+                                  bytes_written=estimate_size(args[0] if args else None))
+            return result
+        if name == 'get_all':
+            return self._timed_stream(result, 'client.get_all', started)
+
+        if result is None or isinstance(result, (str, bytes, int, float, bool, list, dict, tuple)):
+            return result
+        wrapped = _Instrumented(result, self._profiler, collection)
+        wrapped._counts_documents = self._counts_documents and name not in ('sum', 'avg')
+        return wrapped
+
+    def _timed_stream(self, docs, call: str, started: float):
+        """Yield documents, recording time spent fetching (not consuming) them"""
+        fetching = time.perf_counter() - started
+        reads = size = 0
+        iterator = iter(docs)
+        try:
+            while True:
+                before = time.perf_counter()
+                try:
+                    doc = next(iterator)
+                except StopIteration:
+                    fetching += time.perf_counter() - before
+                    break
+                fetching += time.perf_counter() - before
+                reads += 1
+                size += estimate_size(doc.to_dict())
+                yield doc
+        finally:
+            # Queries are billed at least one read even when they match nothing
+            billed = max(reads, 1) if call.endswith('stream') else reads
+            self._profiler.record(call, self._collection, fetching, reads=billed, bytes_read=size)
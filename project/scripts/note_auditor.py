@@ -0,0 +1,289 @@
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Any, Optional
+
+from firestore_manager import FirestoreManager
+
+DEFAULT_FILES_API = os.environ.get('VITE_API_BASE_URL', 'http://localhost:3001/api')
+DEFAULT_AUDIT_CACHE = 'note_audit_cache.json'
+# A well-formed Drive ID that cannot exist, used to check dead-file detection
+MISSING_FILE_PROBE = 'campus-companion-missing-file-probe'
+
+AUDITED_NOTE_FIELDS = ['title', 'fileUrl', 'fileName', 'fileSize', 'driveFileId']
+
+# Results worth remembering; transient errors are always re-checked
+CACHED_STATUSES = {'ok', 'dead', 'size_mismatch', 'no_file_id'}
+
+_DRIVE_ID_PATTERNS = [re.compile(r'/d/([\w-]{10,})'), re.compile(r'[?&]id=([\w-]{10,})')]
+
+def drive_file_id(note: Dict[str, Any]) -> Optional[str]:
+    """The Drive file ID of a note, from driveFileId or else parsed from fileUrl"""
+    if note.get('driveFileId'):
+        return note['driveFileId']
+    for pattern in _DRIVE_ID_PATTERNS:
+        match = pattern.search(note.get('fileUrl') or '')
+        if match:
+            return match.group(1)
+    return None
+
+def recorded_size(note: Dict[str, Any]) -> Optional[int]:
+    """The note's fileSize as a number (older notes store it as a string)"""
+    try:
+        return int(float(note.get('fileSize')))
+    except (TypeError, ValueError):
+        return None
+
+def fingerprint(note: Dict[str, Any]) -> str:
+    """Changes whenever the file a note points at, or its recorded size, changes"""
+    payload = json.dumps([note.get(field) for field in AUDITED_NOTE_FIELDS[1:]], default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+class ServerFileSource:
+    """File metadata from the upload server's ``GET /api/files/:fileId``"""
+
+    def __init__(self, base_url: str = DEFAULT_FILES_API, timeout: float = 10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+
+    def describe(self) -> str:
+        return self.base_url
+
+    def stat(self, file_id: str) -> Optional[Dict[str, Any]]:
+        """fileId/fileName/mimeType/fileSize of a file, or None if it does not exist"""
+        url = f"{self.base_url}/files/{urllib.parse.quote(file_id, safe='')}"
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 410):
+                return None
+            # A 500 still carries Drive's own status when the file is gone; the
+            # error text is not checked, so a transient failure is never taken as dead
+            try:
+                body = json.loads(e.read().decode('utf-8') or '{}')
+            except (OSError, ValueError):
+                body = {}
+            if body.get('driveStatus') in (404, 410):
+                return None
+            raise
+
+def verify_dead_detection(source, file_id: str = MISSING_FILE_PROBE) -> bool:
+    """Check that the source reports a deleted (or never existing) file ID as dead.
+
+    A server that answers every Drive error the same way would make the
+    audit report dead files as transient errors that are never cached.
+    """
+    try:
+        meta = source.stat(file_id)
+    except Exception as e:
+        print(f"❌ {source.describe()} does not report missing file {file_id} as dead: {e}")
+        return False
+    if meta is not None:
+        print(f"❌ {source.describe()} still returns metadata for file {file_id}")
+        return False
+    return True
+
+class LocalFileSource:
+    """Stand-in for the server: a directory of files named by their file ID.
+
+    Files may carry an extension (``<fileId>.pdf``); the directory is
+    listed once up front.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._paths = {}
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if os.path.isfile(path):
+                self._paths.setdefault(os.path.splitext(name)[0], path)
+                self._paths.setdefault(name, path)
+
+    def describe(self) -> str:
+        return self.directory
+
+    def stat(self, file_id: str) -> Optional[Dict[str, Any]]:
+        path = self._paths.get(file_id)
+        if path is None:
+            return None
+        return {
+            'fileId': file_id,
+            'fileName': os.path.basename(path),
+            'mimeType': mimetypes.guess_type(path)[0] or 'application/octet-stream',
+            'fileSize': os.path.getsize(path),
+        }
+
+class AuditCache:
+    """Per-note audit results keyed by note ID, stored as JSON between runs"""
+
+    def __init__(self, path: Optional[str] = DEFAULT_AUDIT_CACHE):
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as fp:
+                    self.entries = json.load(fp)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Ignoring unreadable audit cache {path}: {e}")
+
+    def lookup(self, note_id: str, note_fingerprint: str) -> Optional[Dict[str, Any]]:
+        entry = self.entries.get(note_id)
+        if entry and entry.get('fingerprint') == note_fingerprint and entry['status'] in CACHED_STATUSES:
+            return entry
+        return None
+
+    def save(self, seen_ids: set):
+        """Write the cache, dropping notes that no longer exist"""
+        if not self.path:
+            return
+        entries = {note_id: entry for note_id, entry in self.entries.items() if note_id in seen_ids}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(entries, fp)
+        os.replace(tmp_path, self.path)
+
+class NoteFileAuditor:
+    """Checks that every note's file exists and matches its recorded size.
+
+    Notes are streamed with a projection of the file fields and checked on
+    a bounded thread pool, so at most ``max_workers * 4`` lookups are in
+    flight however large the collection is. Results are cached per note
+    with a fingerprint of its file fields: a re-run only re-checks notes
+    that are new, changed, or last failed with a transient error.
+    """
+
+    def __init__(self, fm: FirestoreManager, source, cache: Optional[AuditCache] = None,
+                 max_workers: int = 16, recheck: bool = False, sample_size: int = 10):
+        self.fm = fm
+        self.source = source
+        self.cache = cache if cache is not None else AuditCache(None)
+        self.max_workers = max_workers
+        self.recheck = recheck
+        self.sample_size = sample_size
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_workers * 4)
+
+    def check(self, note: Dict[str, Any]) -> Dict[str, Any]:
+        """Audit one note against the file source"""
+        file_id = drive_file_id(note)
+        entry = {'fingerprint': fingerprint(note), 'fileId': file_id, 'checkedAt': time.time()}
+        if file_id is None:
+            return {**entry, 'status': 'no_file_id'}
+        try:
+            meta = self.source.stat(file_id)
+        except Exception as e:
+            return {**entry, 'status': 'error', 'error': str(e)}
+        if meta is None:
+            return {**entry, 'status': 'dead'}
+        actual = meta.get('fileSize')
+        entry.update(fileName=note.get('fileName') or meta.get('fileName'), actualSize=actual)
+        expected = recorded_size(note)
+        if expected is not None and actual is not None and int(actual) != expected:
+            return {**entry, 'status': 'size_mismatch', 'recordedSize': expected}
+        return {**entry, 'status': 'ok'}
+
+    def _store(self, note_id: str, entry: Dict[str, Any]):
+        with self._lock:
+            self.cache.entries[note_id] = entry
+
+    def _run_check(self, note):
+        try:
+            self._store(note['id'], self.check(note))
+        finally:
+            self._slots.release()
+
+    def run(self) -> Dict[str, Any]:
+        """Audit every note and return the report"""
+        started = time.monotonic()
+        seen, checked, cached = set(), 0, 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            for note in self.fm.iter_collection('notes', fields=AUDITED_NOTE_FIELDS):
+                seen.add(note['id'])
+                if not self.recheck and self.cache.lookup(note['id'], fingerprint(note)):
+                    cached += 1
+                    continue
+                self._slots.acquire()
+                pool.submit(self._run_check, note)
+                checked += 1
+        self.cache.save(seen)
+        report = self.build_report({note_id: self.cache.entries[note_id] for note_id in seen
+                                    if note_id in self.cache.entries})
+        report.update(notes=len(seen), checked=checked, cached=cached,
+                      seconds=round(time.monotonic() - started, 3))
+        return report
+
+    def build_report(self, entries: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+        """Counts, sample note IDs per problem, and duplicate groups"""
+        statuses = Counter(entry['status'] for entry in entries.values())
+        problems: Dict[str, List[str]] = {}
+        for note_id, entry in sorted(entries.items()):
+            if entry['status'] != 'ok':
+                problems.setdefault(entry['status'], []).append(note_id)
+
+        by_file_id: Dict[str, List[str]] = {}
+        by_content: Dict[tuple, List[str]] = {}
+        for note_id, entry in sorted(entries.items()):
+            if entry.get('fileId'):
+                by_file_id.setdefault(entry['fileId'], []).append(note_id)
+            if entry['status'] in ('ok', 'size_mismatch') and entry.get('fileName') and entry.get('actualSize'):
+                by_content.setdefault((entry['fileName'], entry['actualSize']), []).append(note_id)
+        shared_files = {file_id: ids for file_id, ids in by_file_id.items() if len(ids) > 1}
+        # Same name and size under different file IDs: the same upload made twice
+        reuploads = {f"{name} ({size} bytes)": ids for (name, size), ids in by_content.items()
+                     if len({entries[note_id]['fileId'] for note_id in ids}) > 1}
+        return {
+            'statuses': dict(statuses),
+            'problems': {status: ids[:self.sample_size] for status, ids in problems.items()},
+            'shared_files': shared_files,
+            'reuploads': reuploads,
+        }
+
+def print_audit_report(report: Dict[str, Any], source: str):
+    """Print the outcome of a note file audit"""
+    print(f"\n🔎 Note file audit against {source}:")
+    print(f"   {report['notes']} notes, {report['checked']} checked, {report['cached']} from cache "
+          f"in {report['seconds']}s")
+    for status, count in sorted(report['statuses'].items()):
+        print(f"   {'✅' if status == 'ok' else '❌'} {status}: {count}")
+        sample = report['problems'].get(status)
+        if sample:
+            print(f"      e.g. {', '.join(sample)}")
+    if report['shared_files']:
+        print(f"   ⚠️ {len(report['shared_files'])} files referenced by several notes")
+    if report['reuploads']:
+        print(f"   ⚠️ {len(report['reuploads'])} files uploaded more than once:")
+        for label, note_ids in list(report['reuploads'].items())[:10]:
+            print(f"      {label}: {', '.join(note_ids)}")
+
+def audit_note_files(fm: FirestoreManager, files_api: str = DEFAULT_FILES_API,
+                     files_dir: Optional[str] = None, cache_path: Optional[str] = DEFAULT_AUDIT_CACHE,
+                     max_workers: int = 16, recheck: bool = False,
+                     report_path: Optional[str] = None,
+                     deleted_file_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Audit note files against the server (or a local directory) and print the report.
+
+    Returns None without auditing if the source does not report
+    ``deleted_file_id`` (by default an ID that cannot exist) as dead.
+    """
+    source = LocalFileSource(files_dir) if files_dir else ServerFileSource(files_api)
+    if not verify_dead_detection(source, deleted_file_id or MISSING_FILE_PROBE):
+        print("❌ Audit aborted: dead files would be reported as errors")
+        return None
+    auditor = NoteFileAuditor(fm, source, AuditCache(cache_path), max_workers=max_workers, recheck=recheck)
+    report = auditor.run()
+    print_audit_report(report, source.describe())
+    if report_path:
+        with open(report_path, 'w', encoding='utf-8') as fp:
+            json.dump(report, fp, indent=2)
+        print(f"💾 Saved audit report to {report_path}")
+    return report
@@ -0,0 +1,317 @@
+import hashlib
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Any, Optional, BinaryIO, Tuple
+
+from firestore_client import firestore
+from firestore_manager import FirestoreManager
+from note_auditor import DEFAULT_FILES_API, LocalFileSource, drive_file_id, recorded_size
+
+FILE_HASH_COLLECTION = 'fileHashes'
+HASH_CHUNK_SIZE = 1 << 20
+
+DEDUP_NOTE_FIELDS = ['title', 'subjectCode', 'subclassId', 'isShared', 'approved', 'tags', 'downloads',
+                     'fileUrl', 'fileName', 'fileSize', 'driveFileId', 'viewUrl', 'downloadUrl',
+                     'contentHash', 'createdAt', 'downloadShards']
+
+# Fields that make a note point at a file; copied when a note is repointed
+FILE_FIELDS = ['fileUrl', 'driveFileId', 'viewUrl', 'downloadUrl', 'fileSize']
+
+def hash_stream(stream: BinaryIO, chunk_size: int = HASH_CHUNK_SIZE) -> Tuple[str, int]:
+    """sha256 hex digest and byte count of a stream, read one chunk at a time"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return digest.hexdigest(), size
+        digest.update(chunk)
+        size += len(chunk)
+
+class LocalContentSource(LocalFileSource):
+    """File contents from a directory of files named by file ID"""
+
+    def open(self, file_id: str) -> Optional[BinaryIO]:
+        path = self._paths.get(file_id)
+        return open(path, 'rb') if path else None
+
+class DriveContentSource:
+    """File contents through Drive's download URL, as NotesLibrary downloads them"""
+
+    DOWNLOAD_URL = 'https://drive.google.com/uc?export=download&id={}'
+
+    def __init__(self, files_api: str = DEFAULT_FILES_API, timeout: float = 60):
+        self.files_api = files_api.rstrip('/')
+        self.timeout = timeout
+
+    def describe(self) -> str:
+        return 'Google Drive'
+
+    def open(self, file_id: str) -> Optional[BinaryIO]:
+        try:
+            return urllib.request.urlopen(self.DOWNLOAD_URL.format(urllib.parse.quote(file_id)),
+                                          timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code in (404, 410):
+                return None
+            raise
+
+    def delete(self, file_id: str):
+        """Delete a file through the upload server's ``DELETE /api/files/:fileId``"""
+        request = urllib.request.Request(f"{self.files_api}/files/{urllib.parse.quote(file_id, safe='')}",
+                                         method='DELETE')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+def _created(note: Dict[str, Any]):
+    created = note.get('createdAt')
+    return (created.timestamp() if isinstance(created, datetime) else float('inf'), note['id'])
+
+def plan_merges(notes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge plan for notes sharing one content hash.
+
+    The earliest upload's file becomes the canonical file. Within each
+    subject, a shared copy makes every other copy redundant, so one shared
+    note survives; otherwise one note survives per subclass, keeping each
+    audience's visibility unchanged. Survivors absorb the tags and
+    approval of the notes merged into them (``merged_into``; merge() moves
+    their download counts) and are repointed at the canonical file.
+    """
+    notes = sorted(notes, key=_created)
+    canonical = notes[0]
+    survivors: Dict[tuple, Dict[str, Any]] = {}
+    merged_into: Dict[str, List[Dict[str, Any]]] = {}
+    for note in notes:
+        subject = note.get('subjectCode')
+        shared = any(other.get('isShared') for other in notes if other.get('subjectCode') == subject)
+        key = (subject, '_shared' if shared else note.get('subclassId'))
+        if key not in survivors:
+            # The earliest shared note survives a shared bucket
+            candidates = [other for other in notes if other.get('subjectCode') == subject and
+                          (other.get('isShared') or not shared) and
+                          (shared or other.get('subclassId') == note.get('subclassId'))]
+            survivors[key] = candidates[0]
+            merged_into[candidates[0]['id']] = []
+        if note['id'] != survivors[key]['id']:
+            merged_into[survivors[key]['id']].append(note)
+
+    updates, deletions = {}, []
+    for survivor in survivors.values():
+        absorbed = merged_into[survivor['id']]
+        fields = {}
+        if absorbed:
+            tags = list(dict.fromkeys(tag for note in [survivor] + absorbed for tag in note.get('tags') or []))
+            if tags != (survivor.get('tags') or []):
+                fields['tags'] = tags
+            if not survivor.get('approved', True) and any(note.get('approved', True) for note in absorbed):
+                fields['approved'] = True
+            deletions.extend(absorbed)
+        if drive_file_id(survivor) != drive_file_id(canonical):
+            fields.update({key: canonical[key] for key in FILE_FIELDS if canonical.get(key) is not None})
+        if fields:
+            updates[survivor['id']] = (survivor, fields)
+
+    kept_files = {drive_file_id(canonical)}
+    orphaned = {drive_file_id(note) for note in notes} - kept_files - {None}
+    return {'canonical': canonical, 'survivors': [note['id'] for note in survivors.values()],
+            'updates': updates, 'deletions': deletions, 'orphaned_files': orphaned,
+            'merged_into': {survivor['id']: (survivor, merged_into[survivor['id']])
+                            for survivor in survivors.values() if merged_into[survivor['id']]}}
+
+class NoteDeduplicator:
+    """Content-hash index of note files and duplicate merging.
+
+    ``backfill()`` hashes the file of every note without a ``contentHash``,
+    streaming each file in 1 MiB chunks on a bounded thread pool (a file
+    shared by several notes is hashed once) and, with ``apply``, stores the
+    hash on the notes and rewrites ``fileHashes/{sha256}`` with the file IDs
+    and notes for each content. ``merge()`` then folds duplicate notes together.
+    """
+
+    def __init__(self, fm: FirestoreManager, source, max_workers: int = 8, rehash: bool = False):
+        self.fm = fm
+        self.source = source
+        self.max_workers = max_workers
+        self.rehash = rehash
+        self.notes: List[Dict[str, Any]] = []
+        self.report = {'notes': 0, 'hashed_files': 0, 'hashed_bytes': 0, 'missing_files': 0,
+                       'hash_errors': 0, 'unique_contents': 0, 'duplicate_groups': 0}
+        self._lock = threading.Lock()
+
+    def _hash_file(self, file_id: str) -> Optional[Tuple[str, int]]:
+        try:
+            stream = self.source.open(file_id)
+            if stream is None:
+                with self._lock:
+                    self.report['missing_files'] += 1
+                return None
+            with stream:
+                digest, size = hash_stream(stream)
+        except Exception as e:
+            print(f"⚠️ Could not hash file {file_id}: {e}")
+            with self._lock:
+                self.report['hash_errors'] += 1
+            return None
+        with self._lock:
+            self.report['hashed_files'] += 1
+            self.report['hashed_bytes'] += size
+        return digest, size
+
+    def backfill(self, apply: bool = False) -> Dict[str, List[Dict[str, Any]]]:
+        """Hash unhashed notes (with ``apply``, write the hashes and the index); returns notes grouped by hash"""
+        self.notes = list(self.fm.iter_collection('notes', fields=DEDUP_NOTE_FIELDS))
+        self.report['notes'] = len(self.notes)
+        pending_files = sorted({drive_file_id(note) for note in self.notes
+                                if (self.rehash or not note.get('contentHash')) and drive_file_id(note)})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            results = pool.map(self._hash_file, pending_files)
+            hashes = {file_id: result for file_id, result in zip(pending_files, results) if result}
+
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        updates = {}
+        for note in self.notes:
+            result = hashes.get(drive_file_id(note))
+            if result and result[0] != note.get('contentHash'):
+                note['contentHash'] = updates[note['id']] = result[0]
+            if note.get('contentHash'):
+                groups.setdefault(note['contentHash'], []).append(note)
+
+        if apply:
+            with self.fm.bulk_writer() as writer:
+                notes_ref = self.fm.db.collection('notes')
+                for note_id, digest in updates.items():
+                    writer.update(notes_ref.document(note_id), {'contentHash': digest,
+                                                               'updatedAt': firestore.SERVER_TIMESTAMP})
+                self.write_index(groups, writer, sizes=dict(hashes.values()))
+        self.report['unique_contents'] = len(groups)
+        self.report['duplicate_groups'] = sum(1 for notes in groups.values() if len(notes) > 1)
+        return groups
+
+    def write_index(self, groups: Dict[str, List[Dict[str, Any]]], writer,
+                    sizes: Optional[Dict[str, int]] = None):
+        """Rewrite ``fileHashes`` from the notes grouped by hash, dropping hashes no note has.
+
+        Each entry names the canonical (earliest uploaded) file with the
+        fields UploadNotes needs to reuse it instead of uploading again.
+        """
+        sizes = sizes or {}
+        index_ref = self.fm.db.collection(FILE_HASH_COLLECTION)
+        for digest, notes in groups.items():
+            canonical = min(notes, key=_created)
+            writer.set(index_ref.document(digest), {
+                'fileId': drive_file_id(canonical),
+                'fileUrl': canonical.get('fileUrl'),
+                'fileName': canonical.get('fileName'),
+                'size': sizes.get(digest, recorded_size(canonical)),
+                'fileIds': sorted({drive_file_id(note) for note in notes} - {None}),
+                'noteIds': sorted(note['id'] for note in notes),
+                'updatedAt': firestore.SERVER_TIMESTAMP,
+            })
+        for doc in self.fm.iter_collection(FILE_HASH_COLLECTION, fields=[]):
+            if doc['id'] not in groups:
+                writer.delete(index_ref.document(doc['id']))
+
+    def merge(self, groups: Dict[str, List[Dict[str, Any]]], apply: bool = False,
+              delete_files: bool = False) -> Dict[str, Any]:
+        """Plan (and with ``apply``, write) the merge of every duplicate group"""
+        result = {'notes_deleted': 0, 'notes_updated': 0, 'files_orphaned': 0, 'bytes_reclaimable': 0,
+                  'files_deleted': 0, 'sample': []}
+        plans = [plan for plan in (plan_merges(notes) for notes in groups.values() if len(notes) > 1)
+                 if plan['updates'] or plan['deletions']]
+        writer = self.fm.bulk_writer() if apply and plans else None
+        notes_ref = self.fm.db.collection('notes')
+        reindex, failed = {}, 0
+        # Live counts of the notes merged away, shards included, to move onto the survivors
+        counts = self.fm.download_counts([note for plan in plans for note in plan['deletions']]) if writer else {}
+        try:
+            for plan in plans:
+                result['notes_deleted'] += len(plan['deletions'])
+                result['notes_updated'] += len(set(plan['updates']) | set(plan['merged_into']))
+                result['files_orphaned'] += len(plan['orphaned_files'])
+                size = plan['canonical'].get('fileSize')
+                result['bytes_reclaimable'] += int(float(size or 0)) * len(plan['orphaned_files'])
+                if len(result['sample']) < 10:
+                    merged = ', '.join(note['id'] for note in plan['deletions']) or 'nothing'
+                    result['sample'].append(f"{plan['canonical']['contentHash'][:12]}: keep "
+                                            f"{', '.join(plan['survivors'])}, merge {merged}")
+                if writer is None:
+                    continue
+                for note in plan['deletions']:
+                    writer.delete(notes_ref.document(note['id']))
+                    self.fm.delete_download_shards(note, writer)
+                    self.fm.unindex_note(note['id'], note, writer)
+                for survivor_id, (survivor, absorbed) in plan['merged_into'].items():
+                    moved = sum(counts[note['id']] for note in absorbed)
+                    if not moved:
+                        continue
+                    # The base shard keeps the count through rollups; downloads shows it until the next one
+                    self.fm.add_base_downloads(survivor_id, moved, writer)
+                    fields = plan['updates'].setdefault(survivor_id, (survivor, {}))[1]
+                    fields['downloads'] = int(survivor.get('downloads') or 0) + moved
+                for note_id, (note, fields) in plan['updates'].items():
+                    writer.update(notes_ref.document(note_id), {**fields, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                    reindex[note_id] = dict(note)
+                    note.update(fields)
+                deleted = {note['id'] for note in plan['deletions']}
+                digest = plan['canonical']['contentHash']
+                groups[digest] = [note for note in groups[digest] if note['id'] not in deleted]
+            if writer is not None and plans:
+                self.write_index(groups, writer)
+        finally:
+            if writer is not None:
+                failed = writer.close()['failed']
+        if failed:
+            print(f"❌ {failed} merge writes failed; re-run to finish. No files were deleted")
+            return result
+        if reindex:
+            # Survivors are read in full for their index entries; search shards update once at close
+            with self.fm.bulk_writer() as writer:
+                for note_id, previous in reindex.items():
+                    self.fm.index_note(note_id, previous=previous, writer=writer)
+
+        if apply and delete_files:
+            for plan in plans:
+                for file_id in sorted(plan['orphaned_files']):
+                    try:
+                        self.source.delete(file_id)
+                        result['files_deleted'] += 1
+                    except Exception as e:
+                        print(f"⚠️ Could not delete file {file_id}: {e}")
+        return result
+
+def print_dedup_report(report: Dict[str, Any], merge: Dict[str, Any], apply: bool):
+    """Print hashing and merge results"""
+    print("\n🧬 Note content hashes:")
+    print(f"   {report['notes']} notes, {report['unique_contents']} distinct files, "
+          f"{report['duplicate_groups']} duplicated")
+    print(f"   hashed {report['hashed_files']} files ({report['hashed_bytes'] / (1 << 20):.1f} MiB), "
+          f"{report['missing_files']} missing, {report['hash_errors']} errors"
+          f"{'' if apply else ' (not saved in a dry run)'}")
+    verb = '' if apply else 'would be '
+    print(f"\n🔗 Duplicate merge{'' if apply else ' (dry run)'}:")
+    print(f"   {merge['notes_deleted']} notes {verb}merged away, {merge['notes_updated']} {verb}updated, "
+          f"{merge['files_orphaned']} files no longer referenced "
+          f"({merge['bytes_reclaimable'] / (1 << 20):.1f} MiB)")
+    if merge['files_deleted']:
+        print(f"   🗑️ Deleted {merge['files_deleted']} files")
+    for line in merge['sample']:
+        print(f"      {line}")
+
+def dedup_notes(fm: FirestoreManager, files_api: str = DEFAULT_FILES_API, files_dir: Optional[str] = None,
+                apply: bool = False, delete_files: bool = False, rehash: bool = False,
+                max_workers: int = 8) -> Dict[str, Any]:
+    """Backfill content hashes, then merge duplicates (dry run unless ``apply``)"""
+    source = LocalContentSource(files_dir) if files_dir else DriveContentSource(files_api)
+    dedup = NoteDeduplicator(fm, source, max_workers=max_workers, rehash=rehash)
+    groups = dedup.backfill(apply=apply)
+    report = dict(dedup.report)
+    if delete_files and files_dir:
+        print("⚠️ --delete-files needs the upload server; leaving files in place")
+        delete_files = False
+    merge = dedup.merge(groups, apply=apply, delete_files=delete_files)
+    print_dedup_report(report, merge, apply)
+    return {'hashes': report, 'merge': merge}
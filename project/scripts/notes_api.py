@@ -0,0 +1,425 @@
+"""Notes feed for NotesLibrary: filtered, sorted, cursor-paginated pages over HTTP.
+
+    python scripts/notes_api.py --port 3002
+    curl -H "Authorization: Bearer $ID_TOKEN" 'http://localhost:3002/api/notes?sortBy=newest&limit=20'
+    curl -H "Authorization: Bearer $ID_TOKEN" 'http://localhost:3002/api/notes?...&cursor=<nextCursor>'
+
+Query parameters follow NotesLibrary's ``FilterOptions``: ``subjectCode``,
+``isShared`` ('all', 'shared' or 'private'), ``tags`` (one tag, matched
+exactly) and ``sortBy`` ('newest', 'oldest', 'downloads' or 'title').
+Every request carries the caller's Firebase ID token (``user.getIdToken()``
+in the web app); the visibility rule uses the ``role`` and ``subclass``
+of their ``users/{uid}`` profile: admins see every note, everyone else
+their subclass's notes and shared notes.
+
+Each filter runs in Firestore, ordered by the sort field and the document
+ID, so a page reads ``limit + 1`` notes: the extra one tells whether there
+is a next page. A student's 'all' feed merges their subclass's notes with
+the shared ones; its first page reads up to ``limit + 1`` from each, and
+the rows read past a page are cached as the start of the next, so paging
+on costs about ``limit`` reads a page. Query results are kept in an LRU
+cache; a listener on ``notes`` drops the cached results a changed note
+could appear in. The listener reads every note once at start-up and then
+one per change.
+
+Notes without the sort field (e.g. no ``downloads``) are left out of that
+sort, as in any Firestore query. feed_query_catalog() lists every query
+shape a page can issue; index_advisor checks them, so each has its
+composite index in firestore.indexes.json.
+"""
+import argparse
+import base64
+import json
+import sys
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Any, Optional, Tuple, Callable
+from urllib.parse import parse_qs, urlparse
+
+from firestore_client import DEFAULT_SERVICE_ACCOUNT, verify_id_token
+from firestore_manager import FirestoreManager, ReferenceCache, NOTE_SUMMARY_FIELDS, USER_ROLES
+from storage_backend import BACKENDS
+
+FEED_SORTS = {
+    'newest': ('createdAt', 'DESCENDING'),
+    'oldest': ('createdAt', 'ASCENDING'),
+    'downloads': ('downloads', 'DESCENDING'),
+    'title': ('title', 'ASCENDING'),
+}
+SHARING_FILTERS = ['all', 'shared', 'private']
+# Optional filters a page adds to each of its queries, by catalog label
+FEED_EXTRA_FILTERS = {
+    '': [],
+    ' by subject': [['subjectCode', '==', '$subject']],
+    ' by tag': [['tags', 'array-contains', '$tag']],
+    ' by subject and tag': [['subjectCode', '==', '$subject'], ['tags', 'array-contains', '$tag']],
+}
+FEED_NOTE_FIELDS = NOTE_SUMMARY_FIELDS + ['description']
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 50
+FEED_CACHE_ENTRIES = 1024
+# The listener keeps pages fresh; the TTL only bounds staleness if it stops
+FEED_CACHE_TTL = 600
+DEFAULT_PORT = 3002
+
+# Cache scopes: every note is in ALL_SCOPE, shared notes in SHARED_SCOPE
+# and each subclass's notes in 'class:<subclassId>'
+ALL_SCOPE = '*'
+SHARED_SCOPE = 'shared'
+
+class FeedError(ValueError):
+    """A feed request with invalid parameters"""
+
+class AuthError(Exception):
+    """A feed request without a valid ID token, or from a user without a profile"""
+
+def _class_scope(subclass: str) -> str:
+    return f"class:{subclass}"
+
+def note_scopes(note: Optional[Tuple[Optional[str], bool]]) -> set:
+    """Cache scopes a note with this (subclassId, isShared) appears in"""
+    if note is None:
+        return set()
+    subclass, shared = note
+    scopes = {ALL_SCOPE}
+    if subclass:
+        scopes.add(_class_scope(subclass))
+    if shared:
+        scopes.add(SHARED_SCOPE)
+    return scopes
+
+def feed_streams(role: str, subclass: Optional[str], sharing: str) -> List[Tuple[str, List[tuple]]]:
+    """(cache scope, Firestore filters) of each query a feed is merged from"""
+    if role == 'admin':
+        if sharing == 'all':
+            return [(ALL_SCOPE, [])]
+        return [(ALL_SCOPE, [('isShared', '==', sharing == 'shared')])]
+    if sharing == 'shared':
+        return [(SHARED_SCOPE, [('isShared', '==', True)])]
+    if not subclass:
+        raise FeedError("subclass is required for students and CRs")
+    if sharing == 'private':
+        return [(_class_scope(subclass), [('subclassId', '==', subclass), ('isShared', '==', False)])]
+    return [(_class_scope(subclass), [('subclassId', '==', subclass)]),
+            (SHARED_SCOPE, [('isShared', '==', True)])]
+
+def _describe_filters(filters: List[list]) -> str:
+    parts = []
+    for field, op, value in filters:
+        parts.append(field if isinstance(value, str) and value.startswith('$') else f"{field}={value}")
+    return ', '.join(parts) or 'every note'
+
+def feed_query_catalog() -> List[Dict[str, Any]]:
+    """index_advisor catalog entries for every query shape NotesFeed.page can issue"""
+    catalog = {}
+    for role in ('admin', 'student'):
+        for sharing in SHARING_FILTERS:
+            for _, scope_filters in feed_streams(role, '$subclass', sharing):
+                for label, extra in FEED_EXTRA_FILTERS.items():
+                    filters = [list(clause) for clause in scope_filters] + extra
+                    for sort_by, order in FEED_SORTS.items():
+                        name = f"notes feed {_describe_filters(scope_filters)}{label}, {sort_by}"
+                        catalog[name] = {'name': name, 'source': 'scripts/notes_api.py', 'collection': 'notes',
+                                         'filters': filters, 'order_by': [list(order)],
+                                         'limit': DEFAULT_PAGE_SIZE + 1}
+    return list(catalog.values())
+
+def encode_cursor(value: Any, note_id: str) -> str:
+    """Opaque cursor for the position after a note: its sort value and ID"""
+    payload = {'t': value.isoformat()} if isinstance(value, datetime) else {'v': value}
+    payload['id'] = note_id
+    raw = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        value = datetime.fromisoformat(payload['t']) if 't' in payload else payload['v']
+        return value, str(payload['id'])
+    except (ValueError, KeyError, TypeError) as e:
+        raise FeedError(f"invalid cursor: {e}")
+
+def _sort_key(value: Any, note_id: str) -> tuple:
+    # Firestore orders nulls first; keep that without comparing None to values
+    return (value is not None, value if value is not None else 0, note_id)
+
+def note_row(note_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+    """A note shaped like NotesLibrary's ``Note``, with the same defaults"""
+    created = data.get('createdAt')
+    return {
+        'id': note_id,
+        'title': data.get('title') or 'Untitled',
+        'description': data.get('description') or '',
+        'subjectCode': data.get('subjectCode') or '',
+        'fileUrl': data.get('fileUrl') or '',
+        'fileName': data.get('fileName') or '',
+        'fileSize': data.get('fileSize') or 0,
+        'uploadedBy': data.get('uploadedBy') or '',
+        'uploaderName': data.get('uploaderName') or '',
+        'subclassId': data.get('subclassId') or '',
+        'isShared': bool(data.get('isShared')),
+        'tags': data.get('tags') or [],
+        'downloads': data.get('downloads') or 0,
+        'approved': data.get('approved', True),
+        'createdAt': created.isoformat() if isinstance(created, datetime) else created,
+        'driveFileId': data.get('driveFileId'),
+        'viewUrl': data.get('viewUrl'),
+        'downloadUrl': data.get('downloadUrl'),
+    }
+
+class NotesFeed:
+    """Pages of notes from cursor queries, cached until a listener sees a relevant change.
+
+    Cache keys start with the scope of the query (see feed_streams), so a
+    change to one subclass's note leaves other subclasses' pages cached.
+    """
+
+    def __init__(self, fm: FirestoreManager, cache: Optional[ReferenceCache] = None,
+                 verify_token: Optional[Callable[[str], Dict[str, Any]]] = None):
+        self.fm = fm
+        self.verify_token = verify_token or (lambda token: verify_id_token(token, fm.service_account_path))
+        self.cache = cache if cache is not None else ReferenceCache(ttl=FEED_CACHE_TTL,
+                                                                    max_entries=FEED_CACHE_ENTRIES)
+        self.reads = 0
+        self._lock = threading.Lock()
+        # Bumped on every invalidation; a page read across one is not cached
+        self._generation = 0
+        # (subclassId, isShared) of every note, to find the scopes a note left
+        self._notes: Dict[str, Tuple[Optional[str], bool]] = {}
+        self._watch = None
+
+    def start(self):
+        """Listen for note changes (reads every note once)"""
+        if self._watch is None:
+            self._watch = self.fm.db.collection('notes').on_snapshot(self._on_notes_changed)
+
+    def stop(self):
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_notes_changed(self, snapshots, changes, read_time):
+        scopes = set()
+        with self._lock:
+            for change in changes:
+                note_id = change.document.id
+                scopes |= note_scopes(self._notes.get(note_id))
+                if change.type.name == 'REMOVED':
+                    self._notes.pop(note_id, None)
+                else:
+                    data = change.document.to_dict() or {}
+                    self._notes[note_id] = (data.get('subclassId'), bool(data.get('isShared')))
+                    scopes |= note_scopes(self._notes[note_id])
+            if scopes:
+                self._generation += 1
+                for scope in scopes:
+                    self.cache.invalidate(scope)
+
+    def viewer(self, id_token: Optional[str]) -> Tuple[str, Optional[str]]:
+        """(role, subclass) of the user an ID token belongs to, from ``users/{uid}``.
+
+        Raises AuthError if the token is missing or invalid, or the user has
+        no profile.
+        """
+        if not id_token:
+            raise AuthError("sign in first: send 'Authorization: Bearer <Firebase ID token>'")
+        try:
+            uid = self.verify_token(id_token)['uid']
+        except Exception as e:
+            raise AuthError(f"invalid ID token: {e}")
+        snapshot = self.fm.db.collection('users').document(uid).get(field_paths=['role', 'subclass'])
+        with self._lock:
+            self.reads += 1
+        if not snapshot.exists:
+            raise AuthError(f"no user profile for {uid}")
+        profile = snapshot.to_dict() or {}
+        return profile.get('role') or 'student', profile.get('subclass')
+
+    def page(self, role: str = 'student', subclass: Optional[str] = None, subject_code: Optional[str] = None,
+             sharing: str = 'all', tag: Optional[str] = None, sort_by: str = 'newest',
+             limit: int = DEFAULT_PAGE_SIZE, cursor: Optional[str] = None) -> Dict[str, Any]:
+        """One page of the feed, and the cursor of the next (None on the last page).
+
+        Raises FeedError for invalid parameters.
+        """
+        if role not in USER_ROLES:
+            raise FeedError(f"role must be one of {', '.join(USER_ROLES)}")
+        if sharing not in SHARING_FILTERS:
+            raise FeedError(f"isShared must be one of {', '.join(SHARING_FILTERS)}")
+        if sort_by not in FEED_SORTS:
+            raise FeedError(f"sortBy must be one of {', '.join(FEED_SORTS)}")
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise FeedError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        after = decode_cursor(cursor) if cursor else None
+        filters = [('subjectCode', '==', subject_code)] if subject_code else []
+        if tag:
+            filters.append(('tags', 'array-contains', tag))
+
+        with self._lock:
+            generation = self._generation
+        streams = []
+        reads = 0
+        for scope, scope_filters in feed_streams(role, subclass, sharing):
+            key = (scope, tuple(scope_filters + filters), sort_by)
+            stream, complete, fetched = self._stream_rows(key, after, limit + 1, generation)
+            streams.append((key, stream, complete))
+            reads += fetched
+
+        rows = {note_id: (value, note_id, note) for _, stream, _ in streams for value, note_id, note in stream}
+        descending = FEED_SORTS[sort_by][1] == 'DESCENDING'
+        ordered = sorted(rows.values(), key=lambda row: _sort_key(row[0], row[1]), reverse=descending)
+        notes = ordered[:limit]
+        next_cursor = None
+        if len(ordered) > limit:
+            last = (notes[-1][0], notes[-1][1])
+            next_cursor = encode_cursor(*last)
+            # Rows read past this page start the next one, so paging on reads each note about once
+            boundary = _sort_key(*last)
+            for key, stream, complete in streams:
+                rest = [row for row in stream
+                        if (_sort_key(row[0], row[1]) < boundary if descending else _sort_key(row[0], row[1]) > boundary)]
+                self._put(key + (last,), (rest, complete), generation)
+        return {'notes': [note for _, _, note in notes], 'nextCursor': next_cursor,
+                'cached': reads == 0, 'reads': reads}
+
+    def _put(self, key: tuple, value: Any, generation: int):
+        # A page read while a change came in may predate it; don't cache it
+        with self._lock:
+            if generation == self._generation:
+                self.cache.put(key, value)
+
+    def _stream_rows(self, key: tuple, after: Optional[Tuple[Any, str]], count: int,
+                     generation: int) -> Tuple[List[tuple], bool, int]:
+        """At least ``count`` (sort value, id, note) rows of one query after ``after``, unless it ends first.
+
+        Returns the rows, whether the query has no more, and the number of
+        notes read; cached rows are topped up from Firestore if too few.
+        """
+        scope, filters, sort_by = key
+        with self._lock:
+            cached = self.cache.get(key + (after,))
+        rows, complete = cached if cached is not None else ([], False)
+        if complete or len(rows) >= count:
+            return rows, complete, 0
+
+        field, direction = FEED_SORTS[sort_by]
+        collection = self.fm.db.collection('notes')
+        query = collection
+        for filter_field, op, value in filters:
+            query = query.where(filter_field, op, value)
+        # Ordering by ID too makes the cursor unique when sort values tie
+        query = (query.select(FEED_NOTE_FIELDS).order_by(field, direction=direction)
+                 .order_by('__name__', direction=direction))
+        start = (rows[-1][0], rows[-1][1]) if rows else after
+        if start is not None:
+            query = query.start_after({field: start[0], '__name__': collection.document(start[1])})
+        wanted = count - len(rows)
+        fetched = []
+        for doc in query.limit(wanted).stream():
+            data = doc.to_dict() or {}
+            fetched.append((data.get(field), doc.id, note_row(doc.id, data)))
+
+        rows, complete = rows + fetched, len(fetched) < wanted
+        reads = max(len(fetched), 1)
+        with self._lock:
+            self.reads += reads
+        self._put(key + (after,), (rows, complete), generation)
+        return rows, complete, reads
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.cache.stats(), 'reads': self.reads, 'notes': len(self._notes),
+                    'listening': self._watch is not None}
+
+def _param(params: Dict[str, List[str]], name: str, default: Optional[str] = None) -> Optional[str]:
+    values = params.get(name)
+    return values[0] if values and values[0] != '' else default
+
+class NotesFeedHandler(BaseHTTPRequestHandler):
+    """GET /api/notes (a page) and GET /api/notes/stats (cache counters)"""
+
+    def do_OPTIONS(self):
+        self._send_json(204, None)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        feed: NotesFeed = self.server.feed
+        if url.path == '/api/notes/stats':
+            self._send_json(200, feed.stats())
+            return
+        if url.path != '/api/notes':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        params = parse_qs(url.query)
+        scheme, _, token = (self.headers.get('Authorization') or '').partition(' ')
+        try:
+            role, subclass = feed.viewer(token.strip() if scheme.lower() == 'bearer' else None)
+            limit = _param(params, 'limit')
+            page = feed.page(role=role, subclass=subclass,
+                             subject_code=_param(params, 'subjectCode'), sharing=_param(params, 'isShared', 'all'),
+                             tag=_param(params, 'tags'), sort_by=_param(params, 'sortBy', 'newest'),
+                             limit=int(limit) if limit else DEFAULT_PAGE_SIZE, cursor=_param(params, 'cursor'))
+        except AuthError as e:
+            self._send_json(401, {'error': str(e)})
+            return
+        except (FeedError, ValueError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            print(f"❌ Failed to serve notes page: {e}")
+            self._send_json(500, {'error': 'Failed to load notes'})
+            return
+        self._send_json(200, page)
+
+    def _send_json(self, status: int, payload: Any):
+        body = json.dumps(payload, default=str).encode('utf-8') if payload is not None else b''
+        self.send_response(status)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type')
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(feed: NotesFeed, host: str = '127.0.0.1', port: int = DEFAULT_PORT):
+    """Serve the feed until interrupted"""
+    server = ThreadingHTTPServer((host, port), NotesFeedHandler)
+    server.feed = feed
+    feed.start()
+    print(f"✅ Notes feed listening on http://{host}:{port}/api/notes")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        feed.stop()
+        stats = feed.stats()
+        print(f"\n📊 {stats['hits']} cached pages served, {stats['misses']} queried, {stats['reads']} notes read")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve cursor-paginated notes for NotesLibrary')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port to listen on')
+    parser.add_argument('--cache-entries', type=int, default=FEED_CACHE_ENTRIES,
+                      help='Query pages kept in the LRU cache')
+    parser.add_argument('--cache-ttl', type=float, default=FEED_CACHE_TTL,
+                      help='Seconds a cached page may be served if the listener misses a change')
+    parser.add_argument('--backend', choices=BACKENDS, default='firestore',
+                      help="Storage backend; 'memory' serves a --snapshot instead of Firestore")
+    parser.add_argument('--snapshot', help='With --backend memory, dump to load')
+    args = parser.parse_args()
+
+    fm = FirestoreManager(DEFAULT_SERVICE_ACCOUNT, backend=args.backend, snapshot=args.snapshot)
+    try:
+        feed = NotesFeed(fm, cache=ReferenceCache(ttl=args.cache_ttl, max_entries=args.cache_entries))
+        serve(feed, args.host, args.port)
+    except Exception as e:
+        print(f"❌ Notes feed failed: {e}")
+        sys.exit(1)
@@ -0,0 +1,195 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, List, Any, Optional, Iterator, Tuple
+
+from firestore_client import firestore
+from firestore_manager import FirestoreManager, BatchWriter, USER_ROLES
+
+DEFAULT_CHECKPOINT = 'role_assignment.checkpoint.json'
+
+def read_id_file(path: str) -> List[str]:
+    """User IDs from a file, one per line (or the first CSV column), sorted and deduplicated"""
+    ids = set()
+    with open(path, encoding='utf-8') as fp:
+        for line in fp:
+            user_id = line.split(',')[0].strip()
+            if user_id and not user_id.startswith('#') and user_id.lower() not in ('id', 'uid', 'userid'):
+                ids.add(user_id)
+    return sorted(ids)
+
+class RoleAssignment:
+    """Sets ``role`` on every targeted user in parallel batched writes.
+
+    Users are targeted by a query (department, subclass, current role) or
+    by an explicit list of IDs, and processed in document-ID order one page
+    at a time. Pages are written through a BatchWriter; after every window
+    of ``max_workers`` pages the writer is flushed and the last processed ID
+    is saved to the checkpoint file, so a crashed or interrupted run resumes
+    after the last committed window instead of starting over. Users already
+    holding the role are skipped without a write.
+    """
+
+    def __init__(self, fm: FirestoreManager, role: str, department: Optional[str] = None,
+                 subclass: Optional[str] = None, current_role: Optional[str] = None,
+                 user_ids: Optional[List[str]] = None, dry_run: bool = False,
+                 checkpoint_path: Optional[str] = DEFAULT_CHECKPOINT,
+                 page_size: int = BatchWriter.MAX_BATCH_SIZE, max_workers: int = 4,
+                 sample_size: int = 10):
+        if role not in USER_ROLES:
+            raise ValueError(f"role must be one of {', '.join(USER_ROLES)}")
+        if user_ids is None and not (department or subclass or current_role):
+            raise ValueError("target users with --department/--subclass/--current-role or --ids-file")
+        self.fm = fm
+        self.role = role
+        self.filters = [(field, '==', value) for field, value in
+                        (('department', department), ('subclass', subclass), ('role', current_role))
+                        if value]
+        self.user_ids = user_ids
+        self.dry_run = dry_run
+        self.checkpoint_path = checkpoint_path
+        self.page_size = min(page_size, BatchWriter.MAX_BATCH_SIZE)
+        self.max_workers = max_workers
+        self.sample_size = sample_size
+        self.report = {'scanned': 0, 'updated': 0, 'unchanged': 0, 'missing': 0, 'sample': []}
+
+    def job_key(self) -> str:
+        """Identifies the job, so a checkpoint is only resumed by the same assignment"""
+        targets = self.user_ids if self.user_ids is not None else self.filters
+        payload = json.dumps({'role': self.role, 'targets': targets}, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+    def load_checkpoint(self) -> Optional[str]:
+        """Last committed user ID of an interrupted run of this job, if any"""
+        if self.dry_run or not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, encoding='utf-8') as fp:
+            checkpoint = json.load(fp)
+        if checkpoint.get('job') != self.job_key():
+            raise ValueError(f"{self.checkpoint_path} belongs to a different role assignment; "
+                             "remove it or pass another --checkpoint")
+        for key in ('scanned', 'updated', 'unchanged', 'missing'):
+            self.report[key] = checkpoint.get(key, 0)
+        return checkpoint.get('last_id')
+
+    def save_checkpoint(self, last_id: str):
+        if self.dry_run or not self.checkpoint_path:
+            return
+        checkpoint = {'job': self.job_key(), 'role': self.role, 'last_id': last_id,
+                      'saved_at': time.time(),
+                      **{key: self.report[key] for key in ('scanned', 'updated', 'unchanged', 'missing')}}
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fp:
+            json.dump(checkpoint, fp)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _query_pages(self, after: Optional[str]) -> Iterator[List[Tuple[str, Optional[Dict[str, Any]]]]]:
+        users = self.fm.db.collection('users')
+        query = users
+        for field, op, value in self.filters:
+            query = query.where(field, op, value)
+        query = query.select(['role']).order_by('__name__').limit(self.page_size)
+        last_doc = users.document(after).get() if after else None
+        while True:
+            page = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page.stream())
+            if docs:
+                yield [(doc.id, doc.to_dict() or {}) for doc in docs]
+                last_doc = docs[-1]
+            if len(docs) < self.page_size:
+                return
+
+    def _id_pages(self, after: Optional[str]) -> Iterator[List[Tuple[str, Optional[Dict[str, Any]]]]]:
+        ids = [user_id for user_id in self.user_ids if after is None or user_id > after]
+        users = self.fm.db.collection('users')
+        for start in range(0, len(ids), self.page_size):
+            chunk = ids[start:start + self.page_size]
+            found = {snapshot.id: snapshot.to_dict() or {}
+                     for snapshot in self.fm.db.get_all([users.document(user_id) for user_id in chunk],
+                                                        field_paths=['role'])
+                     if snapshot.exists}
+            yield [(user_id, found.get(user_id)) for user_id in chunk]
+
+    def _apply_page(self, page, writer: Optional[BatchWriter]):
+        users = self.fm.db.collection('users')
+        for user_id, data in page:
+            self.report['scanned'] += 1
+            if data is None:
+                self.report['missing'] += 1
+            elif data.get('role') == self.role:
+                self.report['unchanged'] += 1
+            else:
+                self.report['updated'] += 1
+                if len(self.report['sample']) < self.sample_size:
+                    self.report['sample'].append(f"{user_id}: {data.get('role')} -> {self.role}")
+                if writer is not None:
+                    writer.update(users.document(user_id),
+                                  {'role': self.role, 'updatedAt': firestore.SERVER_TIMESTAMP})
+
+    def run(self) -> Dict[str, Any]:
+        """Apply the assignment (or only count it, in dry-run mode)"""
+        started = time.monotonic()
+        after = self.load_checkpoint()
+        committed = dict(self.report)
+        if after:
+            print(f"↩️  Resuming after user {after} ({self.report['updated']} already updated)")
+        pages = self._id_pages(after) if self.user_ids is not None else self._query_pages(after)
+        writer = None if self.dry_run else self.fm.bulk_writer(batch_size=self.page_size,
+                                                              max_workers=self.max_workers)
+        in_window = 0
+        completed = True
+        try:
+            for page in pages:
+                self._apply_page(page, writer)
+                after = page[-1][0]
+                in_window += 1
+                if writer is not None and in_window >= self.max_workers:
+                    if not self._commit_window(writer, after):
+                        completed = False
+                        break
+                    committed = dict(self.report)
+                    in_window = 0
+            if completed and writer is not None:
+                completed = self._commit_window(writer, after)
+            if not completed:
+                # Report what is committed; the failed window is redone on resume
+                self.report.update({key: committed[key] for key in ('scanned', 'updated', 'unchanged', 'missing')})
+        finally:
+            if writer is not None:
+                writer.close()
+        self.fm.cache.invalidate('users')
+        if completed and not self.dry_run and self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.report['completed'] = completed
+        self.report['seconds'] = round(time.monotonic() - started, 3)
+        return self.report
+
+    def _commit_window(self, writer: BatchWriter, last_id: Optional[str]) -> bool:
+        """Flush queued updates; checkpoint only if every batch committed"""
+        failed = writer.stats['failed']
+        writer.flush()
+        if writer.stats['failed'] > failed:
+            print(f"❌ {writer.stats['failed'] - failed} role updates failed; stopping. "
+                  f"Re-run the same command to resume from the last checkpoint")
+            return False
+        if last_id is not None:
+            self.save_checkpoint(last_id)
+        return True
+
+def print_role_report(report: Dict[str, Any], role: str, dry_run: bool = False):
+    """Print the outcome of a bulk role assignment"""
+    verb = 'would be updated' if dry_run else 'updated'
+    print(f"\n👥 Role assignment to '{role}'{' (dry run)' if dry_run else ''}:")
+    print(f"   {report['scanned']} users scanned, {report['updated']} {verb}, "
+          f"{report['unchanged']} already '{role}', {report['missing']} not found "
+          f"in {report['seconds']}s")
+    for line in report['sample']:
+        print(f"      {line}")
+
+def assign_roles(fm: FirestoreManager, role: str, dry_run: bool = False, **targets) -> Dict[str, Any]:
+    """Run a RoleAssignment and print its report"""
+    assignment = RoleAssignment(fm, role, dry_run=dry_run, **targets)
+    report = assignment.run()
+    print_role_report(report, role, dry_run)
+    return report
@@ -0,0 +1,244 @@
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Any, Optional
+
+from firestore_client import firestore
+from firestore_manager import FirestoreManager, NOTE_SUMMARY_FIELDS
+
+MAX_SEMESTER = 8
+
+# Write phases, in dependency order: subclass documents must exist before
+# users and notes point at them, and departments list only the final subclass set.
+PHASES = ['subclasses', 'users', 'notes', 'departments', 'retired_subclasses']
+
+class RolloverPlan:
+    """Writes computed by a rollover, grouped by phase.
+
+    Each change is ``(collection, doc_id, kind, fields, diff)`` where
+    ``kind`` is 'set' (new document) or 'update', and ``diff`` maps each
+    changed field to its ``(before, after)`` values.
+    """
+
+    def __init__(self, term: str):
+        self.term = term
+        self.changes: Dict[str, List[tuple]] = {phase: [] for phase in PHASES}
+        self.summary = Counter()
+        self.errors: List[str] = []
+        # (previous, moved) data of notes changing subclass, to re-index them
+        self.moved_notes: Dict[str, tuple] = {}
+
+    def add(self, phase: str, collection_name: str, doc_id: str, kind: str,
+            fields: Dict[str, Any], diff: Dict[str, tuple]):
+        self.changes[phase].append((collection_name, doc_id, kind, fields, diff))
+
+    def total(self) -> int:
+        return sum(len(changes) for changes in self.changes.values())
+
+def load_mapping(path: Optional[str]) -> Dict[str, str]:
+    """Subclass ID mapping ``{"old-id": "new-id"}`` from a JSON file"""
+    if not path:
+        return {}
+    with open(path, encoding='utf-8') as fp:
+        mapping = json.load(fp)
+    if not isinstance(mapping, dict):
+        raise ValueError(f"{path} must contain a JSON object of old -> new subclass IDs")
+    return {str(old): str(new) for old, new in mapping.items() if old != new}
+
+def advance(semester: int) -> Dict[str, int]:
+    """The semester and year a subclass moves to"""
+    semester += 1
+    return {'semester': semester, 'year': (semester + 1) // 2}
+
+def _diff(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, tuple]:
+    return {key: (before.get(key), value) for key, value in after.items() if before.get(key) != value}
+
+def plan_rollover(fm: FirestoreManager, term: str, mapping: Optional[Dict[str, str]] = None,
+                  max_semester: int = MAX_SEMESTER, reset_crs: bool = False) -> RolloverPlan:
+    """Compute every change of a rollover from one streamed snapshot.
+
+    Active subclasses advance one semester (their year follows from it);
+    those past ``max_semester`` graduate and are archived rather than
+    deleted, so notes that reference them stay valid. ``mapping`` moves a
+    subclass to a new, unused ID: the advanced document is written there,
+    its students and notes follow it and the old document is archived.
+
+    Every written subclass and user is stamped with ``rolledOverTo = term``
+    and skipped when seen again, so re-running a partly applied rollover
+    only finishes the remainder.
+    """
+    mapping = mapping or {}
+    plan = RolloverPlan(term)
+
+    departments = {doc['id']: doc for doc in fm.iter_collection('departments', fields=['subclasses'])}
+    all_subclasses = {doc['id']: doc for doc in fm.iter_collection('subclasses')}
+    subclasses = {key: doc for key, doc in all_subclasses.items() if not doc.get('archived')}
+
+    moved: Dict[str, str] = {}
+    for old_id, new_id in mapping.items():
+        source = all_subclasses.get(old_id)
+        if source is None:
+            plan.errors.append(f"mapping source '{old_id}' does not exist")
+        elif source.get('archived'):
+            if source.get('movedTo') != new_id:
+                plan.errors.append(f"mapping source '{old_id}' is archived")
+        else:
+            moved[old_id] = new_id
+    for new_id, count in Counter(moved.values()).items():
+        if count > 1:
+            plan.errors.append(f"{count} subclasses map to '{new_id}'")
+    for old_id, new_id in moved.items():
+        target = all_subclasses.get(new_id)
+        resumed = target is not None and target.get('rolledOverTo') == term and target.get('movedFrom') == old_id
+        if target is not None and not resumed:
+            plan.errors.append(f"mapping target '{new_id}' already exists; map to an unused ID")
+    if plan.errors:
+        return plan
+
+    final_ids: Dict[str, set] = {}
+    for subclass_id, data in sorted(subclasses.items()):
+        department = data.get('department')
+        if data.get('rolledOverTo') == term:
+            plan.summary['subclasses_already_rolled'] += 1
+            final_ids.setdefault(department, set()).add(subclass_id)
+            continue
+        semester = data.get('semester') or (data.get('year', 1) * 2 - 1)
+        fields = {**advance(semester), 'rolledOverTo': term}
+        if reset_crs and data.get('crId'):
+            fields['crId'] = None
+        if fields['semester'] > max_semester:
+            if subclass_id in moved:
+                plan.errors.append(f"'{subclass_id}' graduates this term; remove it from the mapping")
+                continue
+            fields = {'archived': True, 'rolledOverTo': term}
+            plan.add('subclasses', 'subclasses', subclass_id, 'update', fields, _diff(data, fields))
+            plan.summary['subclasses_graduated'] += 1
+            continue
+
+        new_id = moved.get(subclass_id)
+        if new_id is None:
+            plan.add('subclasses', 'subclasses', subclass_id, 'update', fields, _diff(data, fields))
+            plan.summary['subclasses_advanced'] += 1
+            final_ids.setdefault(department, set()).add(subclass_id)
+            continue
+
+        if new_id not in subclasses:
+            document = {key: value for key, value in data.items() if key not in ('id', 'updatedAt')}
+            for key, value in fields.items():
+                if value is None:
+                    document.pop(key, None)
+                else:
+                    document[key] = value
+            document.update(id=new_id, movedFrom=subclass_id,
+                            name=new_id if data.get('name') == subclass_id else data.get('name'))
+            plan.add('subclasses', 'subclasses', new_id, 'set', document,
+                     {'id': (subclass_id, new_id), **_diff(data, fields)})
+        retire = {'archived': True, 'movedTo': new_id, 'rolledOverTo': term}
+        plan.add('retired_subclasses', 'subclasses', subclass_id, 'update', retire, _diff(data, retire))
+        plan.summary['subclasses_moved'] += 1
+        final_ids.setdefault(department, set()).add(new_id)
+
+    rolled = set(subclasses)
+    for user in fm.iter_collection('users', fields=['subclass', 'role', 'rolledOverTo']):
+        if user.get('rolledOverTo') == term:
+            continue
+        fields = {}
+        if user.get('subclass') in moved:
+            fields['subclass'] = moved[user['subclass']]
+        if reset_crs and user.get('role') == 'cr' and user.get('subclass') in rolled:
+            fields['role'] = 'student'
+        if fields:
+            fields['rolledOverTo'] = term
+            plan.add('users', 'users', user['id'], 'update', fields, _diff(user, fields))
+            plan.summary['users_moved' if 'subclass' in fields else 'users_reset'] += 1
+
+    # NotesLibrary shows a student the notes of their subclass, so notes move with it
+    for old_id, new_id in sorted(moved.items()):
+        for note in fm.iter_collection('notes', [('subclassId', '==', old_id)], NOTE_SUMMARY_FIELDS + ['description']):
+            plan.add('notes', 'notes', note['id'], 'update', {'subclassId': new_id},
+                     {'subclassId': (old_id, new_id)})
+            plan.moved_notes[note['id']] = (note, {**note, 'subclassId': new_id})
+            plan.summary['notes_moved'] += 1
+
+    for dept_id, dept in sorted(departments.items()):
+        current = dept.get('subclasses') or []
+        # Keep IDs missing from the snapshot (e.g. created while planning)
+        kept = {sub for sub in current if sub not in all_subclasses and sub not in moved.values()}
+        wanted = sorted(kept | final_ids.get(dept_id, set()))
+        if wanted != current:
+            plan.add('departments', 'departments', dept_id, 'update', {'subclasses': wanted},
+                     {'subclasses': (current, wanted)})
+            plan.summary['departments_updated'] += 1
+    return plan
+
+def apply_rollover(fm: FirestoreManager, plan: RolloverPlan) -> Dict[str, Any]:
+    """Write the plan phase by phase, each phase in parallel atomic batches"""
+    stats = {}
+    for phase in PHASES:
+        changes = plan.changes[phase]
+        if not changes:
+            continue
+        started = time.monotonic()
+        writer = fm.bulk_writer()
+        for collection_name, doc_id, kind, fields, _ in changes:
+            ref = fm.db.collection(collection_name).document(doc_id)
+            fields = {key: firestore.DELETE_FIELD if value is None else value
+                      for key, value in fields.items()}
+            fields['updatedAt'] = firestore.SERVER_TIMESTAMP
+            if kind == 'set':
+                writer.set(ref, fields)
+            else:
+                writer.update(ref, fields)
+        result = writer.close()
+        stats[phase] = {'writes': result['operations'], 'failed': result['failed'],
+                        'seconds': round(time.monotonic() - started, 3)}
+        if result['failed']:
+            print(f"❌ Phase '{phase}' had {result['failed']} failed writes; stopping. "
+                  "Re-running the rollover resumes with what is left")
+            break
+        if phase == 'notes' and not fm.index_notes(plan.moved_notes):
+            print("⚠️ Moved notes were not fully re-indexed; run --action index-notes and build-search-index")
+    fm.cache.invalidate()
+    return stats
+
+def print_rollover_diff(plan: RolloverPlan, limit: Optional[int] = 50):
+    """Print the changes of a plan, per phase, as a field-level diff"""
+    print(f"\n🗓️  Rollover to {plan.term}: {plan.total()} writes")
+    for key, count in sorted(plan.summary.items()):
+        print(f"   {key}: {count}")
+    for phase in PHASES:
+        changes = plan.changes[phase]
+        if not changes:
+            continue
+        print(f"\n   [{phase}] {len(changes)} writes")
+        shown = changes if limit is None else changes[:limit]
+        for collection_name, doc_id, kind, _, diff in shown:
+            marker = '+' if kind == 'set' else '~'
+            fields = ', '.join(f"{key}: {before!r} -> {after!r}" for key, (before, after) in diff.items()
+                               if key != 'rolledOverTo')
+            print(f"   {marker} {collection_name}/{doc_id}: {fields}")
+        if len(shown) < len(changes):
+            print(f"   ... {len(changes) - len(shown)} more")
+
+def run_rollover(fm: FirestoreManager, term: str, mapping_path: Optional[str] = None,
+                 dry_run: bool = True, max_semester: int = MAX_SEMESTER,
+                 reset_crs: bool = False, diff_limit: Optional[int] = 50) -> Optional[Dict[str, Any]]:
+    """Plan a rollover, print its diff and apply it unless ``dry_run``"""
+    started = time.monotonic()
+    plan = plan_rollover(fm, term, load_mapping(mapping_path), max_semester, reset_crs)
+    if plan.errors:
+        for error in plan.errors:
+            print(f"❌ {error}")
+        return None
+    print_rollover_diff(plan, limit=diff_limit)
+    print(f"\n   Planned in {time.monotonic() - started:.2f}s")
+    if dry_run:
+        print("\n🔍 Dry run: nothing written (pass --apply to write)")
+        return {}
+    stats = apply_rollover(fm, plan)
+    for phase, result in stats.items():
+        print(f"   {phase}: {result['writes']} writes in {result['seconds']}s")
+    if any(result['failed'] for result in stats.values()):
+        return None
+    print(f"✅ Rolled over to {term}")
+    return stats
@@ -0,0 +1,276 @@
+import bisect
+import gzip
+import json
+import re
+from typing import Dict, List, Any, Optional, Iterable
+
+from firestore_client import firestore
+from firestore_manager import FirestoreManager, SHARED_NOTES_DOC, note_index_docs, note_index_page
+from instrumentation import estimate_size, unwrap
+from storage_backend import run_transaction
+
+SEARCH_INDEX_COLLECTION = 'searchIndex'
+SUBJECTS_SHARD = '_subjects'
+
+# Each shard is split into pages {shard}-{n} by a hash of the note (or
+# subject) ID, like the note visibility index; searchIndex/_manifest holds
+# the page count of each shard, and a shard missing from it has one page.
+# A note adds at most MAX_TERMS_PER_NOTE postings, so SEARCH_PAGE_ENTRIES
+# notes keep a page far from the 1 MiB document limit. A page that outgrows
+# SEARCH_PAGE_MAX_ENTRIES notes or SEARCH_PAGE_MAX_BYTES has its shard
+# repartitioned. ``terms`` is exempt from indexing (firestore.indexes.json),
+# so pages are not bound by the 40k index entries per document limit either.
+SEARCH_MANIFEST_DOC = '_manifest'
+SEARCH_PAGE_ENTRIES = 150
+SEARCH_PAGE_MAX_ENTRIES = 300
+SEARCH_PAGE_MAX_BYTES = 800_000
+MAX_TERMS_PER_NOTE = 64
+MIN_TERM_LENGTH = 2
+
+STOPWORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of',
+             'on', 'or', 'the', 'this', 'to', 'with'}
+
+SEARCH_NOTE_FIELDS = ['title', 'description', 'subjectCode', 'tags', 'subclassId', 'isShared']
+SEARCH_SUBJECT_FIELDS = ['code', 'name', 'description']
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Lowercased alphanumeric words, in order, without stopwords or one-letter words"""
+    return [token for token in _TOKEN.findall((text or '').lower())
+            if (len(token) >= MIN_TERM_LENGTH or token.isdigit()) and token not in STOPWORDS]
+
+def _terms(parts: Iterable[Optional[str]]) -> List[str]:
+    terms = list(dict.fromkeys(token for part in parts for token in tokenize(part)))
+    return terms[:MAX_TERMS_PER_NOTE]
+
+def note_terms(note: Dict[str, Any]) -> List[str]:
+    """Search terms of a note: the fields NotesLibrary's search box matches, most specific first"""
+    return _terms([note.get('subjectCode'), note.get('title'), *(note.get('tags') or []),
+                   note.get('description')])
+
+def subject_terms(subject: Dict[str, Any]) -> List[str]:
+    return _terms([subject.get('code'), subject.get('name'), subject.get('description')])
+
+def add_postings(terms: Dict[str, List[str]], doc_id: str, doc_terms: List[str]):
+    for term in doc_terms:
+        postings = terms.setdefault(term, [])
+        if doc_id not in postings:
+            bisect.insort(postings, doc_id)
+
+def remove_postings(terms: Dict[str, List[str]], doc_ids: set):
+    for term in list(terms):
+        postings = [doc_id for doc_id in terms[term] if doc_id not in doc_ids]
+        if postings:
+            terms[term] = postings
+        else:
+            del terms[term]
+
+def search_terms(terms: Dict[str, List[str]], query: str) -> List[str]:
+    """IDs matching every word of ``query``, each word as a prefix of an indexed term.
+
+    This is the lookup the search box runs against a downloaded shard:
+    the sorted term list is bisected once per query word, so typing "alg"
+    finds notes about "algorithms" without scanning any note.
+    """
+    words = tokenize(query)
+    if not words:
+        return []
+    keys = sorted(terms)
+    matches = None
+    for word in words:
+        found = set()
+        position = bisect.bisect_left(keys, word)
+        while position < len(keys) and keys[position].startswith(word):
+            found.update(terms[keys[position]])
+            position += 1
+        matches = found if matches is None else matches & found
+        if not matches:
+            return []
+    return sorted(matches)
+
+def split_terms(shard: str, terms: Dict[str, List[str]], pages: int) -> Dict[str, Dict[str, List[str]]]:
+    """The postings of a shard split into ``pages`` pages by a hash of each ID, by page ID"""
+    split: Dict[str, Dict[str, List[str]]] = {f"{shard}-{page}": {} for page in range(pages)}
+    for term, postings in terms.items():
+        for doc_id in postings:
+            split[note_index_page(shard, doc_id, pages)].setdefault(term, []).append(doc_id)
+    return split
+
+def shard_pages(terms: Dict[str, List[str]]) -> int:
+    """Pages a shard is split into, for the IDs it indexes"""
+    count = len({doc_id for postings in terms.values() for doc_id in postings})
+    return max(1, -(-count // SEARCH_PAGE_ENTRIES))
+
+def compact_shard(terms: Dict[str, List[str]]) -> Dict[str, Any]:
+    """Encode a shard with postings as positions into one ID list, for the search file"""
+    ids = sorted({doc_id for postings in terms.values() for doc_id in postings})
+    position = {doc_id: i for i, doc_id in enumerate(ids)}
+    return {'ids': ids, 'terms': {term: [position[doc_id] for doc_id in postings]
+                                  for term, postings in sorted(terms.items())}}
+
+class SearchIndex:
+    """Inverted index over notes and subjects, split into paged shards.
+
+    The ``searchIndex/{subclassId}-{n}`` pages index the notes of a
+    subclass, ``searchIndex/_shared-{n}`` every shared note (the same split
+    as the note visibility index) and ``searchIndex/_subjects-{n}`` the
+    subject catalog. Each page holds a ``terms`` map of word -> sorted IDs;
+    prefixes are matched against the sorted words at query time, so only
+    whole words are stored. A student's search downloads the pages of two
+    shards instead of every note.
+    """
+
+    def __init__(self, fm: FirestoreManager):
+        self.fm = fm
+
+    def _ref(self, doc_id: str):
+        return self.fm.db.collection(SEARCH_INDEX_COLLECTION).document(doc_id)
+
+    def _pages(self, transaction=None) -> Dict[str, int]:
+        snapshot = self._ref(SEARCH_MANIFEST_DOC).get(transaction=transaction)
+        return dict((snapshot.to_dict() or {}).get('pages', {})) if snapshot.exists else {}
+
+    def build(self) -> Dict[str, Dict[str, List[str]]]:
+        """Every shard, from one pass over notes and subjects"""
+        shards: Dict[str, Dict[str, List[str]]] = {SHARED_NOTES_DOC: {}, SUBJECTS_SHARD: {}}
+        for note in self.fm.iter_collection('notes', fields=SEARCH_NOTE_FIELDS):
+            doc_terms = note_terms(note)
+            for shard in note_index_docs(note):
+                add_postings(shards.setdefault(shard, {}), note['id'], doc_terms)
+        for subject in self.fm.iter_subjects(fields=SEARCH_SUBJECT_FIELDS):
+            add_postings(shards[SUBJECTS_SHARD], subject.get('code') or subject['id'], subject_terms(subject))
+        return shards
+
+    def rebuild(self, output_path: Optional[str] = None) -> Dict[str, int]:
+        """Rewrite every page and the manifest (and optionally the search file); returns terms per shard"""
+        try:
+            shards = self.build()
+            pages = {shard: shard_pages(terms) for shard, terms in shards.items()}
+            documents: Dict[str, Dict[str, List[str]]] = {}
+            for shard, terms in shards.items():
+                documents.update(split_terms(shard, terms, pages[shard]))
+            largest = max(estimate_size({'terms': terms}) for terms in documents.values())
+            if largest > SEARCH_PAGE_MAX_BYTES:
+                print(f"⚠️ Largest search page is {largest / 1024:.0f} KiB; lower SEARCH_PAGE_ENTRIES")
+
+            existing = {doc['id'] for doc in self.fm.iter_collection(SEARCH_INDEX_COLLECTION, fields=[])}
+            with self.fm.bulk_writer() as writer:
+                for doc_id, terms in documents.items():
+                    writer.set(self._ref(doc_id), {'terms': terms, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                writer.set(self._ref(SEARCH_MANIFEST_DOC), {
+                    'pages': pages, 'updatedAt': firestore.SERVER_TIMESTAMP
+                })
+                for doc_id in existing - set(documents) - {SEARCH_MANIFEST_DOC}:
+                    writer.delete(self._ref(doc_id))
+            if output_path:
+                write_search_file(shards, output_path)
+            counts = {shard: len(terms) for shard, terms in shards.items()}
+            print(f"✅ Rebuilt search index: {len(counts)} shards in {len(documents)} pages, "
+                  f"{sum(counts.values())} terms")
+            return counts
+        except Exception as e:
+            print(f"❌ Failed to rebuild search index: {e}")
+            return {}
+
+    def update_notes(self, notes: Dict[str, Optional[Dict[str, Any]]],
+                     previous: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Re-index changed notes; ``None`` data means the note was deleted.
+
+        ``previous`` holds the old data of notes whose subclass or sharing
+        may have changed, so they are removed from shards they left. Each
+        affected shard is rewritten in its own transaction, so concurrent
+        updates of one shard never lose each other's postings.
+        """
+        previous = previous or {}
+        touched: Dict[str, set] = {}
+        for note_id, data in notes.items():
+            for shard in note_index_docs(data or {}) + note_index_docs(previous.get(note_id) or {}):
+                touched.setdefault(shard, set()).add(note_id)
+        for shard, note_ids in sorted(touched.items()):
+            additions = {note_id: note_terms(notes[note_id]) for note_id in note_ids
+                         if notes[note_id] and shard in note_index_docs(notes[note_id])}
+            try:
+                self._update_shard(shard, note_ids, additions)
+            except Exception as e:
+                print(f"❌ Failed to update search shard {shard}: {e}")
+
+    def remove_subjects(self, subject_codes: Iterable[str]):
+        """Drop deleted subjects from the subjects shard"""
+        try:
+            self._update_shard(SUBJECTS_SHARD, set(subject_codes), {})
+        except Exception as e:
+            print(f"❌ Failed to update search shard {SUBJECTS_SHARD}: {e}")
+
+    def _update_shard(self, shard: str, remove_ids: set, additions: Dict[str, List[str]]):
+        def update(transaction):
+            # Read with the pages: a concurrent repartition makes the transaction retry
+            pages = self._pages(transaction).get(shard, 1)
+            changed: Dict[str, set] = {}
+            for doc_id in remove_ids | set(additions):
+                changed.setdefault(note_index_page(shard, doc_id, pages), set()).add(doc_id)
+            snapshots = {doc_id: self._ref(doc_id).get(transaction=transaction) for doc_id in sorted(changed)}
+            written = {}
+            for doc_id, doc_ids in changed.items():
+                snapshot = snapshots[doc_id]
+                terms = (snapshot.to_dict() or {}).get('terms', {}) if snapshot.exists else {}
+                remove_postings(terms, doc_ids)
+                for entry_id in doc_ids & set(additions):
+                    add_postings(terms, entry_id, additions[entry_id])
+                transaction.set(unwrap(self._ref(doc_id)), {'terms': terms, 'updatedAt': firestore.SERVER_TIMESTAMP})
+                written[doc_id] = terms
+            return written
+
+        if any(self._is_full(terms) for terms in run_transaction(self.fm.db, update).values()):
+            self.repartition(shard)
+
+    def _is_full(self, terms: Dict[str, List[str]]) -> bool:
+        entries = len({doc_id for postings in terms.values() for doc_id in postings})
+        return entries > SEARCH_PAGE_MAX_ENTRIES or estimate_size({'terms': terms}) > SEARCH_PAGE_MAX_BYTES
+
+    def repartition(self, shard: str) -> int:
+        """Split a shard into more pages, at least twice as many; returns the new page count"""
+        manifest_ref = self._ref(SEARCH_MANIFEST_DOC)
+
+        def update(transaction):
+            pages = self._pages(transaction).get(shard, 1)
+            terms: Dict[str, List[str]] = {}
+            for page in range(pages):
+                snapshot = self._ref(f"{shard}-{page}").get(transaction=transaction)
+                for term, postings in ((snapshot.to_dict() or {}).get('terms', {}) if snapshot.exists else {}).items():
+                    terms.setdefault(term, []).extend(postings)
+            for postings in terms.values():
+                postings.sort()
+            new_pages = max(shard_pages(terms), pages * 2)
+            for doc_id, page_terms in split_terms(shard, terms, new_pages).items():
+                transaction.set(unwrap(self._ref(doc_id)), {'terms': page_terms,
+                                                            'updatedAt': firestore.SERVER_TIMESTAMP})
+            transaction.set(unwrap(manifest_ref), {'pages': {shard: new_pages},
+                                                   'updatedAt': firestore.SERVER_TIMESTAMP}, merge=True)
+            return new_pages
+
+        pages = run_transaction(self.fm.db, update)
+        print(f"✅ Split search shard {shard} into {pages} pages")
+        return pages
+
+    def search(self, query: str, subclass: Optional[str] = None, subjects: bool = False) -> List[str]:
+        """IDs matching ``query`` in a subclass's shard plus the shared shard (or in subjects)"""
+        shards = [SUBJECTS_SHARD] if subjects else [shard for shard in (subclass, SHARED_NOTES_DOC) if shard]
+        pages = self._pages()
+        matches = set()
+        for shard in shards:
+            for page in range(pages.get(shard, 1)):
+                snapshot = self._ref(f"{shard}-{page}").get()
+                if snapshot.exists:
+                    matches.update(search_terms((snapshot.to_dict() or {}).get('terms', {}), query))
+        return sorted(matches)
+
+def write_search_file(shards: Dict[str, Dict[str, List[str]]], path: str):
+    """Write every shard, position-encoded, to one JSON file (gzipped if the name ends in .gz)"""
+    payload = json.dumps({'version': 1, 'shards': {shard: compact_shard(terms)
+                                                    for shard, terms in sorted(shards.items())}},
+                         separators=(',', ':')).encode('utf-8')
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wb') as fp:
+        fp.write(payload)
+    print(f"💾 Saved search index to {path} ({len(payload) / 1024:.0f} KiB uncompressed)")
@@ -0,0 +1,762 @@
+import copy
+import enum
+import gzip
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+from functools import cmp_to_key
+from typing import Dict, List, Any, Optional, Iterator, Callable, Tuple
+
+from firestore_client import DEFAULT_SERVICE_ACCOUNT, firestore, get_client
+from instrumentation import unwrap
+
+BACKENDS = ['firestore', 'memory']
+
+class BackendUnavailable(RuntimeError):
+    """The storage backend could not be opened (missing credentials, unreadable snapshot, ...)"""
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    return str(value)
+
+def json_object_hook(obj):
+    if '__datetime__' in obj:
+        return datetime.fromisoformat(obj['__datetime__'])
+    return obj
+
+def connect(backend: str = 'firestore', service_account_path: str = DEFAULT_SERVICE_ACCOUNT,
+            snapshot: Optional[str] = None):
+    """A client for ``backend``: the shared Firestore client, or a MemoryClient loaded from ``snapshot``"""
+    if backend == 'firestore':
+        return get_client(service_account_path)
+    if backend == 'memory':
+        client = MemoryClient()
+        if snapshot:
+            load_snapshot(client, snapshot)
+        return client
+    raise ValueError(f"unknown backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+
+def run_transaction(db, fn: Callable[[Any], Any]):
+    """Run ``fn(transaction)`` atomically on either backend and return its result.
+
+    Firestore transactions are retried by the SDK on contention; the
+    memory engine runs ``fn`` under the client lock. Writes inside ``fn``
+    must go through the transaction object it receives.
+    """
+    client = unwrap(db)
+    if isinstance(client, MemoryClient):
+        with client._lock:
+            transaction = client.transaction()
+            result = fn(transaction)
+            transaction.commit()
+            return result
+    return firestore.transactional(fn)(client.transaction())
+
+# ---------------------------------------------------------------------------
+# In-memory engine
+# ---------------------------------------------------------------------------
+
+_MISSING = object()
+
+ChangeType = enum.Enum('ChangeType', 'ADDED MODIFIED REMOVED')
+DocumentChange = namedtuple('DocumentChange', ['type', 'document', 'old_index', 'new_index'])
+AggregationResult = namedtuple('AggregationResult', ['alias', 'value', 'read_time'])
+
+def _get_path(data: Dict[str, Any], path: str):
+    value = data
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _value_key(value):
+    """Comparable, hashable key following Firestore's cross-type ordering"""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        aware = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return (3, aware.timestamp())
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(_value_key(item) for item in value))
+    if isinstance(value, dict):
+        return (9, tuple(sorted((key, _value_key(item)) for key, item in value.items())))
+    return (6, str(value))
+
+def _compare_keys(a, b) -> int:
+    return (a > b) - (a < b)
+
+def _matches(data: Dict[str, Any], doc_id: str, field: str, op: str, value) -> bool:
+    current = doc_id if field == '__name__' else _get_path(data, field)
+    if field == '__name__':
+        value = [getattr(item, 'id', item) for item in value] if op in ('in', 'not-in') else getattr(value, 'id', value)
+    if current is _MISSING:
+        return False
+    if op == 'array-contains':
+        return isinstance(current, list) and _value_key(value) in {_value_key(item) for item in current}
+    if op == 'array-contains-any':
+        return isinstance(current, list) and bool({_value_key(item) for item in current} &
+                                                  {_value_key(item) for item in value})
+    key = _value_key(current)
+    if op == '==':
+        return key == _value_key(value)
+    if op == '!=':
+        return current is not None and key != _value_key(value)
+    if op == 'in':
+        return key in {_value_key(item) for item in value}
+    if op == 'not-in':
+        return current is not None and key not in {_value_key(item) for item in value}
+    other = _value_key(value)
+    if key[0] != other[0]:
+        # Range filters only match values of the same type
+        return False
+    if op == '<':
+        return key < other
+    if op == '<=':
+        return key <= other
+    if op == '>':
+        return key > other
+    if op == '>=':
+        return key >= other
+    raise ValueError(f"unsupported operator '{op}'")
+
+def _transforms():
+    return (firestore.SERVER_TIMESTAMP, firestore.DELETE_FIELD, firestore.ArrayUnion,
+            firestore.ArrayRemove, firestore.Increment)
+
+def _resolve(target: Dict[str, Any], key: str, value, now: datetime, merge_maps: bool):
+    """Write ``value`` at ``target[key]``, applying Firestore field transforms"""
+    server_timestamp, delete_field, array_union, array_remove, increment = _transforms()
+    if value is delete_field:
+        target.pop(key, None)
+    elif value is server_timestamp:
+        target[key] = now
+    elif isinstance(value, array_union):
+        current = list(target.get(key) or []) if isinstance(target.get(key), list) else []
+        keys = {_value_key(item) for item in current}
+        for item in value.values:
+            if _value_key(item) not in keys:
+                current.append(copy.deepcopy(item))
+                keys.add(_value_key(item))
+        target[key] = current
+    elif isinstance(value, array_remove):
+        removed = {_value_key(item) for item in value.values}
+        current = target.get(key) if isinstance(target.get(key), list) else []
+        target[key] = [item for item in current if _value_key(item) not in removed]
+    elif isinstance(value, increment):
+        current = target.get(key)
+        is_number = isinstance(current, (int, float)) and not isinstance(current, bool)
+        target[key] = (current if is_number else 0) + value.value
+    elif isinstance(value, dict):
+        child = target.get(key) if merge_maps and isinstance(target.get(key), dict) else {}
+        target[key] = child
+        for child_key, child_value in value.items():
+            _resolve(child, child_key, child_value, now, merge_maps)
+    else:
+        target[key] = copy.deepcopy(value)
+
+def _project(data: Dict[str, Any], field_paths: Optional[List[str]]) -> Dict[str, Any]:
+    if field_paths is None:
+        # Writes replace stored dicts instead of mutating them, so snapshots can share them
+        return data
+    projected: Dict[str, Any] = {}
+    for path in field_paths:
+        value = _get_path(data, path)
+        if value is _MISSING:
+            continue
+        parts = path.split('.')
+        target = projected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = copy.deepcopy(value)
+    return projected
+
+class _Store:
+    """Documents of one collection path, with equality and array-contains indexes.
+
+    An index is built the first time a query filters on its field and is
+    then maintained on every write, so repeated ``where(field, '==', v)``
+    lookups cost one dict access instead of a scan.
+    """
+
+    def __init__(self):
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.indexes: Dict[Tuple[str, bool], Dict[Any, set]] = {}
+
+    @staticmethod
+    def _keys(data: Dict[str, Any], field: str, array: bool) -> List[Any]:
+        value = _get_path(data, field)
+        if value is _MISSING:
+            return []
+        if array:
+            return [_value_key(item) for item in value] if isinstance(value, list) else []
+        return [_value_key(value)]
+
+    def index(self, field: str, array: bool = False) -> Dict[Any, set]:
+        if (field, array) not in self.indexes:
+            index: Dict[Any, set] = {}
+            for doc_id, data in self.docs.items():
+                for key in self._keys(data, field, array):
+                    index.setdefault(key, set()).add(doc_id)
+            self.indexes[(field, array)] = index
+        return self.indexes[(field, array)]
+
+    def put(self, doc_id: str, data: Optional[Dict[str, Any]]):
+        """Store (or with ``None``, remove) a document and update the indexes"""
+        old = self.docs.get(doc_id)
+        for (field, array), index in self.indexes.items():
+            if old is not None:
+                for key in self._keys(old, field, array):
+                    ids = index.get(key)
+                    if ids is not None:
+                        ids.discard(doc_id)
+                        if not ids:
+                            del index[key]
+            if data is not None:
+                for key in self._keys(data, field, array):
+                    index.setdefault(key, set()).add(doc_id)
+        if data is None:
+            self.docs.pop(doc_id, None)
+        else:
+            self.docs[doc_id] = data
+
+    def candidates(self, filters: List[tuple]) -> Iterator[str]:
+        """IDs that may match ``filters``, narrowed by the most selective indexable filter"""
+        best = None
+        for field, op, value in filters:
+            if field == '__name__':
+                continue
+            if op == '==':
+                ids = self.index(field).get(_value_key(value), set())
+            elif op == 'in':
+                index = self.index(field)
+                ids = set().union(*(index.get(_value_key(item), set()) for item in value))
+            elif op == 'array-contains':
+                ids = self.index(field, array=True).get(_value_key(value), set())
+            elif op == 'array-contains-any':
+                index = self.index(field, array=True)
+                ids = set().union(*(index.get(_value_key(item), set()) for item in value))
+            else:
+                continue
+            if best is None or len(ids) < len(best):
+                best = ids
+        return iter(list(best)) if best is not None else iter(list(self.docs))
+
+class MemoryDocumentSnapshot:
+    def __init__(self, reference: 'MemoryDocumentReference', data: Optional[Dict[str, Any]],
+                 read_time: Optional[datetime] = None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.read_time = read_time
+        self._data = data
+
+    def to_dict(self) -> Optional[Dict[str, Any]]:
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path: str):
+        value = _get_path(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+class MemoryDocumentReference:
+    def __init__(self, client: 'MemoryClient', collection_path: str, doc_id: str):
+        self._client = client
+        self._collection_path = collection_path
+        self.id = doc_id
+        self.path = f"{collection_path}/{doc_id}"
+
+    @property
+    def parent(self) -> 'MemoryCollectionReference':
+        return MemoryCollectionReference(self._client, self._collection_path)
+
+    def collection(self, name: str) -> 'MemoryCollectionReference':
+        return MemoryCollectionReference(self._client, f"{self.path}/{name}")
+
+    def collections(self) -> List['MemoryCollectionReference']:
+        prefix = self.path + '/'
+        with self._client._lock:
+            paths = [path for path, store in self._client._stores.items()
+                     if store.docs and path.startswith(prefix) and '/' not in path[len(prefix):]]
+        return [MemoryCollectionReference(self._client, path) for path in sorted(paths)]
+
+    def get(self, field_paths: Optional[List[str]] = None, transaction=None) -> MemoryDocumentSnapshot:
+        with self._client._lock:
+            store = self._client._stores.get(self._collection_path)
+            data = store.docs.get(self.id) if store is not None else None
+            return MemoryDocumentSnapshot(self, _project(data, field_paths) if data is not None else None,
+                                          self._client._now())
+
+    def set(self, document_data: Dict[str, Any], merge: bool = False):
+        self._client._commit([('set', self, document_data, merge)])
+
+    def update(self, field_updates: Dict[str, Any]):
+        self._client._commit([('update', self, field_updates, None)])
+
+    def delete(self):
+        self._client._commit([('delete', self, None, None)])
+
+    def create(self, document_data: Dict[str, Any]):
+        self._client._commit([('create', self, document_data, None)])
+
+    def __eq__(self, other):
+        return isinstance(other, MemoryDocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+class MemoryQuery:
+    def __init__(self, client: 'MemoryClient', path: str, all_descendants: bool = False):
+        self._client = client
+        self._path = path
+        self._all_descendants = all_descendants
+        self._filters: List[tuple] = []
+        self._orders: List[Tuple[str, str]] = []
+        self._limit: Optional[int] = None
+        self._offset = 0
+        self._cursor = None
+        self._projection: Optional[List[str]] = None
+
+    def _copy(self, **changes) -> 'MemoryQuery':
+        query = copy.copy(self)
+        query._filters = list(self._filters)
+        query._orders = list(self._orders)
+        for key, value in changes.items():
+            setattr(query, key, value)
+        return query
+
+    def where(self, field_path: Optional[str] = None, op_string: Optional[str] = None, value=None,
+              *, filter=None) -> 'MemoryQuery':
+        if filter is not None:
+            if not hasattr(filter, 'field_path'):
+                raise NotImplementedError("the memory backend supports FieldFilter filters only")
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        query = self._copy()
+        # The SDK spells array operators with underscores, the console with hyphens
+        query._filters.append((field_path, op_string.replace('_', '-'), value))
+        return query
+
+    def order_by(self, field_path: str, direction: str = 'ASCENDING') -> 'MemoryQuery':
+        query = self._copy()
+        query._orders.append((field_path, str(direction).upper()))
+        return query
+
+    def limit(self, count: int) -> 'MemoryQuery':
+        return self._copy(_limit=count)
+
+    def offset(self, num_to_skip: int) -> 'MemoryQuery':
+        return self._copy(_offset=num_to_skip)
+
+    def select(self, field_paths: List[str]) -> 'MemoryQuery':
+        return self._copy(_projection=list(field_paths))
+
+    def start_after(self, document_fields_or_snapshot) -> 'MemoryQuery':
+        return self._copy(_cursor=document_fields_or_snapshot)
+
+    def count(self, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self, 'count', None, alias)
+
+    def sum(self, field_ref: str, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self, 'sum', field_ref, alias)
+
+    def avg(self, field_ref: str, alias: Optional[str] = None) -> 'MemoryAggregationQuery':
+        return MemoryAggregationQuery(self, 'avg', field_ref, alias)
+
+    def _sort_key(self, collection_path: str, doc_id: str, data: Dict[str, Any]):
+        values = []
+        for field, _ in self._orders:
+            value = f"{collection_path}/{doc_id}" if field == '__name__' else _get_path(data, field)
+            if value is _MISSING:
+                return None
+            values.append(_value_key(value))
+        return values + [_value_key(f"{collection_path}/{doc_id}")]
+
+    def _compare(self, a, b) -> int:
+        directions = [direction for _, direction in self._orders] + ['ASCENDING']
+        for key_a, key_b, direction in zip(a, b, directions):
+            result = _compare_keys(key_a, key_b)
+            if result:
+                return -result if direction == 'DESCENDING' else result
+        return 0
+
+    def _cursor_key(self):
+        cursor = unwrap(self._cursor)
+        if isinstance(cursor, dict):
+            return [_value_key(self._cursor_name(cursor.get(field)) if field == '__name__' else cursor.get(field))
+                    for field, _ in self._orders]
+        reference = cursor.reference
+        key = self._sort_key(reference._collection_path, reference.id, cursor.to_dict() or {})
+        if key is None:
+            # A projected snapshot may lack the ordered fields; use the stored document
+            key = self._sort_key(reference._collection_path, reference.id, reference.get().to_dict() or {})
+        return key
+
+    def _cursor_name(self, value):
+        """Full path for a ``__name__`` cursor value, given as a reference or a document ID"""
+        value = getattr(unwrap(value), 'path', value)
+        if isinstance(value, str) and '/' not in value:
+            value = f"{self._path}/{value}"
+        return value
+
+    def _matching(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        """(collection path, id, data) of every document matching the filters, unordered"""
+        results = []
+        for path, store in self._client._stores_for(self._path, self._all_descendants):
+            for doc_id in store.candidates(self._filters):
+                data = store.docs.get(doc_id)
+                if data is not None and all(_matches(data, doc_id, *f) for f in self._filters):
+                    results.append((path, doc_id, data))
+        return results
+
+    def _run(self) -> List[MemoryDocumentSnapshot]:
+        with self._client._lock:
+            keyed = []
+            for path, doc_id, data in self._matching():
+                key = self._sort_key(path, doc_id, data)
+                if key is not None:
+                    keyed.append((key, path, doc_id, data))
+            if self._cursor is not None:
+                anchor = self._cursor_key()
+                keyed = [item for item in keyed if self._compare(item[0][:len(anchor)], anchor) > 0]
+            order = cmp_to_key(self._compare)
+            sort_key = lambda item: order(item[0])
+            if self._limit is not None:
+                # A page needs only its first rows, not the whole result sorted
+                keyed = heapq.nsmallest(self._offset + self._limit, keyed, key=sort_key)[self._offset:]
+            else:
+                keyed = sorted(keyed, key=sort_key)[self._offset:]
+            now = self._client._now()
+            return [MemoryDocumentSnapshot(MemoryDocumentReference(self._client, path, doc_id),
+                                           _project(data, self._projection), now)
+                    for _, path, doc_id, data in keyed]
+
+    def stream(self, transaction=None) -> Iterator[MemoryDocumentSnapshot]:
+        return iter(self._run())
+
+    def get(self, transaction=None) -> List[MemoryDocumentSnapshot]:
+        return self._run()
+
+    def on_snapshot(self, callback: Callable) -> '_Watch':
+        return self._client._listen(self, callback)
+
+class MemoryCollectionReference(MemoryQuery):
+    def __init__(self, client: 'MemoryClient', path: str):
+        super().__init__(client, path)
+        self.id = path.split('/')[-1]
+
+    @property
+    def parent(self) -> Optional[MemoryDocumentReference]:
+        parts = self._path.split('/')
+        if len(parts) < 2:
+            return None
+        return MemoryDocumentReference(self._client, '/'.join(parts[:-2]), parts[-2])
+
+    def document(self, document_id: Optional[str] = None) -> MemoryDocumentReference:
+        return MemoryDocumentReference(self._client, self._path, document_id or self._client._auto_id())
+
+    def add(self, document_data: Dict[str, Any], document_id: Optional[str] = None):
+        ref = self.document(document_id)
+        ref.create(document_data)
+        return self._client._now(), ref
+
+    def list_documents(self) -> List[MemoryDocumentReference]:
+        with self._client._lock:
+            store = self._client._stores.get(self._path)
+            return [self.document(doc_id) for doc_id in sorted(store.docs)] if store else []
+
+class MemoryAggregationQuery:
+    def __init__(self, query: MemoryQuery, kind: str, field: Optional[str], alias: Optional[str]):
+        self._query = query
+        self._kind = kind
+        self._field = field
+        self._alias = alias or 'field_1'
+
+    def get(self, transaction=None) -> List[List[AggregationResult]]:
+        with self._query._client._lock:
+            docs = self._query._matching()
+            if self._kind == 'count':
+                value = len(docs)
+            else:
+                numbers = [value for _, _, data in docs
+                           for value in [_get_path(data, self._field)]
+                           if isinstance(value, (int, float)) and not isinstance(value, bool)]
+                if self._kind == 'sum':
+                    value = sum(numbers)
+                else:
+                    value = sum(numbers) / len(numbers) if numbers else None
+        return [[AggregationResult(self._alias, value, self._query._client._now())]]
+
+class MemoryWriteBatch:
+    """Queued writes applied atomically by commit()"""
+
+    def __init__(self, client: 'MemoryClient'):
+        self._client = client
+        self._writes: List[tuple] = []
+
+    def set(self, reference, document_data: Dict[str, Any], merge: bool = False):
+        self._writes.append(('set', unwrap(reference), document_data, merge))
+
+    def update(self, reference, field_updates: Dict[str, Any]):
+        self._writes.append(('update', unwrap(reference), field_updates, None))
+
+    def delete(self, reference):
+        self._writes.append(('delete', unwrap(reference), None, None))
+
+    def create(self, reference, document_data: Dict[str, Any]):
+        self._writes.append(('create', unwrap(reference), document_data, None))
+
+    def commit(self) -> list:
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+    def __len__(self):
+        return len(self._writes)
+
+class MemoryTransaction(MemoryWriteBatch):
+    def get(self, ref_or_query):
+        ref_or_query = unwrap(ref_or_query)
+        if isinstance(ref_or_query, MemoryDocumentReference):
+            return ref_or_query.get()
+        return ref_or_query.stream()
+
+class _Watch:
+    def __init__(self, client: 'MemoryClient', listener: list):
+        self._client = client
+        self._listener = listener
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self._listener in self._client._listeners:
+                self._client._listeners.remove(self._listener)
+
+class MemoryClient:
+    """In-memory storage engine with the Firestore client API used by these scripts.
+
+    Collections are plain dicts keyed by path (subcollections included),
+    with equality and array-contains indexes built on first use; batches
+    and transactions apply atomically under one lock. Queries, cursors,
+    projections, count/sum aggregations, field transforms and listeners
+    behave like Firestore's, so FirestoreManager and the admin scripts run
+    unchanged against it, at memory speed and without credentials.
+    """
+
+    def __init__(self):
+        self._stores: Dict[str, _Store] = {}
+        self._lock = threading.RLock()
+        self._listeners: List[list] = []
+        self._ids = 0
+
+    def _now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def _auto_id(self) -> str:
+        with self._lock:
+            self._ids += 1
+            return f"mem{self._ids:017d}"
+
+    def _store(self, path: str) -> _Store:
+        if path not in self._stores:
+            self._stores[path] = _Store()
+        return self._stores[path]
+
+    def _stores_for(self, path: str, all_descendants: bool) -> List[Tuple[str, _Store]]:
+        if not all_descendants:
+            return [(path, self._stores[path])] if path in self._stores else []
+        return [(store_path, store) for store_path, store in self._stores.items()
+                if store_path.split('/')[-1] == path]
+
+    def collection(self, path: str) -> MemoryCollectionReference:
+        return MemoryCollectionReference(self, path)
+
+    def collection_group(self, collection_id: str) -> MemoryQuery:
+        return MemoryQuery(self, collection_id, all_descendants=True)
+
+    def document(self, path: str) -> MemoryDocumentReference:
+        collection_path, doc_id = path.rsplit('/', 1)
+        return MemoryDocumentReference(self, collection_path, doc_id)
+
+    def collections(self) -> List[MemoryCollectionReference]:
+        with self._lock:
+            paths = sorted(path for path, store in self._stores.items() if store.docs and '/' not in path)
+        return [MemoryCollectionReference(self, path) for path in paths]
+
+    def batch(self) -> MemoryWriteBatch:
+        return MemoryWriteBatch(self)
+
+    def transaction(self, **kwargs) -> MemoryTransaction:
+        return MemoryTransaction(self)
+
+    def get_all(self, references, field_paths: Optional[List[str]] = None,
+                transaction=None) -> Iterator[MemoryDocumentSnapshot]:
+        with self._lock:
+            snapshots = [unwrap(ref).get(field_paths=field_paths) for ref in references]
+        return iter(snapshots)
+
+    def put_document(self, collection_path: str, doc_id: str, data: Dict[str, Any]):
+        """Store a document as-is, without transforms or listeners (used by snapshot loading)"""
+        with self._lock:
+            self._store(collection_path).put(doc_id, data)
+
+    def document_count(self) -> int:
+        with self._lock:
+            return sum(len(store.docs) for store in self._stores.values())
+
+    def _commit(self, writes: List[tuple]) -> list:
+        now = self._now()
+        with self._lock:
+            undo: Dict[Tuple[str, str], Optional[Dict[str, Any]]] = {}
+            try:
+                for kind, ref, data, merge in writes:
+                    store = self._store(ref._collection_path)
+                    current = store.docs.get(ref.id)
+                    undo.setdefault((ref._collection_path, ref.id), current)
+                    if kind == 'delete':
+                        store.put(ref.id, None)
+                        continue
+                    if kind == 'create' and current is not None:
+                        raise ValueError(f"Document already exists: {ref.path}")
+                    if kind == 'update' and current is None:
+                        raise LookupError(f"No document to update: {ref.path}")
+                    document = copy.deepcopy(current) if current is not None and kind != 'create' and (
+                        merge or kind == 'update') else {}
+                    for key, value in data.items():
+                        if kind == 'update':
+                            # Update keys are field paths; maps at the path are replaced
+                            parts = key.split('.')
+                            target = document
+                            for part in parts[:-1]:
+                                if not isinstance(target.get(part), dict):
+                                    target[part] = {}
+                                target = target[part]
+                            _resolve(target, parts[-1], value, now, merge_maps=False)
+                        else:
+                            _resolve(document, key, value, now, merge_maps=bool(merge))
+                    store.put(ref.id, document)
+            except Exception:
+                for (collection_path, doc_id), previous in undo.items():
+                    self._stores[collection_path].put(doc_id, previous)
+                raise
+            changed = {key: (previous, self._stores[key[0]].docs.get(key[1])) for key, previous in undo.items()}
+            listeners = list(self._listeners)
+        if listeners:
+            self._notify(listeners, changed)
+        return [now] * len(writes)
+
+    def _listen(self, query: MemoryQuery, callback: Callable) -> _Watch:
+        with self._lock:
+            listener = [query, callback, {}]
+            snapshots = query._run()
+            listener[2] = {snapshot.reference.path: snapshot for snapshot in snapshots}
+            self._listeners.append(listener)
+        changes = [DocumentChange(ChangeType.ADDED, snapshot, -1, i) for i, snapshot in enumerate(snapshots)]
+        callback(snapshots, changes, self._now())
+        return _Watch(self, listener)
+
+    def _notify(self, listeners: List[list], changed: Dict[Tuple[str, str], tuple]):
+        for listener in listeners:
+            query, callback, seen = listener
+            if not any(self._in_scope(query, collection_path) for collection_path, _ in changed):
+                continue
+            with self._lock:
+                snapshots = query._run()
+            current = {snapshot.reference.path: snapshot for snapshot in snapshots}
+            changes = []
+            for path, snapshot in current.items():
+                if path not in seen:
+                    changes.append(DocumentChange(ChangeType.ADDED, snapshot, -1, 0))
+                elif (seen[path].to_dict() or {}) != (snapshot.to_dict() or {}):
+                    changes.append(DocumentChange(ChangeType.MODIFIED, snapshot, 0, 0))
+            for path, snapshot in seen.items():
+                if path not in current:
+                    changes.append(DocumentChange(ChangeType.REMOVED, snapshot, 0, -1))
+            listener[2] = current
+            if changes:
+                callback(snapshots, changes, self._now())
+
+    @staticmethod
+    def _in_scope(query: MemoryQuery, collection_path: str) -> bool:
+        if query._all_descendants:
+            return collection_path.split('/')[-1] == query._path
+        return collection_path == query._path
+
+# ---------------------------------------------------------------------------
+# Snapshots
+# ---------------------------------------------------------------------------
+
+def _open(path: str, mode: str):
+    return gzip.open(path, mode) if path.endswith('.gz') else open(path, mode)
+
+def load_snapshot(client: MemoryClient, path: str) -> int:
+    """Load a dump into ``client``; returns the number of documents.
+
+    Accepts the JSON written by export_snapshot (``.json`` or ``.json.gz``:
+    collection path -> {doc id: fields}, or a list of documents carrying
+    an ``id``), SQLite mirror files written by ``--mirror`` and backup
+    files written by ``--action backup``.
+    """
+    if not os.path.exists(path):
+        raise BackendUnavailable(f"snapshot {path} not found")
+    started = time.monotonic()
+    try:
+        with open(path, 'rb') as fp:
+            header = fp.read(16)
+        if header.startswith(b'CCBACKUP'):
+            # Imported here: backup builds on FirestoreManager, which imports this module
+            from backup import BackupReader
+            for doc_path, data in BackupReader(path).iter_documents():
+                collection_path, doc_id = doc_path.rsplit('/', 1)
+                client.put_document(collection_path, doc_id, data)
+        elif header == b'SQLite format 3\x00':
+            conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+            try:
+                for collection_path, doc_id, raw in conn.execute('SELECT collection, id, data FROM documents'):
+                    data = json.loads(raw, object_hook=json_object_hook)
+                    data.pop('id', None)
+                    client.put_document(collection_path, doc_id, data)
+            finally:
+                conn.close()
+        else:
+            with _open(path, 'rt') as fp:
+                dump = json.load(fp, object_hook=json_object_hook)
+            for collection_path, docs in dump.get('collections', dump).items():
+                if isinstance(docs, list):
+                    docs = {doc.pop('id'): doc for doc in docs}
+                for doc_id, data in docs.items():
+                    client.put_document(collection_path, doc_id, data)
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        raise BackendUnavailable(f"could not load snapshot {path}: {e}") from e
+    count = client.document_count()
+    print(f"✅ Loaded {count} documents from {path} in {time.monotonic() - started:.2f}s")
+    return count
+
+def export_snapshot(db, path: str, collections: Optional[List[str]] = None,
+                    subcollections: Optional[List[str]] = None) -> int:
+    """Dump collections (default: every top-level one) and named subcollection groups to JSON"""
+    dump: Dict[str, Dict[str, Any]] = {}
+    names = collections or [collection.id for collection in db.collections()]
+    for name in names:
+        dump[name] = {snapshot.id: snapshot.to_dict() or {} for snapshot in db.collection(name).stream()}
+    for group in subcollections or []:
+        for snapshot in db.collection_group(group).stream():
+            collection_path = snapshot.reference.path.rsplit('/', 1)[0]
+            dump.setdefault(collection_path, {})[snapshot.id] = snapshot.to_dict() or {}
+    count = sum(len(docs) for docs in dump.values())
+    with _open(path, 'wt') as fp:
+        json.dump({'exported_at': time.time(), 'collections': dump}, fp, default=json_default)
+    print(f"💾 Exported {count} documents from {len(dump)} collections to {path}")
+    return count
@@ -0,0 +1,28 @@
+"""Fixtures for tests on the in-memory storage engine (no Firestore or SDK needed)"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import generate_campus
+from firestore_manager import FirestoreManager
+from storage_backend import MemoryClient
+
+SMALL_CAMPUS = {'departments': 2, 'subclasses_per_department': 2, 'subjects_per_department': 6,
+                'users': 20, 'notes': 150, 'assignments': 10}
+
+@pytest.fixture
+def fm():
+    return FirestoreManager(db=MemoryClient())
+
+@pytest.fixture
+def campus(fm):
+    """A manager over a small synthetic campus"""
+    generate_campus(fm, SMALL_CAMPUS)
+    return fm
+
+def documents(db, collection_name):
+    """``{id: data}`` of a collection"""
+    return {snapshot.id: snapshot.to_dict() for snapshot in db.collection(collection_name).stream()}
@@ -0,0 +1,53 @@
+from backup import CampusBackup
+from firestore_manager import DOWNLOAD_SHARD_COLLECTION, FirestoreManager
+from storage_backend import MemoryClient
+
+def dump(db):
+    """``{path: data}`` of every document, download counter shards included"""
+    docs = {snapshot.reference.path: snapshot.to_dict()
+            for collection in db.collections() for snapshot in collection.stream()}
+    docs.update({snapshot.reference.path: snapshot.to_dict()
+                 for snapshot in db.collection_group(DOWNLOAD_SHARD_COLLECTION).stream()})
+    return docs
+
+def test_restore_reproduces_the_backup(campus, tmp_path):
+    campus.migrate_download_counters()
+    path = str(tmp_path / 'campus.ccbak')
+    exported = CampusBackup(campus).export(path)
+    source = dump(campus.db)
+    assert exported['documents'] == len(source)
+
+    target = FirestoreManager(db=MemoryClient())
+    report = CampusBackup(target).restore(path)
+    assert report['writes']['failed'] == 0
+    assert dump(target.db) == source
+
+def test_department_restore_writes_only_that_department(campus, tmp_path):
+    campus.migrate_download_counters()
+    path = str(tmp_path / 'campus.ccbak')
+    CampusBackup(campus).export(path)
+    departments = {doc['id']: doc.get('department') for doc in campus.iter_subclasses(fields=['department'])}
+    source = dump(campus.db)
+
+    target = FirestoreManager(db=MemoryClient())
+    CampusBackup(target).restore(path, department='D00')
+    restored = dump(target.db)
+
+    def department(path, data):
+        collection_name, doc_id = path.split('/')[:2]
+        if collection_name == 'departments':
+            return doc_id
+        note = source.get(f"notes/{doc_id}") if len(path.split('/')) > 2 else data
+        return note.get('department') or departments.get(note.get('subclassId'))
+
+    assert restored
+    assert all(restored[path] == source[path] for path in restored)
+    assert {path for path, data in source.items() if department(path, data) == 'D00'} == set(restored)
+
+def test_dry_run_restore_writes_nothing(campus, tmp_path):
+    path = str(tmp_path / 'campus.ccbak')
+    CampusBackup(campus).export(path)
+    target = FirestoreManager(db=MemoryClient())
+    report = CampusBackup(target).restore(path, dry_run=True)
+    assert report['documents'] > 0
+    assert dump(target.db) == {}
@@ -0,0 +1,75 @@
+from firestore_manager import BatchWriter
+from storage_backend import MemoryClient
+
+ACCOUNTING = ('operations', 'batches', 'retries', 'failed')
+
+def accounting(writer):
+    return {key: writer.stats[key] for key in ACCOUNTING}
+
+class FlakyBatch:
+    def __init__(self, db, batch):
+        self.db = db
+        self.batch = batch
+
+    def __getattr__(self, name):
+        return getattr(self.batch, name)
+
+    def commit(self):
+        self.db.commits += 1
+        if self.db.failures:
+            self.db.failures -= 1
+            raise RuntimeError('UNAVAILABLE')
+        return self.batch.commit()
+
+class FlakyDB:
+    """A MemoryClient whose next ``failures`` batch commits raise"""
+
+    def __init__(self, failures=0):
+        self.client = MemoryClient()
+        self.failures = failures
+        self.commits = 0
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def batch(self):
+        return FlakyBatch(self, self.client.batch())
+
+def test_splits_writes_into_batches_of_500():
+    db = FlakyDB()
+    with BatchWriter(db) as writer:
+        for i in range(1200):
+            writer.set(db.collection('notes').document(f"n{i}"), {'i': i})
+    assert accounting(writer) == {'operations': 1200, 'batches': 3, 'retries': 0, 'failed': 0}
+    assert len(list(db.collection('notes').stream())) == 1200
+
+def test_retries_a_failed_batch():
+    db = FlakyDB(failures=2)
+    with BatchWriter(db, backoff=0) as writer:
+        writer.set(db.collection('notes').document('n1'), {'title': 'a'})
+    assert accounting(writer) == {'operations': 1, 'batches': 1, 'retries': 2, 'failed': 0}
+    assert db.collection('notes').document('n1').get().exists
+
+def test_counts_writes_that_fail_every_attempt():
+    db = FlakyDB(failures=10)
+    with BatchWriter(db, max_retries=2, backoff=0) as writer:
+        writer.set(db.collection('notes').document('n1'), {'title': 'a'})
+        writer.delete(db.collection('notes').document('n2'))
+    assert accounting(writer) == {'operations': 0, 'batches': 0, 'retries': 2, 'failed': 2}
+    assert db.commits == 3
+    assert not db.collection('notes').document('n1').get().exists
+
+def test_flush_callbacks_run_after_the_writes_commit():
+    db = FlakyDB()
+    seen = []
+    writer = BatchWriter(db)
+    writer.set(db.collection('notes').document('n1'), {'title': 'a'})
+    writer.on_flush('check', lambda: seen.append(db.collection('notes').document('n1').get().exists))
+    writer.on_flush('check', lambda: seen.append('replaced'))
+    assert seen == []
+    writer.close()
+    assert seen == ['replaced']
+    writer = BatchWriter(db)
+    writer.on_flush('check', lambda: seen.append(db.collection('notes').document('n1').get().exists))
+    writer.close()
+    assert seen == ['replaced', True]
@@ -0,0 +1,64 @@
+from conftest import documents
+from search_index import SearchIndex
+
+def seed(fm):
+    db = fm.db
+    db.collection('departments').document('CS').set({'code': 'CS', 'subclasses': ['cs-a', 'ee-a']})
+    db.collection('subjects').document('CS101').set({'code': 'CS101', 'name': 'Algorithms', 'department': 'CS'})
+    db.collection('subjects').document('EE101').set({'code': 'EE101', 'name': 'Circuits', 'department': 'EE'})
+    db.collection('subclasses').document('cs-a').set({'department': 'CS', 'semester': 1})
+    db.collection('subclasses').document('ee-a').set({'department': 'EE', 'semester': 1})
+    notes = {
+        'kept': {'subjectCode': 'CS101', 'subclassId': 'cs-a', 'title': 'graph algorithms'},
+        'unknown-subject': {'subjectCode': 'EE101', 'subclassId': 'cs-a', 'title': 'circuit algorithms'},
+        'unknown-subclass': {'subjectCode': 'CS101', 'subclassId': 'ee-a', 'title': 'sorting algorithms'},
+        'shared': {'subjectCode': 'CS101', 'subclassId': 'ee-a', 'title': 'hashing algorithms', 'isShared': True},
+    }
+    for i, (note_id, note) in enumerate(notes.items()):
+        db.collection('notes').document(note_id).set({**note, 'downloads': 5, 'createdAt': i})
+    db.collection('users').document('u1').set({'subclass': 'ee-a'})
+    fm.migrate_download_counters()
+    fm.rebuild_note_index()
+    fm.rebuild_subject_catalogs()
+    SearchIndex(fm).rebuild()
+
+def indexed_notes(db):
+    return {note_id for page in documents(db, 'noteVisibility').values()
+            for note_id in page.get('notes') or {}}
+
+def shards(db):
+    return {snapshot.reference.parent.parent.id for snapshot in db.collection_group('downloadShards').stream()}
+
+def test_dry_run_only_reports(fm):
+    seed(fm)
+    before = documents(fm.db, 'notes')
+    report = fm.cleanup_orphaned_data(dry_run=True)
+    assert report['orphaned_notes']['found'] == 2
+    assert documents(fm.db, 'notes') == before
+    assert shards(fm.db) == set(before)
+
+def test_apply_removes_orphans_and_their_derived_data(fm):
+    seed(fm)
+    report = fm.cleanup_orphaned_data(dry_run=False)
+    assert report['orphaned_subclasses']['found'] == 1
+    assert report['orphaned_subjects']['found'] == 1
+    assert sorted(report['orphaned_notes']['sample']) == ['unknown-subclass', 'unknown-subject']
+
+    remaining = {'kept', 'shared'}
+    assert set(documents(fm.db, 'notes')) == remaining
+    assert shards(fm.db) == remaining
+    assert indexed_notes(fm.db) == remaining
+    assert set(fm.download_counts([{'id': note_id, 'downloadShards': 0} for note_id in remaining]).values()) == {5}
+
+    search = SearchIndex(fm)
+    assert search.search('algorithms', subclass='cs-a') == sorted(remaining)
+    assert search.search('circuits', subjects=True) == []
+    assert set(documents(fm.db, 'subjectCatalogs')) == {'CS'}
+    assert 'subclass' not in documents(fm.db, 'users')['u1']
+    assert documents(fm.db, 'departments')['CS']['subclasses'] == ['cs-a']
+
+    # The derived data now matches a full rebuild
+    visibility = documents(fm.db, 'noteVisibility')
+    fm.rebuild_note_index()
+    assert documents(fm.db, 'noteVisibility').keys() <= visibility.keys()
+    assert indexed_notes(fm.db) == remaining
@@ -0,0 +1,85 @@
+import pytest
+
+from conftest import documents
+from notes_api import FEED_SORTS, SHARING_FILTERS, AuthError, FeedError, NotesFeed
+
+def visible(note, role, subclass, sharing):
+    if role != 'admin' and note.get('subclassId') != subclass and not note.get('isShared'):
+        return False
+    if sharing == 'shared':
+        return bool(note.get('isShared'))
+    if sharing == 'private':
+        return not note.get('isShared')
+    return True
+
+def walk(feed, limit=7, **params):
+    """IDs of every page of a feed, following the cursors"""
+    ids, cursor = [], None
+    while True:
+        page = feed.page(limit=limit, cursor=cursor, **params)
+        assert len(page['notes']) <= limit
+        ids += [note['id'] for note in page['notes']]
+        cursor = page['nextCursor']
+        if cursor is None:
+            return ids
+
+@pytest.fixture
+def feed(campus):
+    feed = NotesFeed(campus)
+    feed.start()
+    yield feed
+    feed.stop()
+
+@pytest.mark.parametrize('role', ['student', 'admin'])
+@pytest.mark.parametrize('sharing', SHARING_FILTERS)
+@pytest.mark.parametrize('sort_by', list(FEED_SORTS))
+def test_pages_match_the_sorted_feed(campus, feed, role, sharing, sort_by):
+    notes = documents(campus.db, 'notes')
+    subclass = sorted(notes.values(), key=lambda note: note['subclassId'])[0]['subclassId']
+    field, direction = FEED_SORTS[sort_by]
+    expected = sorted((note_id for note_id, note in notes.items()
+                       if visible(note, role, subclass, sharing) and field in note),
+                      key=lambda note_id: (notes[note_id][field], note_id), reverse=direction == 'DESCENDING')
+    assert walk(feed, role=role, subclass=subclass, sharing=sharing, sort_by=sort_by) == expected
+
+def test_filters_by_subject_and_tag(campus, feed):
+    notes = documents(campus.db, 'notes')
+    note = next(note for note in notes.values() if note.get('tags'))
+    expected = sorted((note_id for note_id, other in notes.items()
+                       if other.get('subjectCode') == note['subjectCode'] and note['tags'][0] in other.get('tags', [])),
+                      key=lambda note_id: (notes[note_id]['createdAt'], note_id), reverse=True)
+    assert walk(feed, role='admin', subject_code=note['subjectCode'], tag=note['tags'][0]) == expected
+
+def test_a_change_invalidates_only_the_pages_it_can_appear_in(campus, feed):
+    notes = documents(campus.db, 'notes')
+    private = [(note_id, note) for note_id, note in notes.items() if not note.get('isShared')]
+    mine, theirs = private[0], next(item for item in private if item[1]['subclassId'] != private[0][1]['subclassId'])
+    subclass = mine[1]['subclassId']
+
+    first = feed.page(subclass=subclass, sort_by='title')
+    assert not first['cached']
+    assert feed.page(subclass=subclass, sort_by='title')['cached']
+
+    campus.db.collection('notes').document(theirs[0]).update({'title': 'AAA other class'})
+    assert feed.page(subclass=subclass, sort_by='title')['cached']
+
+    campus.db.collection('notes').document(mine[0]).update({'title': 'AAA first'})
+    page = feed.page(subclass=subclass, sort_by='title')
+    assert not page['cached']
+    assert page['notes'][0]['id'] == mine[0]
+
+def test_rejects_invalid_parameters(feed):
+    with pytest.raises(FeedError):
+        feed.page(role='student', subclass=None)
+    with pytest.raises(FeedError):
+        feed.page(role='admin', sort_by='popular')
+    with pytest.raises(FeedError):
+        feed.page(role='admin', cursor='not-a-cursor')
+
+def test_viewer_comes_from_the_verified_users_profile(fm):
+    fm.db.collection('users').document('u1').set({'role': 'cr', 'subclass': 'cs-a'})
+    feed = NotesFeed(fm, verify_token=lambda token: {'uid': {'good': 'u1', 'orphan': 'u2'}[token]})
+    assert feed.viewer('good') == ('cr', 'cs-a')
+    for token in (None, 'forged', 'orphan'):
+        with pytest.raises(AuthError):
+            feed.viewer(token)
@@ -0,0 +1,64 @@
+import json
+
+from conftest import documents
+from firestore_manager import BatchWriter
+from rollover import run_rollover
+
+class FailingDB:
+    """Client whose batch commits always fail"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def batch(self):
+        batch = self.db.batch()
+        def commit():
+            raise RuntimeError('DEADLINE_EXCEEDED')
+        batch.commit = commit
+        return batch
+
+def seed(fm):
+    db = fm.db
+    db.collection('departments').document('CS').set({'code': 'CS', 'subclasses': ['cs-a', 'cs-b']})
+    db.collection('subclasses').document('cs-a').set({'name': 'cs-a', 'department': 'CS', 'semester': 1, 'year': 1})
+    db.collection('subclasses').document('cs-b').set({'name': 'cs-b', 'department': 'CS', 'semester': 8, 'year': 4})
+    for i in range(3):
+        db.collection('users').document(f"u{i}").set({'subclass': 'cs-a', 'role': 'student'})
+        db.collection('notes').document(f"n{i}").set({'title': f"notes {i}", 'subclassId': 'cs-a',
+                                                     'subjectCode': 'CS101', 'createdAt': i})
+
+def test_rerun_after_a_failed_phase_finishes_without_advancing_twice(fm, tmp_path, monkeypatch):
+    seed(fm)
+    fm.rebuild_note_index()
+    mapping = tmp_path / 'mapping.json'
+    mapping.write_text(json.dumps({'cs-a': 'cs-a2'}))
+
+    # The users phase (the second writer) fails on every attempt
+    writers = []
+    def bulk_writer(**kwargs):
+        db = FailingDB(fm.db) if len(writers) == 1 else fm.db
+        writers.append(BatchWriter(db, max_retries=0, **kwargs))
+        return writers[-1]
+    monkeypatch.setattr(fm, 'bulk_writer', bulk_writer)
+    assert run_rollover(fm, '2026-odd', mapping_path=str(mapping), dry_run=False) is None
+    assert documents(fm.db, 'subclasses')['cs-a2']['semester'] == 2
+    assert {user['subclass'] for user in documents(fm.db, 'users').values()} == {'cs-a'}
+    monkeypatch.undo()
+
+    assert run_rollover(fm, '2026-odd', mapping_path=str(mapping), dry_run=False) is not None
+    subclasses = documents(fm.db, 'subclasses')
+    assert subclasses['cs-a2']['semester'] == 2
+    assert subclasses['cs-a']['archived'] and subclasses['cs-a']['movedTo'] == 'cs-a2'
+    assert subclasses['cs-b']['archived']
+    assert {user['subclass'] for user in documents(fm.db, 'users').values()} == {'cs-a2'}
+    assert {note['subclassId'] for note in documents(fm.db, 'notes').values()} == {'cs-a2'}
+    assert documents(fm.db, 'departments')['CS']['subclasses'] == ['cs-a2']
+    index = documents(fm.db, 'noteVisibility')
+    assert sorted(index['cs-a2-0']['notes']) == ['n0', 'n1', 'n2']
+    assert not index.get('cs-a-0', {}).get('notes')
+
+    # A third run finds nothing left to do
+    assert run_rollover(fm, '2026-odd', mapping_path=str(mapping), dry_run=False) == {}
@@ -0,0 +1,51 @@
+import search_index
+from conftest import documents
+from search_index import SEARCH_MANIFEST_DOC, SearchIndex
+
+def add_note(fm, note_id, **fields):
+    note = {'title': f"linear algebra {note_id}", 'subjectCode': 'MA101', 'subclassId': 'cs-a', **fields}
+    fm.db.collection('notes').document(note_id).set(note)
+    return note
+
+def pages(fm):
+    return documents(fm.db, 'searchIndex')[SEARCH_MANIFEST_DOC]['pages']
+
+def test_rebuild_splits_shards_into_pages(fm, monkeypatch):
+    monkeypatch.setattr(search_index, 'SEARCH_PAGE_ENTRIES', 4)
+    for i in range(10):
+        add_note(fm, f"n{i:02}", isShared=i < 3)
+    search = SearchIndex(fm)
+    search.rebuild()
+
+    assert pages(fm)['cs-a'] == 3 and pages(fm)['_shared'] == 1
+    index = documents(fm.db, 'searchIndex')
+    listed = [doc_id for page in range(3) for doc_id in index[f"cs-a-{page}"]['terms']['algebra']]
+    assert sorted(listed) == [f"n{i:02}" for i in range(10)]
+    assert search.search('alg', subclass='cs-a') == [f"n{i:02}" for i in range(10)]
+    assert search.search('n07', subclass='cs-b') == []
+
+def test_full_pages_are_repartitioned(fm, monkeypatch):
+    monkeypatch.setattr(search_index, 'SEARCH_PAGE_MAX_ENTRIES', 4)
+    search = SearchIndex(fm)
+    search.rebuild()
+    notes = {f"n{i:02}": add_note(fm, f"n{i:02}") for i in range(12)}
+    for note_id, note in notes.items():
+        search.update_notes({note_id: note})
+
+    assert pages(fm)['cs-a'] >= 4
+    index = documents(fm.db, 'searchIndex')
+    page_ids = [f"cs-a-{page}" for page in range(pages(fm)['cs-a'])]
+    assert all(len({doc_id for postings in index[page]['terms'].values() for doc_id in postings}) <= 4
+               for page in page_ids)
+    assert search.search('linear', subclass='cs-a') == sorted(notes)
+
+    # Updates and deletes land on the pages the notes moved to
+    search.update_notes({'n03': None, 'n04': {**notes['n04'], 'title': 'graph theory'}},
+                        previous={'n03': notes['n03']})
+    assert search.search('linear', subclass='cs-a') == sorted(set(notes) - {'n03', 'n04'})
+    assert search.search('graph', subclass='cs-a') == ['n04']
+
+    # A rebuild lays the shard out again for its size
+    search.rebuild()
+    assert pages(fm)['cs-a'] == 1
+    assert set(documents(fm.db, 'searchIndex')) == {SEARCH_MANIFEST_DOC, 'cs-a-0', '_shared-0', '_subjects-0'}
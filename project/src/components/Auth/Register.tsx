@@ -1,7 +1,7 @@
 import React, { useState, useEffect } from 'react';
 import { motion } from 'framer-motion';
 import { createUserWithEmailAndPassword } from 'firebase/auth';
-import { doc, setDoc, collection, getDocs } from 'firebase/firestore';
+import { doc, setDoc, collection, getDocs, serverTimestamp } from 'firebase/firestore';
 import { Link } from 'react-router-dom';
 import { User, Mail, Lock, GraduationCap, Eye, EyeOff, Building } from 'lucide-react';
 import { auth, db } from '../../config/firebase';
@@ -53,7 +53,7 @@ const Register: React.FC = () => {
       const subclassList: Subclass[] = [];
       querySnapshot.forEach((doc) => {
         const data = doc.data() as Subclass;
-        if (data.department === departmentId) {
+        if (data.department === departmentId && !data.archived) {
           const { id, ...rest } = data;
           subclassList.push({ id: doc.id, ...rest });
         }
@@ -100,7 +100,8 @@ const Register: React.FC = () => {
         role: formData.role,
         department: formData.department,
         subclass: formData.subclass,
-        createdAt: new Date()
+        createdAt: new Date(),
+        updatedAt: serverTimestamp()
       });
 
       toast.success('Account created successfully!');
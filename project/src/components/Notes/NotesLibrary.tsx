@@ -14,13 +14,15 @@ import {
   XCircle,
   FileText
 } from 'lucide-react';
-import { collection, getDocs, query, where, orderBy, updateDoc, doc } from 'firebase/firestore';
+import { collection, getDocs, query, where, orderBy, updateDoc, doc, setDoc, increment, serverTimestamp } from 'firebase/firestore';
 import { db } from '../../config/firebase';
 import { useAuth } from '../../contexts/AuthContext';
 import { Note } from '../../types';
 import toast from 'react-hot-toast';
 
 
+const DOWNLOAD_SHARDS = 10;
+
 interface FilterOptions {
   subjectCode: string;
   isShared: string; // 'all', 'shared', 'private'
@@ -203,6 +205,16 @@ const NotesLibrary: React.FC = () => {
     setFilteredNotes(filtered);
   };
 
+  // Downloads go to a random counter shard so popular notes don't hit the
+  // per-document write limit; scripts/firestore_manager.py rolls the shards
+  // up into `downloads`
+  const recordDownload = (noteId: string) =>
+    setDoc(
+      doc(db, 'notes', noteId, 'downloadShards', String(Math.floor(Math.random() * DOWNLOAD_SHARDS))),
+      { count: increment(1), updatedAt: serverTimestamp() },
+      { merge: true }
+    );
+
   const handleDownload = async (note: Note) => {
     try {
       let downloadUrl = '';
@@ -225,9 +237,7 @@ const NotesLibrary: React.FC = () => {
       document.body.removeChild(a);
       
       // Update download count
-      await updateDoc(doc(db, 'notes', note.id), {
-        downloads: note.downloads + 1
-      });
+      await recordDownload(note.id);
       
       // Update local state
       setNotes(prevNotes => prevNotes.map(n => 
@@ -254,7 +264,7 @@ const NotesLibrary: React.FC = () => {
 
   const handleApproval = async (noteId: string, approved: boolean) => {
     try {
-      await updateDoc(doc(db, 'notes', noteId), { approved });
+      await updateDoc(doc(db, 'notes', noteId), { approved, updatedAt: serverTimestamp() });
       setNotes(prev => prev.map(note => 
         note.id === noteId ? { ...note, approved } : note
       ));
@@ -288,9 +298,7 @@ const NotesLibrary: React.FC = () => {
       
       // Update download count in Firestore
       try {
-        await updateDoc(doc(db, 'notes', note.id), {
-          downloads: note.downloads + 1
-        });
+        await recordDownload(note.id);
         
         // Update local state
         setNotes(prevNotes => prevNotes.map(n => 
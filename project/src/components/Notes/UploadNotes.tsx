@@ -1,14 +1,18 @@
 import React, { useState, useEffect } from 'react';
 import { useAuth } from '../../contexts/AuthContext';
 import { useSubjects } from '../../hooks/useSubjects';
-import { collection, addDoc } from 'firebase/firestore';
+import { collection, addDoc, doc, getDoc, serverTimestamp } from 'firebase/firestore';
 import { db } from '../../config/firebase';
 import { toast } from 'react-hot-toast';
 import { Upload, Check, X, FileText } from 'lucide-react';
 import { motion } from 'framer-motion';
+import CryptoJS from 'crypto-js';
 import { uploadFile } from '../../services/googleDrive';
 import { FileUploadResult } from '../Upload/FileUpload';
 
+// Files are hashed in slices of this size, so a large file is never read into memory whole
+const HASH_CHUNK_BYTES = 4 * 1024 * 1024;
+
 interface FormFields {
   title: string;
   description: string;
@@ -30,6 +34,7 @@ const UploadNotes: React.FC = () => {
   const [loading, setLoading] = useState(false);
   const [uploading, setUploading] = useState(false);
   const [uploadedFile, setUploadedFile] = useState<FileUploadResult | null>(null);
+  const [contentHash, setContentHash] = useState<string | null>(null);
   const [dragActive, setDragActive] = useState(false);
 
   const handleChange = (e: React.ChangeEvent<HTMLInputElement | HTMLTextAreaElement | HTMLSelectElement>) => {
@@ -77,11 +82,46 @@ const UploadNotes: React.FC = () => {
     }
   };
 
+  // SHA-256 of the file, matching the fileHashes index built by scripts/note_dedup.py.
+  // crypto.subtle can only digest a whole buffer, so the hash is computed incrementally.
+  const hashFile = async (file: File): Promise<string> => {
+    const sha256 = CryptoJS.algo.SHA256.create();
+    for (let start = 0; start < file.size; start += HASH_CHUNK_BYTES) {
+      const chunk = await file.slice(start, start + HASH_CHUNK_BYTES).arrayBuffer();
+      sha256.update(CryptoJS.lib.WordArray.create(new Uint8Array(chunk)));
+    }
+    return sha256.finalize().toString(CryptoJS.enc.Hex);
+  };
+
   const handleFileUpload = async (file: File) => {
     setUploading(true);
     try {
+      // Reuse the Drive file if the same content was uploaded before
+      let hash: string | null = null;
+      try {
+        hash = await hashFile(file);
+        const existing = await getDoc(doc(db, 'fileHashes', hash));
+        if (existing.exists() && existing.data().fileId) {
+          const data = existing.data();
+          setContentHash(hash);
+          setUploadedFile({
+            public_id: data.fileId,
+            secure_url: data.fileUrl || `https://drive.google.com/file/d/${data.fileId}/view`,
+            original_filename: file.name,
+            bytes: data.size || file.size,
+            format: file.name.split('.').pop() || '',
+            resource_type: 'raw'
+          });
+          toast.success('This file was already uploaded, reusing it');
+          return;
+        }
+      } catch (error) {
+        console.warn('Duplicate check skipped:', error);
+      }
+
       // Upload to Google Drive instead of Cloudinary
       const uploadResult = await uploadFile(file, 'notes');
+      setContentHash(hash);
       setUploadedFile(uploadResult);
       toast.success('File uploaded successfully!');
     } catch (error) {
@@ -135,12 +175,14 @@ const UploadNotes: React.FC = () => {
         driveFileId: uploadedFile.public_id,     // Store Google Drive fileId
         viewUrl: `https://drive.google.com/file/d/${uploadedFile.public_id}/preview`,
         downloadUrl: `https://drive.google.com/uc?export=download&id=${uploadedFile.public_id}`,
+        ...(contentHash ? { contentHash } : {}),
         subclassId: userProfile.subclass || '',
         isShared: formData.isShared,
         tags: formData.tags ? formData.tags.split(',').map(tag => tag.trim()) : [],
         downloads: 0,
         approved: userProfile.role === 'admin' || userProfile.role === 'cr',
-        createdAt: new Date()
+        createdAt: new Date(),
+        updatedAt: serverTimestamp()
       };
       
       await addDoc(collection(db, 'notes'), noteData);
@@ -156,6 +198,7 @@ const UploadNotes: React.FC = () => {
         tags: ''
       });
       setUploadedFile(null);
+      setContentHash(null);
       
     } catch (error) {
       console.error('Error uploading notes:', error);
@@ -249,7 +292,7 @@ const UploadNotes: React.FC = () => {
                 {uploadedFile && (
                   <button
                     type="button"
-                    onClick={() => setUploadedFile(null)}
+                    onClick={() => { setUploadedFile(null); setContentHash(null); }}
                     className="mt-2 text-sm text-red-500 hover:underline"
                   >
                     <X className="w-4 h-4 inline-block mr-1" />
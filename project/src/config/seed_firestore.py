@@ -1,11 +1,12 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
+import argparse
+import logging
+import os
+import sys
 
-# Path to your Firebase service account key
-cred = credentials.Certificate('serviceAccountKey.json')
-firebase_admin.initialize_app(cred)
-
-db = firestore.client()
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'scripts'))
+from firestore_manager import FirestoreManager
+from instrumentation import Profiler, profiled
+from storage_backend import BackendUnavailable
 
 departments = [
     {
@@ -42,14 +43,55 @@ subclasses = [
     {'id': 'MECH-2', 'name': 'MECH-2', 'department': 'Mechanical', 'year': 2}
 ]
 
-# Add departments
-for dept in departments:
-    db.collection('departments').document(dept['id']).set(dept)
-    print(f"Added department: {dept['name']}")
+def seed(fm: FirestoreManager) -> bool:
+    """Write every department and subclass through one BatchWriter; False if any write failed"""
+    writer = fm.bulk_writer()
+    for collection_name, docs in (('departments', departments), ('subclasses', subclasses)):
+        for doc in docs:
+            writer.set(fm.db.collection(collection_name).document(doc['id']), doc)
+    stats = writer.close()
+    if stats['failed']:
+        print(f"❌ {stats['failed']} writes failed; re-run the seed to retry them")
+        return False
+    for collection_name, docs in (('departments', departments), ('subclasses', subclasses)):
+        print(f"Added {len(docs)} {collection_name}: {', '.join(doc['name'] for doc in docs)}")
+    return True
+
+def main():
+    parser = argparse.ArgumentParser(description='Seed departments and subclasses')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print the Firestore writes/latency seeding cost')
+    parser.add_argument('--log-calls', action='store_true',
+                        help='Log every Firestore call as a JSON line on stderr')
+    parser.add_argument('--metrics-file',
+                        help='Write call metrics as a Prometheus textfile to this path')
+    parser.add_argument('--openmetrics', action='store_true',
+                        help='Write --metrics-file in OpenMetrics format instead')
+    args = parser.parse_args()
+
+    profiler = None
+    if args.profile or args.log_calls or args.metrics_file:
+        if args.log_calls:
+            logging.basicConfig(level=logging.INFO, format='%(message)s')
+        profiler = Profiler(log_calls=args.log_calls)
+    # Path to your Firebase service account key
+    fm = FirestoreManager('serviceAccountKey.json', profiler=profiler)
+
+    try:
+        with profiled(profiler, 'seed'):
+            seeded = seed(fm)
+    except BackendUnavailable:
+        sys.exit(1)
+    if seeded:
+        print('Seeding complete!')
 
-# Add subclasses
-for sub in subclasses:
-    db.collection('subclasses').document(sub['id']).set(sub)
-    print(f"Added subclass: {sub['name']}")
+    if profiler is not None:
+        if args.profile:
+            profiler.print_summary()
+        if args.metrics_file:
+            profiler.write_metrics(args.metrics_file, openmetrics=args.openmetrics)
+    if not seeded:
+        sys.exit(1)
 
-print('Seeding complete!')
\ No newline at end of file
+if __name__ == '__main__':
+    main()
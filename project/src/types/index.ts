@@ -26,6 +26,7 @@ export interface Subclass {
   semester: number;
   capacity?: number; // Added
   crId?: string;
+  archived?: boolean; // Set when a rollover graduates or renames the subclass
   createdAt: Date;
 }
 
@@ -69,7 +70,8 @@ export interface Note {
   subclassId: string;
   isShared: boolean;
   tags: string[];
-  downloads: number;
+  downloads: number; // Rolled up from the downloadShards subcollection
+  downloadShards?: number; // Set once the note's count is migrated to sharded counters
   approved: boolean;
   createdAt: Date;
   
@@ -77,6 +79,7 @@ export interface Note {
   driveFileId?: string;
   viewUrl?: string;
   downloadUrl?: string;
+  contentHash?: string; // SHA-256 of the file, key of the fileHashes index
 }
 
 export interface TimetableSlot {
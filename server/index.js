@@ -177,8 +177,13 @@ app.get('/api/files/:fileId', async (req, res) => {
       embedLink: `https://drive.google.com/file/d/${file.data.id}/preview`
     });
   } catch (error) {
+    // Drive answers 404 for deleted files and IDs that never existed
+    const driveStatus = Number(error.code || (error.response && error.response.status)) || null;
+    if (driveStatus === 404) {
+      return res.status(404).json({ error: 'File not found', fileId: req.params.fileId });
+    }
     console.error('Get file error:', error);
-    res.status(500).json({ error: 'Failed to get file information' });
+    res.status(500).json({ error: 'Failed to get file information', driveStatus });
   }
 });
 